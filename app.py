@@ -1,25 +1,63 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from config import BOT_TOKEN
-from db import create_tables
+from aiogram.fsm.storage.base import BaseStorage
+from config import BOT_TOKEN, BOT_MODE
+from db import create_tables, engine
+from fsm_storage import SQLiteStorage
 from handlers.common import common_router
 from handlers.user_handlers import user_handlers_router
+from metrics import (instrument_engine, register_cache_gauges,
+                     register_fsm_gauges, register_outbound_gauges,
+                     start_metrics_server)
+from middlewares import (MetricsMiddleware, OutboundQueue,
+                         TelegramCallsMiddleware, UserRegistrationMiddleware)
 
 
 logging.basicConfig(level=logging.INFO)
 
 
-async def main():
-    await create_tables()
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+def create_dispatcher(storage: BaseStorage | None = None) -> Dispatcher:
+    '''storage=None — состояния в памяти процесса (MemoryStorage)'''
+    dp = Dispatcher(storage=storage)
+
+    # Внутренний middleware апдейта: срабатывает для любого события
+    # с автором, до хендлеров всех роутеров
+    dp.update.middleware(UserRegistrationMiddleware())
+    # Метрики по хендлерам (время, SQL, запросы к Telegram)
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
 
     # Регистрация роутеров
     dp.include_router(user_handlers_router)
     dp.include_router(common_router)
+    return dp
+
+
+async def main():
+    await create_tables()
+    bot = Bot(token=BOT_TOKEN)
+    # Счётчик запросов к Telegram стоит перед очередью:
+    # повторы после 429 не считаются отдельными вызовами
+    bot.session.middleware(TelegramCallsMiddleware())
+    # Все исходящие сообщения — через очередь с лимитами Telegram
+    outbound = OutboundQueue()
+    bot.session.middleware(outbound)
+    # Состояния диалогов переживают перезапуск, брошенные — истекают
+    storage = SQLiteStorage()
+    dp = create_dispatcher(storage)
+
+    instrument_engine(engine.sync_engine)
+    register_cache_gauges()
+    register_outbound_gauges(outbound)
+    register_fsm_gauges(storage)
+    await start_metrics_server()
 
-    await dp.start_polling(bot)
+    if BOT_MODE == 'webhook':
+        from webhook import run_webhook
+        await run_webhook(bot, dp)
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+'''
+Сравнение профилей движка БД (db.ENGINE_PROFILES).
+
+Для каждого профиля создаётся временная БД с каталогом рецептов,
+затем измеряется:
+    запись — параллельные короткие транзакции (добавление в избранное);
+    чтение — параллельные выборки рецепта по id на фоне пишущей задачи.
+
+Запуск из корня проекта:
+    python -m benchmarks.db_profiles --recipes 5000 --ops 2000
+'''
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from db import (Base, ENGINE_PROFILES, Recipe, User, favorites_table,
+                create_engine_for)
+
+
+async def seed(session_factory, recipes: int, users: int):
+    async with session_factory() as db:
+        await db.execute(insert(User), [
+            {'id': user_id, 'username': f'user{user_id}'}
+            for user_id in range(1, users + 1)
+        ])
+        await db.execute(insert(Recipe), [
+            {
+                'name': f'Recipe {i}',
+                'ingredients': 'Salt (1 tsp)\nEggs (2)',
+                'instructions': 'Mix and bake. ' * 20,
+                'name_ru': f'Рецепт {i}',
+                'ingredients_ru': 'Соль (1 ч. л.)\nЯйца (2)',
+                'instructions_ru': 'Смешать и запечь. ' * 20,
+            }
+            for i in range(recipes)
+        ])
+        await db.commit()
+
+
+async def run_parallel(worker, ops: int, concurrency: int) -> float:
+    '''Выполняет ops операций в concurrency задачах, возвращает оп/с'''
+    per_task = ops // concurrency
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(per_task) for _ in range(concurrency)))
+    return per_task * concurrency / (time.perf_counter() - started)
+
+
+async def bench_profile(
+        profile: str, recipes: int, ops: int, concurrency: int
+        ) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f'sqlite+aiosqlite:///{os.path.join(tmp, "bench.db")}'
+        db_engine = create_engine_for(profile, url, echo=False)
+        session_factory = sessionmaker(
+            bind=db_engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with db_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await seed(session_factory, recipes, users=concurrency)
+
+        async def add_favorite():
+            async with session_factory() as db:
+                await db.execute(insert(favorites_table).values(
+                    user_id=random.randint(1, concurrency),
+                    recipe_id=random.randint(1, recipes)
+                ))
+                await db.commit()
+
+        async def writer(count: int):
+            for _ in range(count):
+                await add_favorite()
+
+        async def reader(count: int):
+            for _ in range(count):
+                async with session_factory() as db:
+                    await db.execute(select(Recipe).where(
+                        Recipe.id == random.randint(1, recipes)
+                    ))
+
+        writes = await run_parallel(writer, ops, concurrency)
+
+        # Чтение под фоновой записью — так бот работает при импорте каталога
+        stop = asyncio.Event()
+
+        async def background_writer():
+            while not stop.is_set():
+                await add_favorite()
+
+        background = asyncio.create_task(background_writer())
+        reads = await run_parallel(reader, ops, concurrency)
+        stop.set()
+        await background
+
+        await db_engine.dispose()
+    return writes, reads
+
+
+async def main(recipes: int, ops: int, concurrency: int):
+    print(f'{"профиль":<12} {"запись, оп/с":>14} {"чтение, оп/с":>14}')
+    for profile in ENGINE_PROFILES:
+        writes, reads = await bench_profile(profile, recipes, ops, concurrency)
+        print(f'{profile:<12} {writes:>14.0f} {reads:>14.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение профилей БД')
+    parser.add_argument('--recipes', type=int, default=5000)
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='операций в каждом замере')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='параллельных задач')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args.recipes, args.ops, args.concurrency))
@@ -0,0 +1,385 @@
+'''
+Нагрузочный прогон бота целиком: апдейты проходят через настоящий
+Dispatcher (create_dispatcher из app.py) и роутеры, а запросы к Telegram
+перехватывает фейковая сессия aiogram, так что наружу ничего не уходит.
+
+Для каждой комбинации числа пользователей и размера каталога создаётся
+временная БД с синтетическим каталогом (записывается тем же кодом, что
+и импорт), затем пользователи параллельно проходят сценарии:
+/start, поиск по названию и по ингредиентам, случайный рецепт,
+избранное с листанием страниц, список покупок с отметками «куплено».
+Пользователь нажимает кнопки из последних ответов бота, как в Telegram.
+
+Отчёт — пропускная способность и p50/p95/p99 задержки по хендлерам.
+
+Запуск из корня проекта:
+    python -m benchmarks.load --users 10,100 --recipes 1000,10000 --steps 30
+'''
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+from contextvars import ContextVar
+from typing import Any
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, Update
+import callbacks as cb
+import db
+from app import create_dispatcher
+from cache import recipe_cache
+from catalog import catalog_watcher
+from fill_db import content_hash, write_batch
+from fsm_storage import SQLiteStorage
+from metrics import current_stats
+from sampler import recipe_sampler
+
+
+DISHES = ['Суп', 'Салат', 'Пирог', 'Рагу', 'Плов', 'Запеканка', 'Паста',
+          'Котлеты', 'Омлет', 'Каша', 'Жаркое', 'Карри', 'Рулет', 'Блины']
+STYLES = ['по-домашнему', 'по-тайски', 'с сыром', 'с грибами', 'острый',
+          'весенний', 'сливочный', 'с травами', 'по-итальянски', 'быстрый']
+INGREDIENTS = ['Курица', 'Говядина', 'Картофель', 'Лук', 'Морковь', 'Чеснок',
+               'Сыр', 'Молоко', 'Мука', 'Яйца', 'Рис', 'Помидоры', 'Сливки',
+               'Грибы', 'Перец', 'Соль', 'Сахар', 'Масло', 'Лимон', 'Базилик']
+MEASURES = ['100 г', '200 г', '1 кг', '2 ст. л.', '1 ч. л.', '1 стакан',
+            '2', '3 зубчика', 'по вкусу', '500 мл']
+
+# Сценарии и их доля в потоке действий пользователя
+SCENARIOS = {
+    'start': 1,
+    'search_by_name': 3,
+    'search_by_ingredients': 2,
+    'random_recipe': 3,
+    'favorites': 2,
+    'shopping': 3,
+}
+
+
+def make_recipe(rng: random.Random, number: int) -> dict:
+    '''Синтетический рецепт в том виде, в каком его пишет импорт'''
+    name_ru = f'{rng.choice(DISHES)} {rng.choice(STYLES)} №{number}'
+    ingredients_ru = '\n'.join(
+        f'{name} ({rng.choice(MEASURES)})'
+        for name in rng.sample(INGREDIENTS, rng.randint(4, 10))
+    )
+    instructions_ru = ' '.join(
+        f'Шаг {step}: {rng.choice(INGREDIENTS).lower()} '
+        f'{rng.choice(["нарезать", "обжарить", "смешать", "запечь"])}.'
+        for step in range(1, rng.randint(5, 15))
+    )
+    recipe = {
+        'source_id': f'load{number}',
+        'name': f'Dish {number}',
+        'ingredients': ingredients_ru,
+        'instructions': instructions_ru,
+        'image_url': f'https://example.com/{number}.jpg',
+        'cuisine': 'Synthetic',
+        'name_ru': name_ru,
+        'ingredients_ru': ingredients_ru,
+        'instructions_ru': instructions_ru,
+    }
+    recipe['content_hash'] = content_hash(recipe)
+    return recipe
+
+
+async def seed_catalog(recipes: int, seed: int = 0, batch_size: int = 2000):
+    rng = random.Random(seed)
+    for start in range(0, recipes, batch_size):
+        batch = [
+            make_recipe(rng, number)
+            for number in range(start, min(start + batch_size, recipes))
+        ]
+        await write_batch(batch, None)
+
+
+class LoadSession(BaseSession):
+    '''
+    Сессия aiogram без сети: отвечает на запросы бота правдоподобными
+    объектами и запоминает последние кнопки в каждом чате
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.buttons = {}
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(
+            self, bot: Bot, method: TelegramMethod, timeout: int | None = None
+            ) -> Any:
+        self.calls += 1
+        chat_id = getattr(method, 'chat_id', None)
+        markup = getattr(method, 'reply_markup', None)
+        if chat_id is not None and markup is not None:
+            self.buttons[chat_id] = [
+                button.callback_data
+                for row in getattr(markup, 'inline_keyboard', [])
+                for button in row if button.callback_data
+            ]
+
+        if method.__returning__ is not Message:
+            return True
+        data = {
+            'message_id': getattr(method, 'message_id', None)
+            or next(self._message_ids),
+            'date': 0,
+            'chat': {'id': chat_id or 0, 'type': 'private'},
+            'text': getattr(method, 'text', None) or '',
+        }
+        if type(method).__name__ == 'SendPhoto':
+            data['photo'] = [{'file_id': 'load', 'file_unique_id': 'load',
+                              'width': 1, 'height': 1}]
+        return Message.model_validate(data, context={'bot': bot})
+
+
+_handler_name: ContextVar[dict] = ContextVar('handler_name')
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    '''Запоминает, какой хендлер обработал апдейт'''
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            # Имя уточняется роутером колбэков (metrics.label_handler)
+            holder = _handler_name.get(None)
+            if holder is not None:
+                holder['name'] = current_stats.get().handler
+
+
+class SimulatedUser:
+    '''Пользователь, который пишет боту и нажимает кнопки из его ответов'''
+
+    def __init__(
+            self, user_id: int, bot: Bot, dp, session: LoadSession,
+            rng: random.Random, latencies: dict
+            ):
+        self.user_id = user_id
+        self.bot = bot
+        self.dp = dp
+        self.session = session
+        self.rng = rng
+        self.latencies = latencies
+        self._ids = itertools.count(1)
+
+    @property
+    def buttons(self) -> list[str]:
+        return self.session.buttons.get(self.user_id, [])
+
+    def _button(self, payload_type: type[cb.Payload]) -> str | None:
+        prefix = payload_type.prefix() + cb.SEPARATOR
+        matching = [data for data in self.buttons if data.startswith(prefix)]
+        return self.rng.choice(matching) if matching else None
+
+    def _author(self) -> dict:
+        return {'id': self.user_id, 'is_bot': False, 'first_name': 'Load'}
+
+    async def _feed(self, payload: dict):
+        update = Update.model_validate(
+            {'update_id': next(self._ids), **payload},
+            context={'bot': self.bot}
+        )
+        holder = {'name': 'unhandled'}
+        token = _handler_name.set(holder)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        finally:
+            elapsed = time.perf_counter() - started
+            _handler_name.reset(token)
+            self.latencies.setdefault(holder['name'], []).append(elapsed)
+
+    async def send(self, text: str):
+        message = {
+            'message_id': next(self._ids), 'date': 0,
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': self._author(), 'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{
+                'type': 'bot_command', 'offset': 0,
+                'length': len(text.split()[0])
+            }]
+        await self._feed({'message': message})
+
+    async def click(self, data: str | None):
+        if data is None:
+            return
+        await self._feed({'callback_query': {
+            'id': str(next(self._ids)), 'chat_instance': 'load',
+            'from': self._author(), 'data': data,
+            'message': {
+                'message_id': next(self._ids), 'date': 0,
+                'chat': {'id': self.user_id, 'type': 'private'},
+                'text': 'load',
+            },
+        }})
+
+    async def start(self):
+        await self.send('/start')
+
+    async def search_by_name(self):
+        await self.click(cb.FindRecipe().pack())
+        await self.send(self.rng.choice(DISHES + STYLES))
+        if self.rng.random() < 0.3:
+            await self.click(self._button(cb.SearchPage))
+        await self.send('1')
+
+    async def search_by_ingredients(self):
+        await self.click(cb.ByIngredients().pack())
+        await self.send(', '.join(self.rng.sample(INGREDIENTS, 3)))
+        await self.send('1')
+
+    async def random_recipe(self):
+        await self.click(cb.RandomRecipe().pack())
+        if self.rng.random() < 0.5:
+            await self.click(self._button(cb.AddFavorite))
+        if self.rng.random() < 0.5:
+            await self.click(self._button(cb.AddToShoppingList))
+
+    async def favorites(self):
+        await self.click(cb.Favorites().pack())
+        for _ in range(self.rng.randint(0, 3)):
+            await self.click(self._button(cb.FavoritesPage))
+        await self.click(self._button(cb.ViewRecipe))
+
+    async def shopping(self):
+        await self.click(cb.ShoppingList().pack())
+        for _ in range(self.rng.randint(1, 5)):
+            await self.click(self._button(cb.TogglePurchased))
+        if self.rng.random() < 0.3:
+            await self.click(self._button(cb.ShoppingPage))
+
+    async def run(self, steps: int):
+        names = list(SCENARIOS)
+        weights = list(SCENARIOS.values())
+        await self.start()
+        for _ in range(steps):
+            scenario = self.rng.choices(names, weights)[0]
+            await getattr(self, scenario)()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    '''Перцентиль по ближайшему рангу; values отсортирован'''
+    index = min(len(values) - 1, max(0, int(len(values) * fraction + 0.5) - 1))
+    return values[index]
+
+
+def reset_catalog_caches():
+    '''Сбрасывает кеши процесса, построенные по предыдущему каталогу'''
+    recipe_cache.invalidate()
+    catalog_watcher.invalidate()
+    recipe_sampler.rebuild([])
+
+
+def create_load_dispatcher(storage: SQLiteStorage):
+    '''Dispatcher бота с учётом хендлеров. Роутеры подключаются один раз'''
+    dp = create_dispatcher(storage)
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+    return dp
+
+
+async def run_load(
+        dp, users: int, recipes: int, steps: int, run_number: int, seed: int
+        ) -> tuple[dict, float, int]:
+    '''Один прогон: (задержки по хендлерам, секунды, число апдейтов)'''
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f'sqlite+aiosqlite:///{os.path.join(tmp, "load.db")}'
+        db_engine = db.create_engine_for(url=url, echo=False)
+        # Все модули бота открывают сессии через db.SessionLocal
+        db.SessionLocal.configure(bind=db_engine)
+        try:
+            await db.create_tables(db_engine)
+            await seed_catalog(recipes, seed)
+            reset_catalog_caches()
+
+            session = LoadSession()
+            # Свой id бота на прогон: file_id фото привязаны к боту
+            bot = Bot(f'{run_number}:load', session=session)
+
+            latencies = {}
+            rng = random.Random(seed)
+            # Разные id пользователей в разных прогонах — кеши по
+            # пользователям не переносятся между каталогами
+            simulated = [
+                SimulatedUser(
+                    run_number * 10_000_000 + user, bot, dp, session,
+                    random.Random(rng.random()), latencies
+                )
+                for user in range(1, users + 1)
+            ]
+            started = time.perf_counter()
+            await asyncio.gather(*(user.run(steps) for user in simulated))
+            elapsed = time.perf_counter() - started
+        finally:
+            db.SessionLocal.configure(bind=db.engine)
+            await db_engine.dispose()
+    total = sum(len(values) for values in latencies.values())
+    return latencies, elapsed, total
+
+
+def print_report(
+        users: int, recipes: int, latencies: dict, elapsed: float, total: int
+        ):
+    print(f'\nПользователей: {users}, рецептов: {recipes}, '
+          f'апдейтов: {total}, {total / elapsed:.0f} апдейтов/с')
+    print(f'{"хендлер":<36} {"кол-во":>7} {"p50, мс":>8} '
+          f'{"p95, мс":>8} {"p99, мс":>8}')
+    for name, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        values.sort()
+        print(f'{name:<36} {len(values):>7} '
+              f'{percentile(values, 0.50) * 1000:>8.1f} '
+              f'{percentile(values, 0.95) * 1000:>8.1f} '
+              f'{percentile(values, 0.99) * 1000:>8.1f}')
+
+
+async def main(users: list[int], recipes: list[int], steps: int, seed: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        # Состояния диалогов — в том же хранилище, что и у бота
+        storage = SQLiteStorage(os.path.join(tmp, 'fsm.db'))
+        dp = create_load_dispatcher(storage)
+        try:
+            for run_number, (user_count, recipe_count) in enumerate(
+                    itertools.product(users, recipes), start=1):
+                latencies, elapsed, total = await run_load(
+                    dp, user_count, recipe_count, steps, run_number, seed
+                )
+                print_report(
+                    user_count, recipe_count, latencies, elapsed, total
+                )
+        finally:
+            await storage.close()
+
+
+def int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(',') if item]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон бота')
+    parser.add_argument('--users', type=int_list, default=[10, 100],
+                        help='числа пользователей через запятую')
+    parser.add_argument('--recipes', type=int_list, default=[1000],
+                        help='размеры каталога через запятую')
+    parser.add_argument('--steps', type=int, default=20,
+                        help='сценариев на пользователя')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args.users, args.recipes, args.steps, args.seed))
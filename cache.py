@@ -0,0 +1,162 @@
+'''
+Кеши в памяти процесса бота
+'''
+
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+from sqlalchemy.ext.asyncio import AsyncSession
+from cards import RecipeCard, render_recipe_card
+from catalog import catalog_watcher
+from config import RECIPE_CACHE_SIZE, RECIPE_CACHE_MAX_BYTES
+from db import Recipe
+
+
+class LRUCache:
+    '''
+    Ограниченный LRU-кеш. Вытесняет давно неиспользуемые записи,
+    когда превышено число записей или суммарный размер (если задан sizeof)
+    '''
+
+    def __init__(
+            self, max_items: int, max_bytes: int | None = None,
+            sizeof: Callable[[Any], int] | None = None
+            ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or sys.getsizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.pop(key)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Запись больше всего кеша — не храним её
+            return
+        self._data[key] = value
+        self._sizes[key] = size
+        self.current_bytes += size
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        self.current_bytes -= self._sizes.pop(key)
+        return self._data.pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.current_bytes = 0
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_items
+            or (self.max_bytes is not None
+                and self.current_bytes > self.max_bytes)
+        ):
+            key, _ = self._data.popitem(last=False)
+            self.current_bytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'items': len(self._data),
+            'bytes': self.current_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def recipe_size(recipe: Recipe) -> int:
+    '''Примерный объём рецепта в памяти (в основном — его тексты)'''
+    size = sys.getsizeof(recipe)
+    for column in Recipe.__table__.columns:
+        size += sys.getsizeof(getattr(recipe, column.key, None))
+    return size
+
+
+class RecipeCache:
+    '''
+    Кеш рецептов по id. Каталог меняется только при запуске fill_db.py,
+    поэтому кеш полностью сбрасывается при смене версии каталога.
+    Рецепты в кеше отвязаны от сессий (detached), их нельзя
+    добавлять в relationship-коллекции.
+    Рядом хранятся готовые карточки рецептов (см. cards.py),
+    они сбрасываются вместе с рецептами
+    '''
+
+    def __init__(
+            self, max_items: int = RECIPE_CACHE_SIZE,
+            max_bytes: int = RECIPE_CACHE_MAX_BYTES
+            ):
+        self._cache = LRUCache(max_items, max_bytes, sizeof=recipe_size)
+        self._cards = LRUCache(
+            max_items, max_bytes, sizeof=lambda card: card.size()
+        )
+        self._version = None
+
+    async def get(self, db: AsyncSession, recipe_id: int) -> Recipe | None:
+        version = await catalog_watcher.current_version(db)
+        if version != self._version:
+            self._cache.clear()
+            self._cards.clear()
+            self._version = version
+
+        recipe = self._cache.get(recipe_id)
+        if recipe is None:
+            recipe = await db.get(Recipe, recipe_id)
+            if recipe is None:
+                return None
+            db.expunge(recipe)
+            self._cache.set(recipe_id, recipe)
+        return recipe
+
+    def card(self, recipe: Recipe) -> RecipeCard:
+        '''Карточка рецепта: отрисовывается один раз, дальше из кеша'''
+        card = self._cards.get(recipe.id)
+        if card is None:
+            card = render_recipe_card(recipe)
+            self._cards.set(recipe.id, card)
+        return card
+
+    def invalidate(self, recipe_id: int | None = None):
+        if recipe_id is None:
+            self._cache.clear()
+            self._cards.clear()
+        else:
+            self._cache.pop(recipe_id)
+            self._cards.pop(recipe_id)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    def card_stats(self) -> dict:
+        return self._cards.stats()
+
+
+recipe_cache = RecipeCache()
@@ -0,0 +1,273 @@
+'''
+Данные инлайн-кнопок (callback_data): типизированные, компактные
+и с версией формата.
+
+Кнопка кодируется как "<код><версия>:<поле>:<поле>...", например
+"tp1:42:0" — отметить строку 42 списка покупок на странице 0.
+Хендлер выбирается одним поиском в словаре по префиксу до первого ":",
+а поля разбираются по аннотациям класса ещё до вызова хендлера,
+поэтому испорченные данные отбрасываются без обращения к БД.
+
+Если формат действия меняется, версия увеличивается, а класс старой
+версии остаётся в таблице, пока в чатах живут его кнопки.
+Кнопки первого формата ("toggle_purchased:42:0") разбираются как
+legacy-префиксы тех же действий
+'''
+
+from dataclasses import MISSING, dataclass, fields
+from typing import Any, Awaitable, Callable, ClassVar, get_type_hints
+from favorites import page_cursor
+
+
+# Ограничение Telegram на callback_data в байтах
+MAX_CALLBACK_DATA = 64
+SEPARATOR = ':'
+
+
+class CallbackDataError(ValueError):
+    '''callback_data не соответствует формату действия'''
+
+
+def _non_negative_int(value: str) -> int:
+    if not value.isascii() or not value.isdigit():
+        raise CallbackDataError(f'ожидалось число: {value!r}')
+    return int(value)
+
+
+def _text(value: str) -> str:
+    return value
+
+
+CONVERTERS = {int: _non_negative_int, str: _text}
+
+
+@dataclass(frozen=True)
+class Payload:
+    '''
+    Базовый класс данных кнопки. Поля — int или str;
+    поле со значением по умолчанию необязательно и может
+    отсутствовать в конце строки
+    '''
+    code: ClassVar[str]
+    version: ClassVar[int] = 1
+    # Префиксы кнопок первого формата с той же раскладкой полей
+    legacy: ClassVar[tuple[str, ...]] = ()
+    # [(имя, конвертер, обязательное)] — строится при первом разборе
+    _spec: ClassVar[list | None] = None
+
+    @classmethod
+    def prefix(cls) -> str:
+        return f'{cls.code}{cls.version}'
+
+    @classmethod
+    def spec(cls) -> list[tuple[str, Callable[[str], Any], bool]]:
+        if cls.__dict__.get('_spec') is None:
+            hints = get_type_hints(cls)
+            spec = []
+            for field in fields(cls):
+                base = hints[field.name]
+                # int | None -> int
+                args = [arg for arg in getattr(base, '__args__', ())
+                        if arg is not type(None)]
+                converter = CONVERTERS[args[0] if args else base]
+                required = field.default is MISSING
+                spec.append((field.name, converter, required))
+            cls._spec = spec
+        return cls._spec
+
+    def pack(self) -> str:
+        parts = [self.prefix()]
+        for field in fields(self):
+            value = getattr(self, field.name)
+            parts.append('' if value is None else str(value))
+        # Незаданные необязательные поля в конце не передаются
+        while parts[-1] == '':
+            parts.pop()
+        data = SEPARATOR.join(parts)
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise CallbackDataError(f'callback_data длиннее 64 байт: {data}')
+        return data
+
+    @classmethod
+    def unpack(cls, values: list[str]) -> 'Payload':
+        spec = cls.spec()
+        if len(values) > len(spec):
+            raise CallbackDataError('лишние поля')
+        kwargs = {}
+        for position, (name, converter, required) in enumerate(spec):
+            if position < len(values) and values[position] != '':
+                kwargs[name] = converter(values[position])
+            elif required:
+                raise CallbackDataError(f'нет поля {name}')
+        try:
+            return cls(**kwargs)
+        except (TypeError, ValueError, KeyError) as e:
+            raise CallbackDataError(str(e)) from e
+
+
+@dataclass(frozen=True)
+class MainMenu(Payload):
+    code = 'mm'
+    legacy = ('main_menu_inline',)
+
+
+@dataclass(frozen=True)
+class RandomRecipe(Payload):
+    code = 'rr'
+    legacy = ('random_recipe_inline',)
+
+
+@dataclass(frozen=True)
+class FindRecipe(Payload):
+    code = 'fr'
+    legacy = ('find_recipe_inline',)
+
+
+@dataclass(frozen=True)
+class ByIngredients(Payload):
+    code = 'bi'
+    legacy = ('by_ingredients_inline',)
+
+
+@dataclass(frozen=True)
+class SearchPage(Payload):
+    code = 'sr'
+    legacy = ('search_page',)
+    page: int
+
+
+@dataclass(frozen=True)
+class Favorites(Payload):
+    code = 'fv'
+    legacy = ('favorites_inline',)
+
+
+@dataclass(frozen=True)
+class FavoritesPage(Payload):
+    '''Страница избранного; cursor — keyset-курсор "a12", "b7", "f3"'''
+    code = 'fp'
+    legacy = ('favorites_page',)
+    page: int
+    cursor: str = ''
+
+    def __post_init__(self):
+        # Неверный курсор — ошибка разбора, а не запроса к БД
+        page_cursor(self.cursor)
+
+    @property
+    def cursor_kwargs(self) -> dict:
+        return page_cursor(self.cursor)
+
+
+@dataclass(frozen=True)
+class AddFavorite(Payload):
+    code = 'af'
+    legacy = ('add_favorite',)
+    recipe_id: int
+
+
+@dataclass(frozen=True)
+class RemoveFavorite(Payload):
+    code = 'rf'
+    legacy = ('remove_favorite',)
+    recipe_id: int
+
+
+@dataclass(frozen=True)
+class ViewRecipe(Payload):
+    '''Рецепт из избранного: page и page_start — куда вернуться'''
+    code = 'vr'
+    legacy = ('view_recipe',)
+    recipe_id: int
+    page: int
+    page_start: int | None = None
+
+
+@dataclass(frozen=True)
+class BackToRecipe(Payload):
+    code = 'br'
+    legacy = ('back_to_recipe',)
+    recipe_id: int
+
+
+@dataclass(frozen=True)
+class AddToShoppingList(Payload):
+    code = 'as'
+    legacy = ('add_to_shopping_list',)
+    recipe_id: int
+
+
+@dataclass(frozen=True)
+class ShoppingList(Payload):
+    code = 'sl'
+    legacy = ('view_shopping_list',)
+
+
+@dataclass(frozen=True)
+class ShoppingPage(Payload):
+    code = 'sp'
+    legacy = ('shopping_page',)
+    page: int
+
+
+@dataclass(frozen=True)
+class ClearShoppingList(Payload):
+    code = 'cs'
+    legacy = ('clear_shopping_list',)
+
+
+@dataclass(frozen=True)
+class TogglePurchased(Payload):
+    code = 'tp'
+    legacy = ('toggle_purchased',)
+    item_id: int
+    # В кнопках до постраничного списка номера страницы нет
+    page: int = 0
+
+
+@dataclass(frozen=True)
+class DeleteItem(Payload):
+    code = 'di'
+    legacy = ('delete_item',)
+    item_id: int
+    page: int = 0
+
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRoutes:
+    '''
+    Таблица префикс -> (тип данных, хендлер).
+    Стоимость выбора хендлера не зависит от числа действий
+    '''
+
+    def __init__(self):
+        self._routes: dict[str, tuple[type[Payload], CallbackHandler]] = {}
+
+    def __call__(self, payload_type: type[Payload]):
+        '''Декоратор: @callback_routes(TogglePurchased)'''
+        def register(handler: CallbackHandler) -> CallbackHandler:
+            for prefix in (payload_type.prefix(), *payload_type.legacy):
+                if prefix in self._routes:
+                    raise ValueError(f'Префикс {prefix} уже занят')
+                self._routes[prefix] = (payload_type, handler)
+            return handler
+        return register
+
+    def resolve(
+            self, data: str | None
+            ) -> tuple[CallbackHandler, Payload] | None:
+        '''Хендлер и разобранные данные; None — кнопка неизвестна или испорчена'''
+        if not data:
+            return None
+        prefix, _, rest = data.partition(SEPARATOR)
+        route = self._routes.get(prefix)
+        if route is None:
+            return None
+        payload_type, handler = route
+        try:
+            payload = payload_type.unpack(rest.split(SEPARATOR) if rest else [])
+        except CallbackDataError:
+            return None
+        return handler, payload
@@ -0,0 +1,121 @@
+'''
+Карточки рецептов: готовый HTML для отправки в Telegram.
+
+Текст рецепта экранируется и режется на части по лимитам Telegram
+один раз, дальше карточка берётся из кеша (см. RecipeCache.card)
+'''
+
+import sys
+from dataclasses import dataclass
+from html import escape
+from db import Recipe
+
+
+# Лимиты Telegram в символах UTF-16
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+# Самый длинный результат экранирования одного символа — "&amp;"
+MAX_ESCAPED_CHAR = 5
+
+
+@dataclass
+class RecipeCard:
+    # Подпись к фото (или первое сообщение, если фото нет)
+    caption: str
+    # Ингредиенты и инструкция частями не длиннее MESSAGE_LIMIT
+    body: list[str]
+
+    def size(self) -> int:
+        '''Примерный объём карточки в памяти'''
+        return sys.getsizeof(self.caption) + sum(
+            sys.getsizeof(part) for part in self.body
+        )
+
+
+def tg_len(text: str) -> int:
+    '''Длина строки так, как её считает Telegram (UTF-16)'''
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _cut_word(word: str, limit: int):
+    '''Экранирует слово; слишком длинное режет на куски не длиннее limit'''
+    if len(word) * MAX_ESCAPED_CHAR <= limit:
+        yield escape(word, quote=False)
+        return
+    part, size = [], 0
+    for char in word:
+        escaped = escape(char, quote=False)
+        length = tg_len(escaped)
+        if part and size + length > limit:
+            yield ''.join(part)
+            part, size = [], 0
+        part.append(escaped)
+        size += length
+    if part:
+        yield ''.join(part)
+
+
+def wrap_line(line: str, limit: int) -> list[str]:
+    '''Экранирует строку и делит её по словам на куски не длиннее limit'''
+    pieces, current, size = [], [], 0
+    for raw_word in line.split(' '):
+        for word in _cut_word(raw_word, limit):
+            length = tg_len(word)
+            extra = length + 1 if current else length
+            if current and size + extra > limit:
+                pieces.append(' '.join(current))
+                current, size = [word], length
+            else:
+                current.append(word)
+                size += extra
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+
+def pack_lines(lines: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    '''
+    Собирает готовые HTML-строки в сообщения не длиннее limit.
+    Сообщения делятся только между строками, поэтому теги
+    (каждый целиком в одной строке) не разрываются
+    '''
+    chunks, current, size = [], [], 0
+    for line in lines:
+        length = tg_len(line)
+        extra = length + 1 if current else length
+        if current and size + extra > limit:
+            chunks.append('\n'.join(current))
+            current, size = [line], length
+        else:
+            current.append(line)
+            size += extra
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def _text_lines(text: str | None, limit: int) -> list[str]:
+    lines = []
+    for line in (text or '').replace('\r\n', '\n').split('\n'):
+        line = line.strip()
+        if line:
+            lines.extend(wrap_line(line, limit))
+    return lines
+
+
+def render_recipe_card(recipe: Recipe) -> RecipeCard:
+    '''Экранированная и разбитая на части карточка рецепта'''
+    caption_prefix = '<b>Рецепт:</b> '
+    name = wrap_line(
+        recipe.name_ru or recipe.name or '',
+        CAPTION_LIMIT - tg_len(caption_prefix)
+    )
+    caption = caption_prefix + (name[0] if name else '')
+
+    lines = ['<b>Ингредиенты:</b>']
+    lines.extend(_text_lines(recipe.ingredients_ru, MESSAGE_LIMIT))
+    lines.append('')
+    lines.append('<b>Инструкция по приготовлению:</b>')
+    lines.extend(_text_lines(recipe.instructions_ru, MESSAGE_LIMIT))
+
+    return RecipeCard(caption=caption, body=pack_lines(lines))
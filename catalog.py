@@ -0,0 +1,33 @@
+'''
+Отслеживание версии каталога рецептов.
+Каталог меняется только через fill_db.py (другой процесс),
+поэтому бот периодически сверяет версию в catalog_meta
+'''
+
+import time
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import CATALOG_REFRESH_INTERVAL
+from db import get_catalog_version
+
+
+class CatalogWatcher:
+    '''Кеширует версию каталога и перечитывает её не чаще interval секунд'''
+
+    def __init__(self, interval: float = CATALOG_REFRESH_INTERVAL):
+        self.interval = interval
+        self._version = None
+        self._checked_at = 0.0
+
+    async def current_version(self, db: AsyncSession) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.interval:
+            self._version = await get_catalog_version(db)
+            self._checked_at = now
+        return self._version
+
+    def invalidate(self):
+        '''Заставляет перечитать версию при следующем обращении'''
+        self._version = None
+
+
+catalog_watcher = CatalogWatcher()
@@ -3,4 +3,109 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-BOT_TOKEN = os.getenv('BOT_TOKEN')
\ No newline at end of file
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+
+# Способ получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес webhook (https://.../webhook). Пусто — не регистрировать
+# webhook в Telegram (локальная проверка сервера)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+# Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сколько апдейтов обрабатывать одновременно
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', 100))
+# Сколько секунд при остановке ждать начатые обработчики
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 30))
+
+# Метрики Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 — выключены)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+# Профиль движка БД: production (WAL, без логов SQL) или development
+DB_PROFILE = os.getenv('DB_PROFILE', 'production')
+# Логировать каждый SQL-запрос (по умолчанию — только в development)
+DB_ECHO = os.getenv('DB_ECHO', '').lower() in ('1', 'true', 'yes')
+# Параметры SQLite для production: кеш страниц и mmap на соединение,
+# сколько ждать освобождения блокировки записи
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 64 * 1024))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+# Пул соединений: постоянные и дополнительные при пиковой нагрузке
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 8))
+
+# Сколько id уже зарегистрированных пользователей держать в памяти
+KNOWN_USERS_CACHE_SIZE = int(os.getenv('KNOWN_USERS_CACHE_SIZE', 100000))
+
+# Сколько параметризованных клавиатур (кнопки рецепта и т.п.) кешировать
+KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', 4096))
+
+# Лимиты исходящих сообщений (middlewares/outbound.py): всего в секунду,
+# в один чат в секунду и сколько сообщений в чат можно отправить подряд
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', 4))
+# Сколько раз повторять запрос после ответа 429 (retry_after)
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+# Для скольких чатов помнить их лимит
+OUTBOUND_CHATS_TRACKED = int(os.getenv('OUTBOUND_CHATS_TRACKED', 10000))
+
+# Максимальное количество рецептов в выдаче поиска
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 50))
+
+# Как часто (в секундах) процессы бота проверяют, не обновился ли каталог
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', 30))
+
+# Доля каталога, которую пользователь должен увидеть,
+# прежде чем случайный рецепт сможет повториться
+RANDOM_NO_REPEAT_FRACTION = float(os.getenv('RANDOM_NO_REPEAT_FRACTION', 0.5))
+# Для скольких пользователей хранится история случайных рецептов
+RANDOM_HISTORY_USERS = int(os.getenv('RANDOM_HISTORY_USERS', 10000))
+
+# Кеш рецептов по id: максимум записей и примерный объём в байтах
+RECIPE_CACHE_SIZE = int(os.getenv('RECIPE_CACHE_SIZE', 2000))
+RECIPE_CACHE_MAX_BYTES = int(os.getenv('RECIPE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Сколько file_id фото рецептов держать в памяти (остальные — в БД)
+RECIPE_PHOTO_CACHE_SIZE = int(os.getenv('RECIPE_PHOTO_CACHE_SIZE', 10000))
+
+# Для скольких пользователей держать в памяти множество id избранного.
+# 0 — не кешировать, каждая проверка идёт в БД (нужно, если ботов несколько)
+FAVORITES_CACHE_USERS = int(os.getenv('FAVORITES_CACHE_USERS', 0))
+
+# Результаты поиска хранятся в состоянии пользователя как список id:
+# сколько секунд они действительны и сколько рецептов на странице
+SEARCH_SESSION_TTL = int(os.getenv('SEARCH_SESSION_TTL', 15 * 60))
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 10))
+
+# Сколько строк списка покупок на одной странице
+SHOPPING_PAGE_SIZE = int(os.getenv('SHOPPING_PAGE_SIZE', 10))
+# Для скольких пользователей помнить последнюю показанную страницу
+# списка покупок (0 — не помнить, каждое нажатие читает страницу из БД)
+SHOPPING_VIEW_CACHE_USERS = int(os.getenv('SHOPPING_VIEW_CACHE_USERS', 1000))
+
+# Состояния диалогов (FSM) хранятся в отдельном файле SQLite
+FSM_DB_PATH = os.getenv('FSM_DB_PATH', 'data/fsm.db')
+# Через сколько секунд без изменений состояние пользователя удаляется
+FSM_TTL = int(os.getenv('FSM_TTL', 24 * 60 * 60))
+# Как часто (в секундах) удаляются просроченные состояния
+FSM_EVICT_INTERVAL = float(os.getenv('FSM_EVICT_INTERVAL', 300))
+# Сколько состояний держать в памяти для чтения без обращения к файлу
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+
+# Импорт рецептов (fill_db.py)
+MEALDB_API_URL = os.getenv(
+    'MEALDB_API_URL', 'https://www.themealdb.com/api/json/v1/1'
+)
+# Число параллельных воркеров и лимит операций в секунду для стадий
+IMPORT_FETCH_CONCURRENCY = int(os.getenv('IMPORT_FETCH_CONCURRENCY', 4))
+IMPORT_FETCH_RATE = float(os.getenv('IMPORT_FETCH_RATE', 2))
+IMPORT_TRANSLATE_CONCURRENCY = int(os.getenv('IMPORT_TRANSLATE_CONCURRENCY', 4))
+IMPORT_TRANSLATE_RATE = float(os.getenv('IMPORT_TRANSLATE_RATE', 5))
+# Сколько рецептов записывается в БД одной транзакцией
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 50))
+# То же для загрузки из локального дампа (fill_db.py --from-dump)
+IMPORT_DUMP_BATCH_SIZE = int(os.getenv('IMPORT_DUMP_BATCH_SIZE', 2000))
@@ -2,12 +2,17 @@
 Файл для создания БД
 '''
 
+import logging
 import os
-from sqlalchemy import (Column, Integer,
+from sqlalchemy import (Column, Integer, Float,
                         String, Text, ForeignKey, Table,
-                        Boolean)
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+                        Boolean, Index, event, select)
+from sqlalchemy.ext.asyncio import (create_async_engine, AsyncEngine,
+                                    AsyncSession)
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from ingredients import parse_ingredients
+from config import (DB_PROFILE, DB_ECHO, DB_CACHE_SIZE_KB, DB_MMAP_SIZE,
+                    DB_BUSY_TIMEOUT_MS, DB_POOL_SIZE, DB_MAX_OVERFLOW)
 
 
 DATABASE_NAME = 'recipes.db'
@@ -17,21 +22,89 @@ DATABASE_URL = f'sqlite+aiosqlite:///{os.path.join(DATA_DIR, DATABASE_NAME)}'
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+logger = logging.getLogger(__name__)
+
+
+# Профили движка. pragmas выполняются на каждом новом соединении пула
+ENGINE_PROFILES = {
+    # Журнал по умолчанию (DELETE): запись блокирует и чтение
+    'development': {
+        'echo': True,
+        'pragmas': {},
+        'pool': {},
+    },
+    # WAL: читатели не ждут писателя, fsync только на контрольных точках
+    'production': {
+        'echo': False,
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            # Отрицательное значение — размер в КиБ, а не в страницах
+            'cache_size': -DB_CACHE_SIZE_KB,
+            'mmap_size': DB_MMAP_SIZE,
+            'busy_timeout': DB_BUSY_TIMEOUT_MS,
+            'temp_store': 'MEMORY',
+        },
+        'pool': {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            # Соединения с файлом SQLite не рвутся, проверка не нужна
+            'pool_pre_ping': False,
+        },
+    },
+}
+
+
+def _set_pragmas(pragmas: dict):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return on_connect
+
+
+def create_engine_for(
+        profile: str = DB_PROFILE, url: str = DATABASE_URL,
+        echo: bool | None = None
+        ) -> AsyncEngine:
+    '''Создаёт движок БД с настройками профиля из ENGINE_PROFILES'''
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(
+            f'Неизвестный профиль БД "{profile}", '
+            f'доступны: {", ".join(ENGINE_PROFILES)}'
+        )
+    settings = ENGINE_PROFILES[profile]
+    if echo is None:
+        echo = settings['echo'] or DB_ECHO
+
+    db_engine = create_async_engine(url, echo=echo, **settings['pool'])
+    if settings['pragmas']:
+        event.listen(
+            db_engine.sync_engine, 'connect', _set_pragmas(settings['pragmas'])
+        )
+    return db_engine
+
+
+engine = create_engine_for()
 
 Base = declarative_base()
 
 
+# Составной первичный ключ (user_id, recipe_id) запрещает дубли
+# и служит индексом для проверки «рецепт в избранном?»
 favorites_table = Table(
     'favorites', Base.metadata,
-    Column('user_id', Integer, ForeignKey('users.id')),
-    Column('recipe_id', Integer, ForeignKey('recipes.id'))
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('recipe_id', Integer, ForeignKey('recipes.id'), primary_key=True),
+    # Неявно (user_id, rowid): страницы избранного в порядке добавления
+    Index('ix_favorites_user_id', 'user_id')
 )
 
 shopping_recipes_table = Table(
     'shoping_recipes', Base.metadata,
-    Column('user_id', Integer, ForeignKey('users.id')),
-    Column('recipe_id', Integer, ForeignKey('recipes.id'))
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('recipe_id', Integer, ForeignKey('recipes.id'), primary_key=True)
 )
 
 
@@ -49,8 +122,7 @@ class User(Base):
 
     shopping_list_items = relationship(
         'ShoppingList',
-        backref='user',
-        lazy='joined'
+        backref='user'
     )
 
     shoping_recipes = relationship(
@@ -65,8 +137,15 @@ class User(Base):
 
 class Recipe(Base):
     __tablename__ = 'recipes'
+    __table_args__ = (
+        Index('ux_recipes_source_id', 'source_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # idMeal в TheMealDB — естественный ключ для синхронизации каталога
+    source_id = Column(String(20), nullable=True)
+    # Хеш исходных (английских) полей, чтобы пропускать неизменённые рецепты
+    content_hash = Column(String(64), nullable=True)
     name = Column(String(50), nullable=False)
     ingredients = Column(Text, nullable=False)
     instructions = Column(Text, nullable=False)
@@ -81,21 +160,425 @@ class Recipe(Base):
         return f'Recipe(name="{self.name}")'
 
 
+class RecipeIngredient(Base):
+    '''
+    Инвертированный индекс ингредиентов: нормализованный терм -> рецепт.
+    Первичный ключ начинается с term, поэтому строки одного терма
+    (posting list) лежат в таблице подряд
+    '''
+    __tablename__ = 'recipe_ingredients'
+    __table_args__ = (
+        Index('ix_recipe_ingredients_recipe_id', 'recipe_id'),
+        {'sqlite_with_rowid': False},
+    )
+
+    term = Column(String(50), primary_key=True)
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), primary_key=True)
+    # Номер строки ингредиента в рецепте
+    position = Column(Integer, primary_key=True)
+    # Общее число ингредиентов рецепта, чтобы считать недостающие
+    # без обращения к другим таблицам
+    ingredients_count = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<RecipeIngredient(term="{self.term}", recipe_id={self.recipe_id})>'
+
+
+class RecipeIngredientItem(Base):
+    '''
+    Ингредиент рецепта, разобранный при импорте на название,
+    количество и единицу (см. ingredients.py). Из этих строк
+    список покупок складывает одинаковые ингредиенты
+    '''
+    __tablename__ = 'recipe_ingredient_items'
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False)
+    # Нормализованное название — ключ сложения в списке покупок
+    name_key = Column(String(200), nullable=False)
+    # None — мера не разобрана, её текст лежит в unit
+    quantity = Column(Float, nullable=True)
+    unit = Column(String(50), nullable=False, default='', server_default='')
+
+    def __repr__(self):
+        return (f'<RecipeIngredientItem(recipe_id={self.recipe_id}, '
+                f'name="{self.name}")>')
+
+
+def ingredient_item_rows(
+        recipe_id: int, ingredients_text: str | None
+        ) -> list[dict]:
+    '''Строки recipe_ingredient_items для одного рецепта'''
+    return [
+        {
+            'recipe_id': recipe_id,
+            'position': position,
+            'name': item.name[:200],
+            'name_key': item.key[:200],
+            'quantity': item.quantity,
+            'unit': item.unit[:50],
+        }
+        for position, item in enumerate(parse_ingredients(ingredients_text))
+    ]
+
+
+class CatalogMeta(Base):
+    '''Служебные значения каталога рецептов (версия и т.п.)'''
+    __tablename__ = 'catalog_meta'
+
+    key = Column(String(50), primary_key=True)
+    value = Column(String(200), nullable=False)
+
+    def __repr__(self):
+        return f'<CatalogMeta(key="{self.key}", value="{self.value}")>'
+
+
+class RecipePhoto(Base):
+    '''
+    file_id фото рецепта, полученный от Telegram при первой отправке.
+    file_id действителен только для своего бота, поэтому ключ включает
+    bot_id; image_url запоминается, чтобы заметить смену картинки
+    '''
+    __tablename__ = 'recipe_photos'
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+    bot_id = Column(Integer, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey('recipes.id'), primary_key=True)
+    image_url = Column(String(300), nullable=False)
+    file_id = Column(String(200), nullable=False)
+
+    def __repr__(self):
+        return (f'<RecipePhoto(bot_id={self.bot_id}, '
+                f'recipe_id={self.recipe_id})>')
+
+
 class ShoppingList(Base):
+    '''
+    Строка списка покупок — один ингредиент в одной единице.
+    Одинаковые ингредиенты из разных рецептов складываются
+    upsert'ом по (user_id, name_key, unit)
+    '''
     __tablename__ = 'shopping_list'
+    __table_args__ = (
+        Index('ux_shopping_list_user_item', 'user_id', 'name_key', 'unit',
+              unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     item_name = Column(String(200), nullable=False)
     is_purchased = Column(Boolean, default=False)
+    name_key = Column(String(200), nullable=False, default='',
+                      server_default='')
+    quantity = Column(Float, nullable=True)
+    unit = Column(String(50), nullable=False, default='', server_default='')
 
     def __repr__(self):
         return f'<ShoppingList(user_id={self.user_id}), item_name="{self.item_name}">'
 
 
-async def create_tables():
-    async with engine.begin() as conn:
+# Полнотекстовый индекс по названиям рецептов (SQLite FTS5).
+# Таблица хранит собственную копию названий с заменой ё -> е,
+# регистр для кириллицы и латиницы сворачивает токенайзер unicode61.
+# Синхронизация с recipes — триггерами, поэтому индекс актуален
+# при любой записи в recipes, в том числе из fill_db.py
+RECIPES_FTS_DDL = (
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+        name, name_ru,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_fts_ai AFTER INSERT ON recipes
+    BEGIN
+        INSERT INTO recipes_fts(rowid, name, name_ru) VALUES (
+            new.id,
+            replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+            replace(replace(new.name_ru, 'ё', 'е'), 'Ё', 'Е')
+        );
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_fts_ad AFTER DELETE ON recipes
+    BEGIN
+        DELETE FROM recipes_fts WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_fts_au
+    AFTER UPDATE OF name, name_ru ON recipes
+    BEGIN
+        DELETE FROM recipes_fts WHERE rowid = old.id;
+        INSERT INTO recipes_fts(rowid, name, name_ru) VALUES (
+            new.id,
+            replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+            replace(replace(new.name_ru, 'ё', 'е'), 'Ё', 'Е')
+        );
+    END
+    ''',
+)
+
+RECIPES_FTS_REBUILD = (
+    'DELETE FROM recipes_fts',
+    '''
+    INSERT INTO recipes_fts(rowid, name, name_ru)
+    SELECT id,
+           replace(replace(name, 'ё', 'е'), 'Ё', 'Е'),
+           replace(replace(name_ru, 'ё', 'е'), 'Ё', 'Е')
+    FROM recipes
+    ''',
+)
+
+
+def _create_search_index(conn):
+    '''Создаёт FTS-индекс и заполняет его, если он отстал от recipes'''
+    for statement in RECIPES_FTS_DDL:
+        conn.exec_driver_sql(statement)
+
+    indexed = conn.exec_driver_sql(
+        'SELECT count(*) FROM recipes_fts'
+    ).scalar()
+    total = conn.exec_driver_sql('SELECT count(*) FROM recipes').scalar()
+    if indexed != total:
+        rebuild_search_index(conn)
+
+
+def rebuild_search_index(conn):
+    '''Полная пересборка FTS-индекса по таблице recipes'''
+    for statement in RECIPES_FTS_REBUILD:
+        conn.exec_driver_sql(statement)
+
+
+def _add_missing_columns(conn):
+    '''
+    create_all не добавляет новые колонки в уже существующие таблицы.
+    Добавляем их через ALTER TABLE (только nullable-колонки)
+    '''
+    for table in Base.metadata.sorted_tables:
+        existing = {
+            row[1] for row in conn.exec_driver_sql(
+                f'PRAGMA table_info("{table.name}")'
+            )
+        }
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" '
+                f'ADD COLUMN "{column.name}" {column_type}'
+            )
+
+
+def _create_missing_indexes(conn):
+    '''create_all не добавляет новые индексы в уже существующие таблицы'''
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# Миграции схемы для уже существующих БД.
+# Номер применённой миграции хранится в PRAGMA user_version.
+# Миграция — функция от синхронного соединения; SQL в ней пишется явно,
+# а не по текущим моделям, чтобы она не менялась вместе с ними.
+# Новые миграции добавляются только в конец списка
+def _table_exists(conn, name: str) -> bool:
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (name,)
+    ).first() is not None
+
+
+def _rebuild_association_table(conn, name: str, indexes: tuple[str, ...] = ()):
+    '''
+    SQLite не добавляет первичный ключ к существующей таблице,
+    поэтому таблица пересоздаётся. Дубли схлопываются, остаётся
+    первая строка: rowid сохраняет порядок добавления
+    '''
+    if not _table_exists(conn, name):
+        return
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}__new"')
+    conn.exec_driver_sql(
+        f'CREATE TABLE "{name}__new" ('
+        'user_id INTEGER NOT NULL REFERENCES users (id), '
+        'recipe_id INTEGER NOT NULL REFERENCES recipes (id), '
+        'PRIMARY KEY (user_id, recipe_id))'
+    )
+    conn.exec_driver_sql(
+        f'INSERT INTO "{name}__new" (rowid, user_id, recipe_id) '
+        f'SELECT min(rowid), user_id, recipe_id FROM "{name}" '
+        'WHERE user_id IS NOT NULL AND recipe_id IS NOT NULL '
+        'GROUP BY user_id, recipe_id'
+    )
+    conn.exec_driver_sql(f'DROP TABLE "{name}"')
+    conn.exec_driver_sql(f'ALTER TABLE "{name}__new" RENAME TO "{name}"')
+    for statement in indexes:
+        conn.exec_driver_sql(statement)
+
+
+def _migration_association_keys(conn):
+    _rebuild_association_table(conn, 'favorites', (
+        'CREATE INDEX ix_favorites_user_id ON favorites (user_id)',
+    ))
+    _rebuild_association_table(conn, 'shoping_recipes')
+
+
+def _migration_shopping_list_user_index(conn):
+    if _table_exists(conn, 'shopping_list'):
+        conn.exec_driver_sql(
+            'CREATE INDEX IF NOT EXISTS ix_shopping_list_user_id '
+            'ON shopping_list (user_id)'
+        )
+
+
+def _migration_structured_ingredients(conn):
+    '''
+    Разобранные ингредиенты рецептов и сложение одинаковых
+    ингредиентов в списке покупок
+    '''
+    conn.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS recipe_ingredient_items ('
+        'recipe_id INTEGER NOT NULL REFERENCES recipes (id), '
+        'position INTEGER NOT NULL, '
+        'name VARCHAR(200) NOT NULL, '
+        'name_key VARCHAR(200) NOT NULL, '
+        'quantity FLOAT, '
+        "unit VARCHAR(50) DEFAULT '' NOT NULL, "
+        'PRIMARY KEY (recipe_id, position)'
+        ') WITHOUT ROWID'
+    )
+    conn.exec_driver_sql('DELETE FROM recipe_ingredient_items')
+    rows = []
+    for recipe_id, ingredients_ru in conn.exec_driver_sql(
+            'SELECT id, ingredients_ru FROM recipes').all():
+        rows.extend(
+            tuple(row.values())
+            for row in ingredient_item_rows(recipe_id, ingredients_ru)
+        )
+    if rows:
+        conn.exec_driver_sql(
+            'INSERT INTO recipe_ingredient_items '
+            '(recipe_id, position, name, name_key, quantity, unit) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows
+        )
+
+    if not _table_exists(conn, 'shopping_list'):
+        return
+    existing = {
+        row[1] for row in conn.exec_driver_sql(
+            'PRAGMA table_info("shopping_list")'
+        )
+    }
+    for column, ddl in (
+        ('name_key', "VARCHAR(200) DEFAULT '' NOT NULL"),
+        ('quantity', 'FLOAT'),
+        ('unit', "VARCHAR(50) DEFAULT '' NOT NULL"),
+    ):
+        if column not in existing:
+            conn.exec_driver_sql(
+                f'ALTER TABLE shopping_list ADD COLUMN {column} {ddl}'
+            )
+
+    # Старые строки — целиком "название (мера)": разбираем и складываем.
+    # Сложенная строка куплена, только если куплены все исходные
+    merged = {}
+    for user_id, item_name, is_purchased in conn.exec_driver_sql(
+            'SELECT user_id, item_name, is_purchased '
+            'FROM shopping_list ORDER BY id').all():
+        for item in parse_ingredients(item_name):
+            key = (user_id, item.key, item.unit)
+            if key not in merged:
+                merged[key] = [item, bool(is_purchased)]
+                continue
+            current = merged[key]
+            if item.quantity is not None:
+                current[0].quantity = (current[0].quantity or 0) + item.quantity
+            current[1] = current[1] and bool(is_purchased)
+    rows = [
+        (user_id, item.name[:200], purchased, name_key[:200],
+         item.quantity, unit[:50])
+        for (user_id, name_key, unit), (item, purchased) in merged.items()
+    ]
+
+    conn.exec_driver_sql('DELETE FROM shopping_list')
+    if rows:
+        conn.exec_driver_sql(
+            'INSERT INTO shopping_list '
+            '(user_id, item_name, is_purchased, name_key, quantity, unit) '
+            'VALUES (?, ?, ?, ?, ?, ?)', rows
+        )
+    conn.exec_driver_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_shopping_list_user_item '
+        'ON shopping_list (user_id, name_key, unit)'
+    )
+
+
+MIGRATIONS = [
+    (1, 'составные ключи favorites и shoping_recipes',
+     _migration_association_keys),
+    (2, 'индекс shopping_list(user_id)', _migration_shopping_list_user_index),
+    (3, 'разобранные ингредиенты и сложение списка покупок',
+     _migration_structured_ingredients),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(conn) -> list[int]:
+    '''
+    Применяет к БД миграции новее её user_version и возвращает их номера.
+    Пустая БД сразу получает последнюю версию — её схему создаст create_all
+    '''
+    version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+    if version == 0 and not _table_exists(conn, 'recipes'):
+        conn.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return []
+
+    applied = []
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info('Миграция БД %s: %s', number, description)
+        migration(conn)
+        conn.exec_driver_sql(f'PRAGMA user_version = {number}')
+        applied.append(number)
+    return applied
+
+
+async def create_tables(db_engine: AsyncEngine | None = None):
+    '''Создаёт и мигрирует схему (по умолчанию — в основной БД)'''
+    async with (db_engine or engine).begin() as conn:
+        await conn.run_sync(run_migrations)
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(_create_search_index)
+
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+
+async def get_catalog_version(db: AsyncSession) -> int:
+    '''Текущая версия каталога рецептов (0, если каталог не менялся)'''
+    result = await db.execute(
+        select(CatalogMeta.value).where(CatalogMeta.key == CATALOG_VERSION_KEY)
+    )
+    value = result.scalar()
+    return int(value) if value is not None else 0
+
+
+async def bump_catalog_version(db: AsyncSession) -> int:
+    '''
+    Увеличивает версию каталога. Вызывается после изменения recipes,
+    чтобы процессы бота сбросили построенные по каталогу структуры.
+    Коммит остаётся за вызывающим
+    '''
+    version = await get_catalog_version(db) + 1
+    await db.merge(CatalogMeta(key=CATALOG_VERSION_KEY, value=str(version)))
+    return version
 
 
 SessionLocal = sessionmaker(
@@ -115,5 +598,6 @@ def get_db():
 
 if __name__ == '__main__':
     import asyncio
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     asyncio.run(create_tables())
     print('Таблица создана в файле recipes.db')
@@ -0,0 +1,168 @@
+'''
+Работа с избранными рецептами пользователя
+'''
+
+from dataclasses import dataclass
+from sqlalchemy import and_, delete, exists, literal_column, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import LRUCache
+from config import FAVORITES_CACHE_USERS
+from db import Recipe, favorites_table as favorites
+
+
+FAVORITES_PAGE_SIZE = 5
+
+# rowid строки в favorites растёт с каждой вставкой,
+# поэтому порядок по нему — порядок добавления в избранное.
+# Индекс по user_id в SQLite неявно содержит rowid, так что
+# выборка страницы — диапазон по индексу (user_id, rowid)
+favorite_position = literal_column('favorites.rowid')
+
+
+@dataclass
+class FavoritesPage:
+    '''Одна страница избранного: только id и название рецептов'''
+    page: int
+    # [(recipe_id, name_ru), ...]
+    recipes: list[tuple[int, str]]
+    # Позиции первой и последней записи страницы (курсоры keyset)
+    first_position: int | None
+    last_position: int | None
+    has_next: bool
+    has_prev: bool
+
+
+PAGE_CURSORS = {'a': 'after', 'b': 'before', 'f': 'start'}
+
+
+def page_cursor(token: str) -> dict:
+    '''Курсор из callback_data: "a12" -> {'after': 12}, "" -> {}'''
+    if not token:
+        return {}
+    return {PAGE_CURSORS[token[0]]: int(token[1:])}
+
+
+class FavoritesService:
+    '''
+    Проверка «рецепт в избранном?» одним EXISTS по индексу
+    (user_id, recipe_id) без загрузки всей коллекции.
+    При cache_users > 0 множество id избранного пользователя
+    кешируется в памяти и обновляется при add/remove
+    '''
+
+    def __init__(self, cache_users: int = FAVORITES_CACHE_USERS):
+        self._cache = LRUCache(cache_users) if cache_users > 0 else None
+
+    async def is_favorite(
+            self, db: AsyncSession, user_id: int, recipe_id: int
+            ) -> bool:
+        if self._cache is not None:
+            return recipe_id in await self.favorite_ids(db, user_id)
+
+        return bool(await db.scalar(
+            select(exists().where(
+                and_(
+                    favorites.c.user_id == user_id,
+                    favorites.c.recipe_id == recipe_id
+                )
+            ))
+        ))
+
+    async def favorite_ids(self, db: AsyncSession, user_id: int) -> set[int]:
+        '''Множество id избранных рецептов (читается только индекс)'''
+        if self._cache is not None:
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                return cached
+
+        result = await db.execute(
+            select(favorites.c.recipe_id).where(favorites.c.user_id == user_id)
+        )
+        recipe_ids = set(result.scalars().all())
+        if self._cache is not None:
+            self._cache.set(user_id, recipe_ids)
+        return recipe_ids
+
+    async def add(self, db: AsyncSession, user_id: int, recipe_id: int):
+        # Повторное добавление (двойное нажатие кнопки) ничего не меняет
+        await db.execute(
+            insert(favorites)
+            .values(user_id=user_id, recipe_id=recipe_id)
+            .on_conflict_do_nothing()
+        )
+        await db.commit()
+        if self._cache is not None and user_id in self._cache:
+            self._cache.get(user_id).add(recipe_id)
+
+    async def remove(self, db: AsyncSession, user_id: int, recipe_id: int):
+        await db.execute(
+            delete(favorites).where(
+                and_(
+                    favorites.c.user_id == user_id,
+                    favorites.c.recipe_id == recipe_id
+                )
+            )
+        )
+        await db.commit()
+        if self._cache is not None and user_id in self._cache:
+            self._cache.get(user_id).discard(recipe_id)
+
+    async def page(
+            self, db: AsyncSession, user_id: int, page: int = 0,
+            after: int | None = None, before: int | None = None,
+            start: int | None = None, per_page: int = FAVORITES_PAGE_SIZE
+            ) -> FavoritesPage:
+        '''
+        Keyset-пагинация избранного по порядку добавления.
+        after — страница после позиции, before — страница перед позицией,
+        start — страница, начиная с позиции (включительно).
+        Без курсора возвращается первая страница.
+        Стоимость не зависит от общего числа избранных рецептов
+        '''
+        query = (
+            select(favorite_position, Recipe.id, Recipe.name_ru)
+            .select_from(favorites)
+            .join(Recipe, Recipe.id == favorites.c.recipe_id)
+            .where(favorites.c.user_id == user_id)
+            # +1 строка — дешёвая проверка, есть ли ещё страница
+            .limit(per_page + 1)
+        )
+        backwards = before is not None
+        if backwards:
+            query = query.where(favorite_position < before)
+            query = query.order_by(favorite_position.desc())
+        else:
+            if after is not None:
+                query = query.where(favorite_position > after)
+            elif start is not None:
+                query = query.where(favorite_position >= start)
+            else:
+                page = 0
+            query = query.order_by(favorite_position)
+
+        rows = (await db.execute(query)).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows and (after, before, start) != (None, None, None):
+            # Курсор устарел (рецепты удалены) — начинаем сначала
+            return await self.page(db, user_id, per_page=per_page)
+
+        return FavoritesPage(
+            page=max(page, 0),
+            recipes=[(recipe_id, name) for _, recipe_id, name in rows],
+            first_position=rows[0][0] if rows else None,
+            last_position=rows[-1][0] if rows else None,
+            has_next=True if backwards else has_more,
+            has_prev=has_more if backwards else page > 0,
+        )
+
+    def invalidate(self, user_id: int):
+        if self._cache is not None:
+            self._cache.pop(user_id)
+
+
+favorites_service = FavoritesService()
@@ -1,117 +1,893 @@
+'''
+Наполнение БД рецептами из TheMealDB.
+
+Импорт устроен как асинхронный конвейер из трёх стадий,
+связанных очередями:
+    загрузка (HTTP) -> перевод -> пакетная запись в БД
+У каждой стадии свои число воркеров и лимит операций в секунду.
+
+Для офлайн-наполнения каталог можно загрузить из локального дампа
+(--from-dump) и выгрузить в дамп (--export)
+'''
+
+import argparse
 import asyncio
-import requests
+import hashlib
+import json
+import logging
+import re
 import time
-from googletrans import Translator
+from itertools import islice
+from dataclasses import dataclass, field
+import aiohttp
+from sqlalchemy import and_, delete, insert, or_, select, update
 from sqlalchemy.exc import IntegrityError
-from db import SessionLocal, Recipe
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import (
+    MEALDB_API_URL, IMPORT_FETCH_CONCURRENCY, IMPORT_FETCH_RATE,
+    IMPORT_TRANSLATE_CONCURRENCY, IMPORT_TRANSLATE_RATE, IMPORT_BATCH_SIZE,
+    IMPORT_DUMP_BATCH_SIZE
+)
+from db import (SessionLocal, Recipe, RecipeIngredient, RecipeIngredientItem,
+                CatalogMeta, create_tables, bump_catalog_version,
+                ingredient_item_rows)
+from search import build_ingredient_index, rebuild_ingredient_index
+from translation import (
+    BaseTranslator, CachedTranslator, TranslationCache, TRANSLATORS
+)
 
 
-API_URL_BY_LETTER = 'https://www.themealdb.com/api/json/v1/1/search.php?f='
-
 LETTERS = 'abcdefghijklmnopqrstuvwxyz'
 
-translator = Translator()
+# Как часто печатать прогресс импорта (секунды)
+PROGRESS_INTERVAL = 5
+# Сколько ждать добора пакета, прежде чем записать неполный
+BATCH_TIMEOUT = 2
+# Сколько рецептов из очереди переводчик берёт в один пакет
+TRANSLATE_BATCH_RECIPES = 10
+# Признак конца очереди
+DONE = None
+
+# Поля, которые переводятся и хранятся в колонке <поле>_ru
+TRANSLATED_FIELDS = ('name', 'ingredients', 'instructions')
+# Поля, по которым считается хеш содержимого рецепта
+HASHED_FIELDS = ('source_id', 'name', 'ingredients', 'instructions',
+                 'image_url', 'cuisine')
+
+CHECKPOINT_KEY = 'sync_checkpoint'
+
+# Сколько символов дампа читается с диска за раз
+DUMP_READ_CHUNK = 1 << 16
+# Строка ингредиентов "название (мера)"
+INGREDIENT_LINE_RE = re.compile(r'^(.*?)\s*\(([^()]*)\)$')
+
+
+class SyncCheckpoint:
+    '''
+    Какие буквы уже полностью записаны в БД.
+    Сохраняется в catalog_meta вместе с каждым пакетом рецептов,
+    поэтому прерванный импорт продолжается с места остановки
+    '''
+
+    def __init__(self, done: str = ''):
+        self._restored = set(done)
+        # Буква -> сколько её рецептов ещё не записано
+        self._pending = {}
+        self._failed = set()
+
+    @property
+    def done(self) -> str:
+        letters = self._restored | {
+            letter for letter, count in self._pending.items()
+            if count == 0 and letter not in self._failed
+        }
+        return ''.join(sorted(letters))
+
+    def fetched(self, letter: str, count: int):
+        self._pending[letter] = count
+
+    def processed(self, letters: list[str]):
+        for letter in letters:
+            self._pending[letter] -= 1
+
+    def failed(self, letters: list[str]):
+        '''Рецепты букв потеряны — при следующем запуске загрузим их снова'''
+        self._failed.update(letters)
+
+
+async def load_checkpoint() -> str:
+    async with SessionLocal() as db:
+        value = await db.scalar(
+            select(CatalogMeta.value).where(CatalogMeta.key == CHECKPOINT_KEY)
+        )
+    return value or ''
+
+
+async def save_checkpoint(checkpoint: SyncCheckpoint, letters: str):
+    '''Сохраняет прогресс; после полного прохода точка сбрасывается'''
+    async with SessionLocal() as db:
+        if set(letters) <= set(checkpoint.done):
+            await db.execute(
+                delete(CatalogMeta).where(CatalogMeta.key == CHECKPOINT_KEY)
+            )
+        else:
+            await db.merge(CatalogMeta(key=CHECKPOINT_KEY, value=checkpoint.done))
+        await db.commit()
+
+
+class RateLimiter:
+    '''Равномерно ограничивает частоту операций: не больше rate в секунду'''
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
 
 
-def get_recipes_by_letter(letter):
+@dataclass
+class ImportSettings:
+    '''Параметры конвейера импорта'''
+    api_url: str = MEALDB_API_URL
+    letters: str = LETTERS
+    fetch_concurrency: int = IMPORT_FETCH_CONCURRENCY
+    fetch_rate: float = IMPORT_FETCH_RATE
+    translate_concurrency: int = IMPORT_TRANSLATE_CONCURRENCY
+    translate_rate: float = IMPORT_TRANSLATE_RATE
+    batch_size: int = IMPORT_BATCH_SIZE
+    # None — Google Translate
+    translator: BaseTranslator | None = None
+    use_translation_cache: bool = True
+    # False — игнорировать сохранённую точку возобновления
+    resume: bool = True
+
+
+@dataclass
+class ImportStats:
+    '''Счётчики прогресса импорта'''
+    letters_total: int = 0
+    letters_done: int = 0
+    fetched: int = 0
+    unchanged: int = 0
+    translated: int = 0
+    written: int = 0
+    skipped: int = 0
+    errors: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        rate = self.written / elapsed if elapsed else 0.0
+        letters = (
+            f'буквы {self.letters_done}/{self.letters_total}, '
+            if self.letters_total else ''
+        )
+        return (
+            f'[{elapsed:6.1f} c] {letters}'
+            f'получено {self.fetched}, без изменений {self.unchanged}, '
+            f'переведено {self.translated}, '
+            f'записано {self.written}, пропущено {self.skipped}, '
+            f'ошибок {self.errors} ({rate:.1f} рецептов/с)'
+        )
+
+
+async def get_recipes_by_letter(
+        http: aiohttp.ClientSession, api_url: str, letter: str
+        ) -> list[dict] | None:
     '''
-    Делает запрос к API по заданной букве и возвращает список рецептов
+    Делает запрос к API по заданной букве и возвращает список рецептов.
+    None — запрос не удался
     '''
-    url = f'{API_URL_BY_LETTER}{letter}'
+    url = f'{api_url}/search.php'
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        async with http.get(url, params={'f': letter}) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
         if isinstance(data, dict) and data.get('meals') is not None:
             return data['meals']
         else:
             return []
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
         print(f'Ошибка при запросе к API для буквы "{letter}": {e}')
-        return []
+        return None
+
+
+def parse_meal(recipe_data: dict) -> dict | None:
+    '''
+    Достаёт из ответа API поля рецепта на английском.
+    ingredient_items — пары (ингредиент, мера) для перевода по отдельности
+    '''
+    ingredient_items = []
+    for i in range(1, 21):
+        ingredient = recipe_data.get(f'strIngredient{i}')
+        measure = recipe_data.get(f'strMeasure{i}') or ''
+        if ingredient and ingredient.strip():
+            ingredient_items.append((ingredient.strip(), measure.strip()))
 
+    name_en = recipe_data.get('strMeal')
+    if not name_en:
+        return None
+
+    recipe = {
+        'source_id': recipe_data.get('idMeal'),
+        'name': name_en,
+        'ingredients': format_ingredients(ingredient_items),
+        'instructions': recipe_data.get('strInstructions') or '',
+        'image_url': recipe_data.get('strMealThumb'),
+        'cuisine': recipe_data.get('strArea'),
+    }
+    recipe['content_hash'] = content_hash(recipe)
+    recipe['ingredient_items'] = ingredient_items
+    return recipe
+
+
+def content_hash(recipe: dict) -> str:
+    '''Хеш исходных полей рецепта'''
+    payload = '\x1f'.join(str(recipe.get(key) or '') for key in HASHED_FIELDS)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def plan_sync(recipes: list[dict], stats: ImportStats) -> list[dict]:
+    '''
+    Сверяет загруженные рецепты с БД по idMeal.
+    Неизменённые (тот же хеш) отбрасываются. Изменённым проставляется id
+    и переводы тех полей, что не поменялись, — переводить их заново не нужно.
+    У рецепта без хеша перевод не удался: он переводится заново целиком,
+    удачные строки возьмутся из кеша переводов.
+    Рецепты, загруженные до появления source_id, находятся по названию
+    '''
+    source_ids = [recipe['source_id'] for recipe in recipes if recipe['source_id']]
+    names = [recipe['name'] for recipe in recipes]
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(Recipe).where(
+                or_(
+                    Recipe.source_id.in_(source_ids),
+                    and_(Recipe.source_id.is_(None), Recipe.name.in_(names))
+                )
+            )
+        )
+        existing = result.scalars().all()
+
+    by_source_id = {item.source_id: item for item in existing if item.source_id}
+    by_name = {item.name: item for item in existing if not item.source_id}
+
+    planned = []
+    for recipe in recipes:
+        current = (by_source_id.get(recipe['source_id'])
+                   or by_name.pop(recipe['name'], None))
+        if current is None:
+            planned.append(recipe)
+            continue
+
+        if current.content_hash == recipe['content_hash']:
+            stats.unchanged += 1
+            continue
+
+        recipe['id'] = current.id
+        if current.content_hash is None:
+            # В *_ru может лежать английский текст вместо перевода
+            planned.append(recipe)
+            continue
+        for field_name in TRANSLATED_FIELDS:
+            translated = getattr(current, f'{field_name}_ru')
+            if getattr(current, field_name) == recipe[field_name] and translated:
+                recipe.setdefault(f'{field_name}_ru', translated)
+        planned.append(recipe)
+    return planned
+
+
+def format_ingredients(ingredient_items: list[tuple[str, str]]) -> str:
+    '''Ингредиенты построчно в формате "название (мера)"'''
+    return '\n'.join(
+        f'{ingredient} ({measure})' for ingredient, measure in ingredient_items
+    )
+
+
+def split_ingredients(ingredients: str) -> list[tuple[str, str]]:
+    '''Обратное к format_ingredients: строки -> пары (ингредиент, мера)'''
+    items = []
+    for line in ingredients.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        match = INGREDIENT_LINE_RE.match(line)
+        items.append((match[1], match[2]) if match else (line, ''))
+    return items
+
+
+def translate_recipes(
+        translator: CachedTranslator, recipes: list[dict]
+        ) -> list[dict]:
+    '''
+    Добавляет к рецептам русские поля (блокирующий вызов).
+    Ингредиенты и меры переводятся как отдельные строки,
+    поэтому «Salt» переводится один раз на весь каталог.
+    Если перевод не удался, остаётся английский текст, а content_hash
+    не сохраняется — следующая синхронизация переведёт рецепт снова
+    '''
+    texts = []
+    recipe_texts = []
+    for recipe in recipes:
+        own = []
+        # Уже переведённые поля (у неизменённых при синхронизации) пропускаем
+        if 'name_ru' not in recipe:
+            own.append(recipe['name'])
+        if 'instructions_ru' not in recipe:
+            own.append(recipe['instructions'])
+        if 'ingredients_ru' not in recipe:
+            for ingredient, measure in recipe['ingredient_items']:
+                own.append(ingredient)
+                own.append(measure)
+        texts.extend(own)
+        recipe_texts.append(own)
+
+    translated = translator.translate_many(texts)
+
+    def tr(text):
+        return translated.get(text) or text
+
+    result = []
+    for recipe, own in zip(recipes, recipe_texts):
+        recipe = dict(recipe)
+        ingredient_items = recipe.pop('ingredient_items')
+        if translated.failed.intersection(own):
+            recipe['content_hash'] = None
+        if 'name_ru' not in recipe:
+            recipe['name_ru'] = tr(recipe['name'])
+        if 'ingredients_ru' not in recipe:
+            recipe['ingredients_ru'] = format_ingredients([
+                (tr(ingredient), tr(measure))
+                for ingredient, measure in ingredient_items
+            ])
+        if 'instructions_ru' not in recipe:
+            recipe['instructions_ru'] = tr(recipe['instructions'])
+        result.append(recipe)
+    return result
+
+
+async def fetch_worker(
+        http: aiohttp.ClientSession, settings: ImportSettings,
+        letters: asyncio.Queue, translate_queue: asyncio.Queue,
+        limiter: RateLimiter, stats: ImportStats, checkpoint: SyncCheckpoint
+        ):
+    '''Стадия 1: загрузка рецептов по буквам и сверка с БД'''
+    while True:
+        letter = await letters.get()
+        if letter is DONE:
+            return
+
+        await limiter.wait()
+        recipes_data = await get_recipes_by_letter(http, settings.api_url, letter)
+        if recipes_data is None:
+            # Буква не отмечается выполненной и загрузится при следующем запуске
+            stats.errors += 1
+            continue
+
+        recipes = []
+        for recipe_data in recipes_data:
+            if not isinstance(recipe_data, dict):
+                print(f'Пропускаем некорректные данные для буквы {letter}: {recipe_data}')
+                stats.skipped += 1
+                continue
+            recipe = parse_meal(recipe_data)
+            if recipe is None:
+                print('Пропуск рецепта без названия')
+                stats.skipped += 1
+                continue
+            recipes.append(recipe)
+        stats.fetched += len(recipes)
+
+        recipes = await plan_sync(recipes, stats) if recipes else []
+        checkpoint.fetched(letter, len(recipes))
+        for recipe in recipes:
+            recipe['letter'] = letter
+            await translate_queue.put(recipe)
+
+        stats.letters_done += 1
+
+
+async def translate_worker(
+        translator: CachedTranslator,
+        translate_queue: asyncio.Queue, write_queue: asyncio.Queue,
+        limiter: RateLimiter, stats: ImportStats, checkpoint: SyncCheckpoint
+        ):
+    '''
+    Стадия 2: перевод. Берёт из очереди до TRANSLATE_BATCH_RECIPES
+    рецептов за раз. Переводчик синхронный, поэтому работает в потоке
+    '''
+    finished = False
+    while not finished:
+        recipe = await translate_queue.get()
+        if recipe is DONE:
+            return
 
-def translate_text(text):
-    '''Перевод текста на русский язык'''
-    if not text:
-        return ''
+        recipes = [recipe]
+        while len(recipes) < TRANSLATE_BATCH_RECIPES:
+            try:
+                recipe = translate_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if recipe is DONE:
+                finished = True
+                break
+            recipes.append(recipe)
+
+        await limiter.wait()
+        try:
+            recipes = await asyncio.to_thread(
+                translate_recipes, translator, recipes
+            )
+        except Exception as e:
+            print(f'Ошибка перевода пакета из {len(recipes)} рецептов: {e}')
+            stats.errors += len(recipes)
+            checkpoint.failed([recipe['letter'] for recipe in recipes])
+            continue
+        stats.translated += len(recipes)
+        for recipe in recipes:
+            await write_queue.put(recipe)
+
+
+async def write_batch(batch: list[dict], checkpoint: SyncCheckpoint | None):
+    '''
+    Записывает пакет одной транзакцией: новые рецепты вставляются,
+    изменённые обновляются по id, индекс ингредиентов и разобранные
+    ингредиенты пересобираются.
+    Все шаги — пакетные executemany, без объектов ORM.
+    В той же транзакции сохраняется точка возобновления
+    '''
+    letters = [recipe.pop('letter', None) for recipe in batch]
+    updates = [recipe for recipe in batch if 'id' in recipe]
+    inserts = [recipe for recipe in batch if 'id' not in recipe]
+
+    async with SessionLocal() as db:
+        indexed = [(recipe['id'], recipe['ingredients_ru']) for recipe in updates]
+        if updates:
+            await db.execute(update(Recipe), updates)
+            updated_ids = [recipe['id'] for recipe in updates]
+            await db.execute(
+                delete(RecipeIngredient)
+                .where(RecipeIngredient.recipe_id.in_(updated_ids))
+            )
+            await db.execute(
+                delete(RecipeIngredientItem)
+                .where(RecipeIngredientItem.recipe_id.in_(updated_ids))
+            )
+
+        if inserts:
+            # id новых рецептов нужны для индекса ингредиентов
+            result = await db.execute(
+                insert(Recipe).returning(
+                    Recipe.id, sort_by_parameter_order=True
+                ),
+                inserts
+            )
+            indexed += [
+                (recipe_id, recipe['ingredients_ru'])
+                for recipe_id, recipe in zip(result.scalars(), inserts)
+            ]
+
+        index_rows, item_rows = [], []
+        for recipe_id, ingredients_ru in indexed:
+            index_rows.extend(build_ingredient_index(recipe_id, ingredients_ru))
+            item_rows.extend(ingredient_item_rows(recipe_id, ingredients_ru))
+        if index_rows:
+            await db.execute(insert(RecipeIngredient), index_rows)
+        if item_rows:
+            await db.execute(insert(RecipeIngredientItem), item_rows)
+
+        if checkpoint is None:
+            await bump_catalog_version(db)
+            await db.commit()
+            return
+
+        checkpoint.processed(letters)
+        try:
+            await db.merge(
+                CatalogMeta(key=CHECKPOINT_KEY, value=checkpoint.done)
+            )
+            await bump_catalog_version(db)
+            await db.commit()
+        except Exception:
+            checkpoint.failed(letters)
+            raise
+
+
+async def flush_batch(
+        batch: list[dict], stats: ImportStats,
+        checkpoint: SyncCheckpoint | None
+        ):
+    if not batch:
+        return
+    letters = [recipe.get('letter') for recipe in batch]
     try:
-        # У Google Translate есть ограничение по символам, 
-        # поэтому большие тексты могут не переводиться
-        return translator.translate(text, src='en', dest='ru').text
+        await write_batch(batch, checkpoint)
+        stats.written += len(batch)
+    except IntegrityError as e:
+        print(f'Пакет из {len(batch)} рецептов конфликтует с БД: {e}')
+        stats.errors += len(batch)
+        if checkpoint:
+            checkpoint.failed(letters)
     except Exception as e:
-        print(f'Ошибка перевода: {e}')
-        return ''
+        print(f'Ошибка при записи пакета из {len(batch)} рецептов: {e}')
+        stats.errors += len(batch)
+        if checkpoint:
+            checkpoint.failed(letters)
+    batch.clear()
+
+
+async def writer(
+        write_queue: asyncio.Queue, batch_size: int, stats: ImportStats,
+        checkpoint: SyncCheckpoint
+        ):
+    '''Стадия 3: пакетная запись в БД'''
+    batch = []
+    while True:
+        try:
+            recipe = await asyncio.wait_for(write_queue.get(), BATCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Новых рецептов давно нет — записываем то, что накопилось
+            await flush_batch(batch, stats, checkpoint)
+            continue
+
+        if recipe is DONE:
+            await flush_batch(batch, stats, checkpoint)
+            return
 
+        batch.append(recipe)
+        if len(batch) >= batch_size:
+            await flush_batch(batch, stats, checkpoint)
 
-async def fill_database():
-    '''Наполнение БД (асинхронная версия)'''
-    recipes_added = 0
+
+async def report_progress(stats: ImportStats):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        print(stats.report())
+
+
+async def run_stage(workers: list, next_queue: asyncio.Queue, consumers: int):
+    '''Ждёт воркеров стадии и передаёт следующей стадии признак конца'''
+    await asyncio.gather(*workers)
+    for _ in range(consumers):
+        await next_queue.put(DONE)
+
+
+async def fill_database(settings: ImportSettings | None = None) -> ImportStats:
+    '''Наполнение БД (асинхронный конвейер)'''
+    settings = settings or ImportSettings()
+    await create_tables()
+
+    checkpoint = SyncCheckpoint(
+        await load_checkpoint() if settings.resume else ''
+    )
+    pending_letters = [
+        letter for letter in settings.letters if letter not in checkpoint.done
+    ]
+    stats = ImportStats(letters_total=len(pending_letters))
 
     print('Start parsing')
+    if len(pending_letters) < len(settings.letters):
+        print(f'Продолжаем прерванный импорт, уже загружены буквы: '
+              f'{checkpoint.done}')
 
-    async with SessionLocal() as db:
-        for letter in LETTERS:
-            print(f'Загрузка рецептов на букву {letter}')
-            recipes = get_recipes_by_letter(letter)
+    letters = asyncio.Queue()
+    for letter in pending_letters:
+        letters.put_nowait(letter)
+    for _ in range(settings.fetch_concurrency):
+        letters.put_nowait(DONE)
 
-            if not recipes:
-                continue
+    # Ограниченные очереди дают обратное давление на быстрые стадии
+    translate_queue = asyncio.Queue(maxsize=settings.batch_size * 2)
+    write_queue = asyncio.Queue(maxsize=settings.batch_size * 2)
+
+    fetch_limiter = RateLimiter(settings.fetch_rate)
+    translate_limiter = RateLimiter(settings.translate_rate)
+
+    translator = CachedTranslator(
+        settings.translator or TRANSLATORS['google'](),
+        TranslationCache() if settings.use_translation_cache else None
+    )
+
+    progress = asyncio.create_task(report_progress(stats))
+    try:
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30)
+        ) as http:
+            fetchers = [
+                fetch_worker(http, settings, letters, translate_queue,
+                             fetch_limiter, stats, checkpoint)
+                for _ in range(settings.fetch_concurrency)
+            ]
+            translators = [
+                translate_worker(translator, translate_queue, write_queue,
+                                 translate_limiter, stats, checkpoint)
+                for _ in range(settings.translate_concurrency)
+            ]
+            await asyncio.gather(
+                run_stage(fetchers, translate_queue,
+                          settings.translate_concurrency),
+                run_stage(translators, write_queue, 1),
+                writer(write_queue, settings.batch_size, stats, checkpoint),
+            )
+    finally:
+        progress.cancel()
+        if translator.cache:
+            translator.cache.close()
+
+    await save_checkpoint(checkpoint, settings.letters)
+
+    print(stats.report())
+    print(f'Кеш переводов: {translator.hits} попаданий, '
+          f'{translator.misses} новых строк')
+    print(f'БД заполнена, записано {stats.written} новых или изменённых рецептов')
+    return stats
+
+
+def iter_json_array(file, chunk_size: int = DUMP_READ_CHUNK):
+    '''
+    Потоково разбирает элементы первого JSON-массива в файле:
+    и [...], и ответ API {"meals": [...]}. В памяти — один кусок файла
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = -1
+    while pos == -1:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        buffer += chunk
+        pos = buffer.find('[')
+    pos += 1
+
+    while True:
+        # Пропускаем пробелы и запятые между элементами
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buffer):
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            buffer, pos = chunk, 0
+            continue
+        if buffer[pos] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Элемент не поместился в буфер — дочитываем
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield item
+        pos = end
+        if pos > chunk_size:
+            buffer, pos = buffer[pos:], 0
+
+
+def iter_dump(path: str):
+    '''
+    Генератор записей дампа. Понимает NDJSON (объект на строку),
+    JSON-массив и сохранённый ответ API {"meals": [...]}
+    '''
+    with open(path, encoding='utf-8') as file:
+        first_line = file.readline()
+        try:
+            first = json.loads(first_line)
+        except json.JSONDecodeError:
+            first = None
+
+        if isinstance(first, dict) and 'meals' not in first:
+            yield first
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            file.seek(0)
+            yield from iter_json_array(file)
 
-            for recipe_data in recipes:
-                if not isinstance(recipe_data, dict):
-                    print(f'Пропускаем некорректные данные для буквы {letter}: {recipe_data}')
+
+def parse_dump_record(record) -> dict | None:
+    '''
+    Рецепт из записи дампа: формат API TheMealDB или формат --export.
+    Готовые переводы (*_ru) из записи сохраняются
+    '''
+    if not isinstance(record, dict):
+        return None
+    if 'strMeal' in record:
+        recipe = parse_meal(record)
+        if recipe is None:
+            return None
+    elif record.get('name'):
+        recipe = {key: record.get(key) for key in HASHED_FIELDS}
+        recipe['ingredients'] = recipe['ingredients'] or ''
+        recipe['instructions'] = recipe['instructions'] or ''
+        recipe['content_hash'] = content_hash(recipe)
+        recipe['ingredient_items'] = split_ingredients(recipe['ingredients'])
+    else:
+        return None
+
+    if recipe['source_id'] is not None:
+        recipe['source_id'] = str(recipe['source_id'])
+    for field_name in TRANSLATED_FIELDS:
+        if record.get(f'{field_name}_ru'):
+            recipe[f'{field_name}_ru'] = record[f'{field_name}_ru']
+    return recipe
+
+
+def batched(items, size: int):
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+async def import_dump(
+        path: str, batch_size: int = IMPORT_DUMP_BATCH_SIZE,
+        translator: BaseTranslator | None = None
+        ) -> ImportStats:
+    '''
+    Наполнение БД из локального дампа без обращения к API.
+    Записи читаются генератором и пишутся пакетами по batch_size
+    в одной транзакции, поэтому в памяти только текущий пакет.
+    Без переводчика русские поля берутся из записи или кеша переводов,
+    иначе остаётся английский текст без content_hash — рецепт переведёт
+    следующая синхронизация с переводчиком
+    '''
+    await create_tables()
+    stats = ImportStats()
+    translator = CachedTranslator(translator, TranslationCache())
+
+    print(f'Загрузка каталога из {path}')
+    progress = asyncio.create_task(report_progress(stats))
+    try:
+        for records in batched(iter_dump(path), batch_size):
+            # Повторы внутри пакета: остаётся последняя версия рецепта
+            recipes = {}
+            for record in records:
+                recipe = parse_dump_record(record)
+                if recipe is None:
+                    stats.skipped += 1
                     continue
-                try:
-                    ingredients_list = []
-                    for i in range(1, 21):
-                        ingredient = recipe_data.get(f'strIngredient{i}')
-                        measure = recipe_data.get(f'strMeasure{i}')
-                        if ingredient and ingredient.strip():
-                            ingredients_list.append(f'{ingredient.strip()} ({measure.strip()})')
-
-                    name_en = recipe_data.get('strMeal')
-                    ingredients_en = '\n'.join(ingredients_list)
-                    instructions_en = recipe_data.get('strInstructions')
-                    cuisine_en = recipe_data.get('strArea')
-
-                    if not name_en:
-                        print('Пропуск рецепта без названия')
-                        continue
-
-                    print(f'Переводим рецепт {name_en}')
-
-                    name_ru = translate_text(name_en)
-                    ingredients_ru = translate_text(ingredients_en)
-                    instructions_ru = translate_text(instructions_en)
-
-                    db_recipe = Recipe(
-                        name=name_en,
-                        ingredients=ingredients_en,
-                        instructions=instructions_en,
-                        image_url=recipe_data.get('strMealThumb'),
-                        cuisine=cuisine_en,
-                        name_ru=name_ru,
-                        ingredients_ru=ingredients_ru,
-                        instructions_ru=instructions_ru,
-                    )
-
-                    db.add(db_recipe)
-                    recipes_added += 1
-
-                except IntegrityError:
-                    await db.rollback()
-                    print(f'Рецепт {recipe_data.get("strMeal")} уже есть в БД. Пропускаем')
-                except Exception as e:
-                    await db.rollback()
-                    print(f'Ошибка при добавлении рецепта: {e}')
-
-            # Сохраняем все рецепты, собранные по одной букве
-            await db.commit()
-            time.sleep(1)
+                recipes[recipe['source_id'] or recipe['name']] = recipe
+            stats.fetched += len(recipes)
 
-    print(f'БД заполнена, добавлено {recipes_added} новых рецептов')
+            planned = await plan_sync(list(recipes.values()), stats)
+            if not planned:
+                continue
+            planned = await asyncio.to_thread(
+                translate_recipes, translator, planned
+            )
+            stats.translated += len(planned)
+            await flush_batch(planned, stats, None)
+    finally:
+        progress.cancel()
+        translator.cache.close()
+
+    print(stats.report())
+    print(f'БД заполнена из дампа, записано {stats.written} новых '
+          f'или изменённых рецептов')
+    return stats
+
+
+async def export_dump(path: str) -> int:
+    '''Выгружает каталог в NDJSON — формат, который читает --from-dump'''
+    fields = HASHED_FIELDS + tuple(
+        f'{field_name}_ru' for field_name in TRANSLATED_FIELDS
+    )
+    exported = 0
+    async with SessionLocal() as db:
+        result = await db.stream(
+            select(*(getattr(Recipe, name) for name in fields))
+            .order_by(Recipe.id)
+            .execution_options(yield_per=IMPORT_DUMP_BATCH_SIZE)
+        )
+        with open(path, 'w', encoding='utf-8') as file:
+            async for row in result:
+                file.write(json.dumps(dict(row._mapping), ensure_ascii=False))
+                file.write('\n')
+                exported += 1
+    print(f'Выгружено {exported} рецептов в {path}')
+    return exported
+
+
+async def rebuild_ingredient_items(db: AsyncSession):
+    '''Заново разбирает ингредиенты всех рецептов'''
+    await db.execute(delete(RecipeIngredientItem))
+    result = await db.execute(select(Recipe.id, Recipe.ingredients_ru))
+    rows = []
+    for recipe_id, ingredients_ru in result.all():
+        rows.extend(ingredient_item_rows(recipe_id, ingredients_ru))
+    for rows_batch in batched(rows, IMPORT_DUMP_BATCH_SIZE):
+        await db.execute(insert(RecipeIngredientItem), rows_batch)
+    await db.commit()
+
+
+async def reindex_ingredients():
+    '''
+    Пересборка индекса ингредиентов и разобранных ингредиентов
+    для уже загруженных рецептов
+    '''
+    await create_tables()
+    async with SessionLocal() as db:
+        indexed = await rebuild_ingredient_index(db)
+        await rebuild_ingredient_items(db)
+        await bump_catalog_version(db)
+        await db.commit()
+    print(f'Индекс ингредиентов пересобран для {indexed} рецептов')
 
 
 if __name__ == '__main__':
-    asyncio.run(fill_database())
+    # Миграции схемы и ошибки перевода пишутся через logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='Наполнение БД рецептами')
+    parser.add_argument(
+        '--reindex', action='store_true',
+        help='только пересобрать индекс и разбор ингредиентов без загрузки'
+    )
+    parser.add_argument(
+        '--api-url', default=MEALDB_API_URL,
+        help='адрес API TheMealDB (или локальной заглушки)'
+    )
+    parser.add_argument('--letters', default=LETTERS,
+                        help='какие буквы загружать')
+    parser.add_argument('--fetch-concurrency', type=int,
+                        default=IMPORT_FETCH_CONCURRENCY)
+    parser.add_argument('--fetch-rate', type=float, default=IMPORT_FETCH_RATE,
+                        help='запросов к API в секунду (0 — без лимита)')
+    parser.add_argument('--translate-concurrency', type=int,
+                        default=IMPORT_TRANSLATE_CONCURRENCY)
+    parser.add_argument('--translate-rate', type=float,
+                        default=IMPORT_TRANSLATE_RATE,
+                        help='переводов рецептов в секунду (0 — без лимита)')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--translator', choices=TRANSLATORS,
+                        help='google (по умолчанию) или fake — локальная '
+                             'заглушка без сети. Для --from-dump по умолчанию '
+                             'переводы берутся только из дампа и кеша')
+    parser.add_argument('--no-translation-cache', action='store_true',
+                        help='не использовать кеш переводов на диске')
+    parser.add_argument('--restart', action='store_true',
+                        help='начать импорт заново, не продолжая прерванный')
+    parser.add_argument('--from-dump', metavar='PATH',
+                        help='загрузить рецепты из локального дампа '
+                             '(NDJSON или JSON) без обращения к API')
+    parser.add_argument('--export', metavar='PATH',
+                        help='выгрузить каталог из БД в NDJSON-дамп')
+    parser.add_argument('--dump-batch-size', type=int,
+                        default=IMPORT_DUMP_BATCH_SIZE,
+                        help='рецептов дампа в одной транзакции')
+    args = parser.parse_args()
+
+    if args.reindex:
+        asyncio.run(reindex_ingredients())
+    elif args.export:
+        asyncio.run(export_dump(args.export))
+    elif args.from_dump:
+        asyncio.run(import_dump(
+            args.from_dump, args.dump_batch_size,
+            TRANSLATORS[args.translator]() if args.translator else None
+        ))
+    else:
+        asyncio.run(fill_database(ImportSettings(
+            api_url=args.api_url.rstrip('/'),
+            letters=args.letters,
+            fetch_concurrency=args.fetch_concurrency,
+            fetch_rate=args.fetch_rate,
+            translate_concurrency=args.translate_concurrency,
+            translate_rate=args.translate_rate,
+            batch_size=args.batch_size,
+            translator=TRANSLATORS[args.translator or 'google'](),
+            use_translation_cache=not args.no_translation_cache,
+            resume=not args.restart,
+        )))
@@ -0,0 +1,278 @@
+'''
+Хранилище состояний FSM в отдельном файле SQLite.
+
+MemoryStorage aiogram держит состояние брошенного диалога до
+перезапуска, а перезапуск теряет все начатые диалоги. Здесь состояние
+пользователя — строка таблицы с данными в JSON и сроком жизни:
+каждая запись продлевает его на ttl, просроченные строки удаляет
+фоновая задача.
+Чтения обслуживает LRU-кеш в памяти, запись идёт сразу в кеш и в файл.
+Поэтому файлом должен владеть один процесс бота.
+Записи, пришедшие, пока идёт предыдущая, сбрасываются в файл одной
+транзакцией (group commit); вызов возвращается, когда его изменение
+уже записано
+'''
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Mapping
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (BaseStorage, DefaultKeyBuilder,
+                                      StateType, StorageKey)
+from sqlalchemy import (Column, Float, Index, MetaData, String, Table, Text,
+                        delete, select)
+from sqlalchemy.dialects.sqlite import insert
+from cache import LRUCache
+from config import FSM_DB_PATH, FSM_TTL, FSM_EVICT_INTERVAL, FSM_CACHE_SIZE
+from db import create_engine_for
+
+
+logger = logging.getLogger(__name__)
+
+# Своя MetaData: таблица живёт не в файле каталога рецептов
+metadata = MetaData()
+
+fsm_states = Table(
+    'fsm_states', metadata,
+    Column('key', String, primary_key=True),
+    Column('state', String),
+    # JSON без пробелов; NULL — данных нет
+    Column('data', Text),
+    Column('expires_at', Float, nullable=False),
+    Index('ix_fsm_states_expires_at', 'expires_at'),
+    sqlite_with_rowid=False,
+)
+
+
+@dataclass
+class _Record:
+    state: str | None = None
+    data: dict = field(default_factory=dict)
+    expires_at: float = float('inf')
+    # Есть ли строка в файле или она уже в очереди на запись:
+    # пустую запись без строки писать незачем
+    stored: bool = False
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+def _dump(data: dict) -> str | None:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLiteStorage(BaseStorage):
+    '''
+    FSM-хранилище в SQLite с TTL на каждую запись
+    и write-through кешем на cache_size пользователей
+    '''
+
+    def __init__(
+            self, path: str = FSM_DB_PATH, ttl: float = FSM_TTL,
+            evict_interval: float = FSM_EVICT_INTERVAL,
+            cache_size: int = FSM_CACHE_SIZE
+            ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.engine = create_engine_for(url=f'sqlite+aiosqlite:///{path}')
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._key_builder = DefaultKeyBuilder(
+            with_bot_id=True, with_destiny=True
+        )
+        self._cache = LRUCache(cache_size)
+        # Ключи, ждущие записи, и future их общей транзакции
+        self._dirty: dict[str, _Record] = {}
+        self._pending: asyncio.Future | None = None
+        self._flusher = None
+        # Сброс пачки и удаление просроченных не пересекаются
+        self._write_lock = asyncio.Lock()
+        self._ready_lock = asyncio.Lock()
+        self._ready = False
+        self._evictor = None
+        self.evicted = 0
+
+    async def _prepare(self):
+        '''Создаёт таблицу и запускает удаление просроченных записей'''
+        if self._ready:
+            return
+        async with self._ready_lock:
+            if self._ready:
+                return
+            async with self.engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+            self._evictor = asyncio.create_task(self._evict_loop())
+            self._ready = True
+
+    async def _record(self, key: StorageKey) -> tuple[str, _Record]:
+        db_key = self._key_builder.build(key)
+        now = time.time()
+        record = self._cache.get(db_key)
+        if record is not None and record.expires_at > now:
+            return db_key, record
+
+        await self._prepare()
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(
+                select(fsm_states.c.state, fsm_states.c.data,
+                       fsm_states.c.expires_at)
+                .where(fsm_states.c.key == db_key,
+                       fsm_states.c.expires_at > now)
+            )).first()
+
+        # Пока шло чтение, запись могла уже появиться в кеше — она новее
+        cached = self._cache.get(db_key)
+        if (cached is not None and cached is not record
+                and cached.expires_at > now):
+            return db_key, cached
+
+        if row is None:
+            record = _Record()
+        else:
+            record = _Record(
+                row.state, json.loads(row.data) if row.data else {},
+                row.expires_at, stored=True
+            )
+        # Отсутствие строки тоже кешируется: пользователи без диалога
+        # не читают файл на каждом апдейте
+        self._cache.set(db_key, record)
+        return db_key, record
+
+    async def _write(self, db_key: str, record: _Record):
+        if record.is_empty() and not record.stored:
+            return
+        # Очистка, пришедшая во время сброса этой записи, должна
+        # удалить строку, а не пропустить запись
+        record.stored = True
+        self._cache.set(db_key, record)
+        await self._prepare()
+        self._dirty[db_key] = record
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().create_future()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        await asyncio.shield(self._pending)
+
+    async def _flush_loop(self):
+        while self._dirty:
+            batch, self._dirty = self._dirty, {}
+            done, self._pending = self._pending, None
+            try:
+                async with self._write_lock:
+                    await self._flush(batch)
+            except Exception as e:
+                done.set_exception(e)
+                # Если все ожидающие отменены, исключение некому забрать
+                done.exception()
+            else:
+                done.set_result(None)
+
+    async def _flush(self, batch: dict[str, _Record]):
+        '''
+        Пишет пачку записей одной транзакцией. Записи сериализуются
+        в момент сброса, поэтому в файл уходит последнее состояние
+        '''
+        expires_at = time.time() + self.ttl
+        removed = [key for key, record in batch.items() if record.is_empty()]
+        rows = [
+            {'key': key, 'state': record.state, 'data': _dump(record.data),
+             'expires_at': expires_at}
+            for key, record in batch.items() if not record.is_empty()
+        ]
+        async with self.engine.begin() as conn:
+            if removed:
+                await conn.execute(
+                    delete(fsm_states).where(fsm_states.c.key.in_(removed))
+                )
+            if rows:
+                statement = insert(fsm_states)
+                await conn.execute(statement.on_conflict_do_update(
+                    index_elements=[fsm_states.c.key],
+                    set_={
+                        'state': statement.excluded.state,
+                        'data': statement.excluded.data,
+                        'expires_at': statement.excluded.expires_at,
+                    }
+                ), rows)
+
+        for key, record in batch.items():
+            if self._dirty.get(key) is record:
+                # Запись изменилась во время сброса и снова в очереди
+                continue
+            if record.is_empty():
+                record.stored = False
+                record.expires_at = float('inf')
+            else:
+                record.stored = True
+                record.expires_at = expires_at
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._write(db_key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f'Данные FSM должны быть словарём, а не {type(data).__name__}'
+            )
+        db_key, record = await self._record(key)
+        record.data = data.copy()
+        await self._write(db_key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def evict_expired(self) -> int:
+        '''Удаляет просроченные строки, возвращает их число'''
+        await self._prepare()
+        async with self._write_lock:
+            async with self.engine.begin() as conn:
+                result = await conn.execute(
+                    delete(fsm_states)
+                    .where(fsm_states.c.expires_at <= time.time())
+                )
+        # Просроченные записи в кеше не используются (см. _record)
+        self.evicted += result.rowcount
+        return result.rowcount
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            try:
+                removed = await self.evict_expired()
+            except Exception:
+                logger.exception('Ошибка удаления просроченных состояний')
+                continue
+            if removed:
+                logger.info('Удалено просроченных состояний: %s', removed)
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), 'evicted': self.evicted}
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._evictor is not None:
+            self._evictor.cancel()
+            try:
+                await self._evictor
+            except asyncio.CancelledError:
+                pass
+            self._evictor = None
+        self._ready = False
+        await self.engine.dispose()
@@ -1,39 +1,58 @@
 from aiogram import Router, types
-from aiogram.client.bot import Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from sqlalchemy import select, delete
-from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import IntegrityError
-from db import SessionLocal, Recipe, User, ShoppingList
+from cache import recipe_cache
+import callbacks as cb
+from db import SessionLocal
+from favorites import favorites_service
+from metrics import label_handler
+import shopping
 from .states import FindRecipeState, ByIngredientsState
 from utils import (send_random_recipe, start_search_dialog,
                    process_search_query_and_display_results,
                    send_selected_recipe_by_choice,
                    start_by_ingredients_search,
                    process_search_by_ingredients, from_favorites,
-                   send_one_recipe)
+                   send_one_recipe, send_search_page, send_shopping_page)
 from keyboards.inline import (
     main_menu_keyboard, recipe_actions_keyboard,
-    favorites_paginated_keyboard,
-    shopping_list_actions_keyboard
+    favorites_paginated_keyboard
     )
 
 
 user_handlers_router = Router()
+callback_routes = cb.CallbackRoutes()
+
+
+@user_handlers_router.callback_query()
+async def route_callback(callback: types.CallbackQuery, state: FSMContext):
+    '''
+    Все инлайн-кнопки: хендлер выбирается по префиксу callback_data
+    (callbacks.CallbackRoutes), данные разбираются до обращения к БД
+    '''
+    route = callback_routes.resolve(callback.data)
+    if route is None:
+        await callback.answer(
+            'Кнопка устарела, откройте меню заново: /start'
+        )
+        return
+
+    handler, payload = route
+    label_handler(handler.__name__)
+    await handler(callback, payload, state)
 
 
 @user_handlers_router.message(Command('random_recipe'))
 async def random_recipe(message: types.Message,
                         state: FSMContext):
     '''Ручка для выдачи рандомного рецепта пользователю'''
-    send_random_recipe(message, state)
+    await send_random_recipe(message, state)
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data == 'random_recipe_inline'
-        )
+@callback_routes(cb.RandomRecipe)
 async def random_recipe_inline(callback: types.CallbackQuery,
+                               payload: cb.RandomRecipe,
                                state: FSMContext):
     await callback.answer()
     await send_random_recipe(callback.message, state)
@@ -45,10 +64,9 @@ async def find_recipe(message: types.Message, state: FSMContext):
     await start_search_dialog(message, state)
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data == 'find_recipe_inline'
-        )
+@callback_routes(cb.FindRecipe)
 async def find_recipe_inline(callback: types.CallbackQuery,
+                             payload: cb.FindRecipe,
                              state: FSMContext):
     await callback.answer()
     await start_search_dialog(callback.message, state)
@@ -66,17 +84,25 @@ async def process_recipe_choice(message: types.Message, state: FSMContext):
     await send_selected_recipe_by_choice(message, state)
 
 
+@callback_routes(cb.SearchPage)
+async def search_page_handler(
+    callback: types.CallbackQuery, payload: cb.SearchPage, state: FSMContext
+):
+    '''Листание страниц результатов поиска'''
+    await callback.answer()
+    await send_search_page(callback.message, state, payload.page, edit=True)
+
+
 @user_handlers_router.message(Command('by_ingredients'))
 async def find_recipe_by_ingredients(message: types.Message, state: FSMContext):
     '''Ручка поиска по ингредиентам'''
     await start_by_ingredients_search(message, state)
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data == 'by_ingredients_inline'
-        )
+@callback_routes(cb.ByIngredients)
 async def find_recipe_by_ingredients_inline(
     callback: types.CallbackQuery,
+    payload: cb.ByIngredients,
     state: FSMContext
 ):
     await callback.answer()
@@ -95,58 +121,42 @@ async def process_choice(message: types.Message, state: FSMContext):
     await send_selected_recipe_by_choice(message, state)
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data == 'main_menu_inline'
-)
-async def main_menu_inline(callback: types.CallbackQuery, state: FSMContext):
+@callback_routes(cb.MainMenu)
+async def main_menu_inline(
+    callback: types.CallbackQuery, payload: cb.MainMenu, state: FSMContext
+):
     await callback.answer()
-    keyboard = await main_menu_keyboard(state)
+    keyboard = main_menu_keyboard()
     await callback.message.answer(
         'Вы вернулись в главное меню. Выберите действие:',
         reply_markup=keyboard
         )
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data == 'favorites_inline'
-)
-async def favorites_inline(callback: types.CallbackQuery, state: FSMContext):
+@callback_routes(cb.Favorites)
+async def favorites_inline(
+    callback: types.CallbackQuery, payload: cb.Favorites, state: FSMContext
+):
     await from_favorites(callback, state)
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data.startswith('add_favorite:')
-)
+@callback_routes(cb.AddFavorite)
 async def add_favorite(
     callback: types.CallbackQuery,
-    state: FSMContext,
-    bot: Bot
+    payload: cb.AddFavorite,
+    state: FSMContext
 ):
     await callback.answer()
 
     user_id = callback.from_user.id
-
-    try:
-        recipe_id = int(callback.data.split(':')[1])
-    except (IndexError, ValueError):
-        await callback.message.edit_text('Произошла ошибка с данными.')
-        return
+    recipe_id = payload.recipe_id
+    bot = callback.bot
 
     async with SessionLocal() as db:
-        user_result = await db.execute(
-            select(User).options(
-                selectinload(User.favorites_recipes)
-            ).where(User.id == user_id)
-        )
-        recipe_result = await db.execute(
-            select(Recipe).where(Recipe.id == recipe_id)
-        )
-
-        user = user_result.scalars().first()
-        recipe = recipe_result.scalars().first()
+        recipe = await recipe_cache.get(db, recipe_id)
 
-        if user and recipe:
-            if recipe in user.favorites_recipes:
+        if recipe:
+            if await favorites_service.is_favorite(db, user_id, recipe_id):
                 # Рецепт уже в избранном, просто обновляем кнопку
                 await bot.edit_message_reply_markup(
                     chat_id=callback.message.chat.id,
@@ -160,8 +170,7 @@ async def add_favorite(
                 return
 
             try:
-                user.favorites_recipes.append(recipe)
-                await db.commit()
+                await favorites_service.add(db, user_id, recipe_id)
                 await bot.edit_message_reply_markup(
                     chat_id=callback.message.chat.id,
                     message_id=callback.message.message_id,
@@ -179,45 +188,26 @@ async def add_favorite(
                 await callback.answer(f'Произошла неизвестная ошибка: {e}')
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data.startswith('remove_favorite:')
-)
+@callback_routes(cb.RemoveFavorite)
 async def remove_favorite(
     callback: types.CallbackQuery,
-    state: FSMContext,
-    bot: Bot
+    payload: cb.RemoveFavorite,
+    state: FSMContext
                         ):
-    print("Received callback data:", callback.data)  # Отладочная печать
-    try:
-        parts = callback.data.split(':')
-        recipe_id = int(parts[1])
-    except (IndexError, ValueError):
-        return
+    recipe_id = payload.recipe_id
+    user_id = callback.from_user.id
 
     async with SessionLocal() as db:
-        user_result = await db.execute(
-            select(User)
-            .options(selectinload(User.favorites_recipes))
-            .where(User.id == callback.from_user.id)
-        )
-        user = user_result.scalars().first()
+        recipe = await recipe_cache.get(db, recipe_id)
 
-        recipe_result = await db.execute(
-            select(Recipe).where(Recipe.id == recipe_id)
-        )
-        recipe = recipe_result.scalars().first()
-
-        if user and recipe and recipe in user.favorites_recipes:
-            user.favorites_recipes.remove(recipe)
-            await db.commit()
+        if (recipe and await favorites_service.is_favorite(
+                db, user_id, recipe_id)):
+            await favorites_service.remove(db, user_id, recipe_id)
 
-            await db.refresh(user)
-            updated_recipes = user.favorites_recipes
+            favorites_page = await favorites_service.page(db, user_id)
 
-            if updated_recipes:
-                keyboard = await favorites_paginated_keyboard(
-                    updated_recipes, page=0
-                    )
+            if favorites_page.recipes:
+                keyboard = await favorites_paginated_keyboard(favorites_page)
                 await callback.message.edit_text(
                     '⭐️ Ваши избранные рецепты:\n'
                     'Выберите, чтобы посмотреть:',
@@ -226,7 +216,7 @@ async def remove_favorite(
             else:
                 await callback.message.edit_text(
                     'У вас больше нет избранных рецептов 🤷‍♂️',
-                    reply_markup=await main_menu_keyboard(state)
+                    reply_markup=main_menu_keyboard()
                 )
         else:
             await callback.message.answer(
@@ -234,122 +224,79 @@ async def remove_favorite(
             )
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data.startswith('back_to_recipe')
-)
-async def back_to_recipe(callback: types.CallbackQuery, state: FSMContext):
+@callback_routes(cb.BackToRecipe)
+async def back_to_recipe(
+    callback: types.CallbackQuery, payload: cb.BackToRecipe, state: FSMContext
+):
     await callback.answer()
-
-    try:
-        recipe_id = int(callback.data.split(':')[1])
-    except (IndexError, ValueError):
-        keyboard = await main_menu_keyboard(state)
-        await callback.message.answer(
-            'Ошибка при получении ID рецепта... Возвращаю в главное меню',
-            reply_markup=keyboard
-        )
-        return
+    recipe_id = payload.recipe_id
 
     async with SessionLocal() as db:
-        result = await db.execute(select(Recipe).where(Recipe.id == recipe_id))
-        found_recipe = result.scalars().first()
-
-        if found_recipe:
-            user_id = callback.from_user.id
-            user_result = await db.execute(
-                select(User).where(User.id == user_id)
-            )
-            user = user_result.scalars().first()
-            is_favorite = found_recipe in user.favorites_recipes if user else False
-
-            await send_one_recipe(
-                callback.message, found_recipe, is_favorite, state
-            )
+        found_recipe = await recipe_cache.get(db, recipe_id)
+        is_favorite = await favorites_service.is_favorite(
+            db, callback.from_user.id, recipe_id
+        ) if found_recipe else False
+
+    if found_recipe:
+        await send_one_recipe(
+            callback.message, found_recipe, is_favorite, state
+        )
 
-            await state.clear()
-        else:
-            keyboard = await main_menu_keyboard(state)
+        await state.clear()
+    else:
+        keyboard = main_menu_keyboard()
 
-            await callback.message.answer(
-                'Произошла внутренняя ошибка...\n'
-                'Возвращаю в главное меню...',
-                reply_markup=keyboard
-            )
+        await callback.message.answer(
+            'Произошла внутренняя ошибка...\n'
+            'Возвращаю в главное меню...',
+            reply_markup=keyboard
+        )
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data.startswith('view_recipe:')
-        )
-async def view_recipe(callback: types.CallbackQuery, state: FSMContext):
+@callback_routes(cb.ViewRecipe)
+async def view_recipe(
+    callback: types.CallbackQuery, payload: cb.ViewRecipe, state: FSMContext
+):
     await callback.answer()
-
-    try:
-        parts = callback.data.split(':')
-        recipe_id = int(parts[1])
-        page_from_list = int(parts[2])
-    except (IndexError, ValueError):
-        return
+    recipe_id = payload.recipe_id
 
     async with SessionLocal() as db:
-        recipe_result = await db.execute(
-            select(Recipe).where(Recipe.id == recipe_id)
+        found_recipe = await recipe_cache.get(db, recipe_id)
+        is_favorite = await favorites_service.is_favorite(
+            db, callback.from_user.id, recipe_id
+        ) if found_recipe else False
+
+    if found_recipe:
+        await send_one_recipe(
+            callback.message,
+            found_recipe,
+            is_favorite,
+            state,
+            page=payload.page,
+            page_start=payload.page_start
         )
-        found_recipe = recipe_result.scalars().first()
 
-        user_result = await db.execute(
-            select(User)
-            .options(selectinload(User.favorites_recipes))
-            .where(User.id == callback.from_user.id)
+        await state.clear()
+    else:
+        await callback.message.answer(
+            'К сожалению, рецепт не найден.'
         )
-        user = user_result.scalars().first()
-        is_favorite = found_recipe in user.favorites_recipes if user and found_recipe else False
-
-        if found_recipe:
-            await send_one_recipe(
-                callback.message,
-                found_recipe,
-                is_favorite,
-                state,
-                page=page_from_list
-            )
-
-            await state.clear()
-        else:
-            await callback.message.answer(
-                'К сожалению, рецепт не найден.'
-            )
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data.startswith('favorites_page:')
-        )
+@callback_routes(cb.FavoritesPage)
 async def favorites_page_handler(
-    callback: types.CallbackQuery, state: FSMContext
+    callback: types.CallbackQuery, payload: cb.FavoritesPage,
+    state: FSMContext
                 ):
     await callback.answer()
 
-    try:
-        page = int(callback.data.split(':')[1])
-    except (IndexError, ValueError):
-        keyboard = await main_menu_keyboard(state)
-        await callback.message.answer(
-            'Произошла ошибка, возвращаюсь в главное меню.',
-            reply_markup=keyboard
-        )
-        return
-
     async with SessionLocal() as db:
-        user_result = await db.execute(
-            select(User).options(selectinload(User.favorites_recipes))
-            .where(User.id == callback.from_user.id)
+        favorites_page = await favorites_service.page(
+            db, callback.from_user.id, payload.page, **payload.cursor_kwargs
         )
-        user = user_result.scalars().first()
 
-    if user and user.favorites_recipes:
-        keyboard = await favorites_paginated_keyboard(
-            user.favorites_recipes,
-            page=page
-        )
+    if favorites_page.recipes:
+        keyboard = await favorites_paginated_keyboard(favorites_page)
 
         await callback.bot.edit_message_reply_markup(
             chat_id=callback.message.chat.id,
@@ -358,155 +305,107 @@ async def favorites_page_handler(
         )
     else:
         # Если список избранного внезапно стал пустым
-        keyboard = await main_menu_keyboard(state)
+        keyboard = main_menu_keyboard()
         await callback.message.answer(
             'У вас больше нет избранных рецептов 🤷‍♂️',
             reply_markup=keyboard
         )
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data.startswith('add_to_shopping_list')
-        )
+@callback_routes(cb.AddToShoppingList)
 async def add_to_shopping_list_handler(
-    callback: types.CallbackQuery, state: FSMContext
+    callback: types.CallbackQuery, payload: cb.AddToShoppingList,
+    state: FSMContext
                 ):
-    await callback.answer('Ингредиенты добавлены в список покупок')
+    await callback.answer()
 
     user_id = callback.from_user.id
-    try:
-        recipe_id = int(callback.data.split(':')[1])
-    except (IndexError, ValueError):
-        await callback.message.edit_text(
-            'Произошла ошибка с данными... Попробуйте ещё раз'
-        )
-        return
+    recipe_id = payload.recipe_id
 
     async with SessionLocal() as db:
-        recipe_result = await db.execute(
-            select(Recipe).where(Recipe.id == recipe_id)
-        )
-        found_recipe = recipe_result.scalars().first()
+        found_recipe = await recipe_cache.get(db, recipe_id)
 
         if found_recipe:
-            ingredients_text = found_recipe.ingredients_ru
-            ingredients_list = [
-                item.strip() for item in ingredients_text.split('\n') if item.strip()
-            ]
-
-            for item in ingredients_list:
-                new_item = ShoppingList(user_id=user_id, item_name=item)
-                db.add(new_item)
-            await db.commit()
+            ingredients = await shopping.recipe_ingredients(
+                db, recipe_id, found_recipe.ingredients_ru
+            )
+            added = await shopping.add_recipe(
+                db, user_id, recipe_id, ingredients
+            )
 
             await callback.message.answer(
-                'Список покупок обновлен!',
-                reply_markup=await main_menu_keyboard(state)
+                'Список покупок обновлен!' if added else
+                'Ингредиенты этого рецепта уже в списке покупок',
+                reply_markup=main_menu_keyboard()
             )
         else:
-            callback.message.answer(
+            await callback.message.answer(
                 'Сожалею, но рецепт не найден...'
             )
 
 
-@user_handlers_router.callback_query(
-        lambda c: c.data.startswith('view_shopping_list')
-        )
+@callback_routes(cb.ShoppingList)
 async def view_shopping_list_handler(
-    callback: types.CallbackQuery, state: FSMContext
+    callback: types.CallbackQuery, payload: cb.ShoppingList,
+    state: FSMContext
                 ):
     await callback.answer()
+    await send_shopping_page(callback, state)
 
-    user_id = callback.from_user.id
 
-    async with SessionLocal() as db:
-        shopping_list_result = await db.execute(
-            select(ShoppingList).where(
-                ShoppingList.user_id == user_id
-            )
-        )
-        shopping_items = shopping_list_result.scalars().all()
-
-        if not shopping_items:
-            await callback.message.edit_text(
-                'Ваш список покупок пуст. Добавьте в него'
-                ' ингредиенты из избранных рецептов',
-                reply_markup=await main_menu_keyboard(state)
-            )
-            return
-
-        items_text = '\n'.join([
-            f'~~{item.item_name}~~' if item.is_purchased else f'• {item.item_name}' 
-            for item in shopping_items
-        ])
-        try:
-            await callback.message.edit_text(
-                f'<b>🛒 Ваш список покупок</b>:\n'
-                'Купленные ингредиенты отмечайте кнопкой ☑️ '
-                '(для отмены нажмите на ингредиент еще раз)\n'
-                'Чтобы удалить ингредиент из списка (безвозвратно!), нажмите ❌\n\n'
-                f'{items_text}\n\n'
-                'Чтобы удалить весь список, нажмите кнопку ниже.',
-                reply_markup=await shopping_list_actions_keyboard(
-                    shopping_items
-                    ),
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            await callback.message.answer(
-                f'Произошла ошибка при обновлении списка: {e}'
-            )
+@callback_routes(cb.ShoppingPage)
+async def shopping_page_handler(
+    callback: types.CallbackQuery, payload: cb.ShoppingPage,
+    state: FSMContext
+                ):
+    await callback.answer()
+    await send_shopping_page(callback, state, payload.page)
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data.startswith('clear_shopping_list')
-    )
+@callback_routes(cb.ClearShoppingList)
 async def clear_shopping_list_handler(
-    callback: types.CallbackQuery, state: FSMContext
+    callback: types.CallbackQuery, payload: cb.ClearShoppingList,
+    state: FSMContext
                 ):
     await callback.answer('Список покупок очищен полностью!')
 
     user_id = callback.from_user.id
 
     async with SessionLocal() as db:
-        await db.execute(
-            delete(ShoppingList).where(ShoppingList.user_id == user_id)
-        )
-        await db.commit()
+        await shopping.clear(db, user_id)
 
         await callback.message.edit_text(
             'Ваш список покупок полностью очищен! ✅',
-            reply_markup=await main_menu_keyboard(state)
+            reply_markup=main_menu_keyboard()
         )
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data.startswith('toggle_purchased:')
-    )
+@callback_routes(cb.TogglePurchased)
 async def toggle_purchased_item(
-    callback: types.CallbackQuery, state: FSMContext
+    callback: types.CallbackQuery, payload: cb.TogglePurchased,
+    state: FSMContext
         ):
-    item_id = int(callback.data.split(':')[1])
+    await callback.answer()
+    item_id, page = payload.item_id, payload.page
 
     async with SessionLocal() as db:
-        item = await db.get(ShoppingList, item_id)
-        if item:
-            item.is_purchased = not item.is_purchased
-            await db.commit()
+        is_purchased = await shopping.toggle_item(
+            db, callback.from_user.id, item_id
+        )
 
-    await view_shopping_list_handler(callback, state)
+    toggled = (item_id, is_purchased) if is_purchased is not None else None
+    await send_shopping_page(callback, state, page, toggled)
 
 
-@user_handlers_router.callback_query(
-    lambda c: c.data.startswith('delete_item:')
-)
-async def delete_shopping_list_item(callback: types.CallbackQuery, state: FSMContext):
-    item_id = int(callback.data.split(':')[1])
+@callback_routes(cb.DeleteItem)
+async def delete_shopping_list_item(
+    callback: types.CallbackQuery, payload: cb.DeleteItem, state: FSMContext
+):
+    await callback.answer()
+    item_id, page = payload.item_id, payload.page
 
     async with SessionLocal() as db:
-        await db.execute(
-            delete(ShoppingList).where(ShoppingList.id == item_id)
-        )
-        await db.commit()
+        await shopping.delete_item(db, callback.from_user.id, item_id)
 
-    await view_shopping_list_handler(callback, state)
+    # Строки сдвинулись — страница перечитывается из БД
+    await send_shopping_page(callback, state, page)
@@ -0,0 +1,177 @@
+'''
+Разбор строк ингредиентов "название (мера)" на название, количество
+и единицу измерения и сложение одинаковых ингредиентов.
+
+Модуль не зависит от БД: его используют и импорт каталога,
+и миграции схемы, и список покупок
+'''
+
+import re
+from dataclasses import dataclass
+
+
+AMOUNT_RE = re.compile(
+    r'''^\s*(?:
+        (?P<whole>\d+)\s+(?P<mixed_num>\d+)\s*/\s*(?P<mixed_den>\d+)
+      | (?P<num>\d+)\s*/\s*(?P<den>\d+)
+      | (?P<number>\d+(?:[.,]\d+)?)
+      | (?P<vulgar>[½¼¾⅓⅔])
+    )
+    # Диапазон "2-3": берём нижнюю границу
+    (?:\s*[-–]\s*\d+(?:[.,]\d+)?)?
+    \s*(?P<rest>.*)$''',
+    re.X
+)
+LINE_RE = re.compile(r'^(?P<name>.*?)\s*\((?P<measure>[^()]*)\)$')
+
+VULGAR_FRACTIONS = {'½': 0.5, '¼': 0.25, '¾': 0.75, '⅓': 1 / 3, '⅔': 2 / 3}
+
+# Написание единицы -> (каноническая единица, множитель).
+# Пустая единица — штуки
+UNIT_ALIASES = {}
+for _unit, _factor, _aliases in (
+    ('г', 1, ('г', 'гр', 'грамм', 'грамма', 'граммов',
+              'g', 'gr', 'gram', 'grams')),
+    ('г', 1000, ('кг', 'килограмм', 'килограмма', 'kg')),
+    ('г', 28.35, ('унция', 'унции', 'унций', 'oz')),
+    ('г', 453.6, ('фунт', 'фунта', 'фунтов', 'lb', 'lbs')),
+    ('мл', 1, ('мл', 'ml')),
+    ('мл', 1000, ('л', 'литр', 'литра', 'литров', 'l', 'litre', 'liter')),
+    ('ч. л.', 1, ('ч. л', 'ч.л', 'ч л', 'чайная ложка', 'чайной ложки',
+                  'чайные ложки', 'чайных ложек', 'чайную ложку',
+                  'tsp', 'teaspoon', 'teaspoons')),
+    ('ст. л.', 1, ('ст. л', 'ст.л', 'ст л', 'столовая ложка',
+                   'столовой ложки', 'столовые ложки', 'столовых ложек',
+                   'столовую ложку', 'tbsp', 'tbs', 'tbl', 'tblsp',
+                   'tablespoon', 'tablespoons')),
+    ('стакан', 1, ('стакан', 'стакана', 'стаканов', 'чашка', 'чашки',
+                   'чашек', 'чашку', 'cup', 'cups')),
+    ('щепотка', 1, ('щепотка', 'щепотки', 'щепоток', 'пинч', 'pinch')),
+    # "гвоздика" в мере — машинный перевод clove (зубчик чеснока)
+    ('зубчик', 1, ('зубчик', 'зубчика', 'зубчиков', 'гвоздика', 'гвоздики',
+                   'clove', 'cloves')),
+    ('банка', 1, ('банка', 'банки', 'банок', 'can', 'tin')),
+    ('', 1, ('шт', 'штука', 'штуки', 'штук')),
+):
+    for _alias in _aliases:
+        UNIT_ALIASES[_alias] = (_unit, _factor)
+
+# Крупные единицы для показа: 1500 г -> 1,5 кг
+DISPLAY_UNITS = {'г': ('кг', 1000), 'мл': ('л', 1000)}
+
+
+@dataclass
+class Ingredient:
+    '''
+    Ингредиент с количеством.
+    quantity=None — мера не разобрана, тогда её текст хранится в unit
+    ("по вкусу", "для жарки")
+    '''
+    name: str
+    quantity: float | None
+    unit: str
+
+    @property
+    def key(self) -> str:
+        return ingredient_key(self.name)
+
+    def __str__(self):
+        amount = format_amount(self.quantity, self.unit)
+        return f'{self.name} ({amount})' if amount else self.name
+
+
+def ingredient_key(name: str) -> str:
+    '''Ключ для сравнения названий: регистр, ё и пробелы не важны'''
+    return ' '.join(name.lower().replace('ё', 'е').split())
+
+
+def _normalize_unit(text: str) -> tuple[str, float] | None:
+    text = ' '.join(text.lower().replace('.', ' ').split())
+    if text in UNIT_ALIASES:
+        return UNIT_ALIASES[text]
+    words = text.split()
+    # "2 столовые ложки нарезанного" — единица в начале, дальше пояснение
+    for length in (2, 1):
+        prefix = ' '.join(words[:length])
+        if len(words) >= length and prefix in UNIT_ALIASES:
+            return UNIT_ALIASES[prefix]
+    return None
+
+
+def parse_measure(measure: str) -> tuple[float | None, str]:
+    '''"1 1/2 ст. л." -> (1.5, 'ст. л.'), "по вкусу" -> (None, 'по вкусу')'''
+    measure = measure.strip()
+    match = AMOUNT_RE.match(measure)
+    if not measure or not match:
+        return None, measure.lower()
+
+    if match['whole']:
+        quantity = int(match['whole']) + _fraction(
+            match['mixed_num'], match['mixed_den']
+        )
+    elif match['num']:
+        quantity = _fraction(match['num'], match['den'])
+    elif match['number']:
+        quantity = float(match['number'].replace(',', '.'))
+    else:
+        quantity = VULGAR_FRACTIONS[match['vulgar']]
+
+    # "75g/3oz" — после косой черты та же мера в других единицах
+    rest = match['rest'].split('/')[0].strip()
+    if not rest:
+        return quantity, ''
+    unit = _normalize_unit(rest)
+    if unit is None:
+        return quantity, rest.lower()
+    return quantity * unit[1], unit[0]
+
+
+def _fraction(numerator: str, denominator: str) -> float:
+    denominator = int(denominator)
+    return int(numerator) / denominator if denominator else 0.0
+
+
+def parse_ingredient_line(line: str) -> Ingredient:
+    '''"Пикша (600 г)" -> Ingredient('Пикша', 600.0, 'г')'''
+    line = line.strip()
+    match = LINE_RE.match(line)
+    if not match:
+        return Ingredient(line, None, '')
+    quantity, unit = parse_measure(match['measure'])
+    return Ingredient(match['name'] or line, quantity, unit)
+
+
+def parse_ingredients(text: str | None) -> list[Ingredient]:
+    '''Ингредиенты рецепта построчно, пустые строки пропускаются'''
+    return [
+        parse_ingredient_line(line)
+        for line in (text or '').split('\n') if line.strip()
+    ]
+
+
+def aggregate_ingredients(items: list[Ingredient]) -> list[Ingredient]:
+    '''
+    Складывает одинаковые ингредиенты в одинаковых единицах.
+    Порядок — по первому появлению, название — первое встреченное
+    '''
+    merged = {}
+    for item in items:
+        key = (item.key, item.unit)
+        if key not in merged:
+            merged[key] = Ingredient(item.name, item.quantity, item.unit)
+        elif item.quantity is not None:
+            current = merged[key]
+            current.quantity = (current.quantity or 0) + item.quantity
+    return list(merged.values())
+
+
+def format_amount(quantity: float | None, unit: str) -> str:
+    '''(1500.0, 'г') -> '1,5 кг', (2.0, '') -> '2'; без количества — текст меры'''
+    if quantity is None:
+        return unit
+    if unit in DISPLAY_UNITS:
+        big_unit, factor = DISPLAY_UNITS[unit]
+        if quantity >= factor:
+            quantity, unit = quantity / factor, big_unit
+    number = f'{round(quantity, 2):g}'.replace('.', ',')
+    return f'{number} {unit}' if unit else number
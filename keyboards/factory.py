@@ -0,0 +1,88 @@
+'''
+Кеш готовых инлайн-клавиатур.
+
+Клавиатура без параметров строится один раз за жизнь процесса,
+параметризованная — один раз на набор параметров и хранится в LRU.
+Разметка после построения не меняется, поэтому один объект
+безопасно отдавать во все ответы
+'''
+
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Hashable
+from aiogram.types import InlineKeyboardMarkup
+from cache import LRUCache
+from config import KEYBOARD_CACHE_SIZE
+
+
+@dataclass
+class KeyboardStats:
+    '''Счётчики одной клавиатуры'''
+    builds: int = 0
+    hits: int = 0
+    build_seconds: float = 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        '''Сколько времени заняли бы построения, отданные из кеша'''
+        if not self.builds:
+            return 0.0
+        return self.hits * self.build_seconds / self.builds
+
+
+class KeyboardFactory:
+    '''Строит и кеширует клавиатуры; report() — метрики bot_keyboard_cache'''
+
+    def __init__(self, cache_size: int = KEYBOARD_CACHE_SIZE):
+        self._static = {}
+        self._cache = LRUCache(cache_size)
+        self.stats = defaultdict(KeyboardStats)
+
+    def static(
+            self, name: str, build: Callable[[], InlineKeyboardMarkup]
+            ) -> InlineKeyboardMarkup:
+        '''Клавиатура без параметров'''
+        markup = self._static.get(name)
+        if markup is None:
+            markup = self._static[name] = self._build(name, build)
+        else:
+            self.stats[name].hits += 1
+        return markup
+
+    def cached(
+            self, name: str, build: Callable[..., InlineKeyboardMarkup],
+            *args: Hashable
+            ) -> InlineKeyboardMarkup:
+        '''Клавиатура build(*args), закешированная по (name, args)'''
+        key = (name, args)
+        markup = self._cache.get(key)
+        if markup is None:
+            markup = self._build(name, build, *args)
+            self._cache.set(key, markup)
+        else:
+            self.stats[name].hits += 1
+        return markup
+
+    def _build(self, name: str, build: Callable, *args) -> InlineKeyboardMarkup:
+        started = time.perf_counter()
+        markup = build(*args)
+        stats = self.stats[name]
+        stats.build_seconds += time.perf_counter() - started
+        stats.builds += 1
+        return markup
+
+    def report(self) -> dict[str, dict]:
+        '''Счётчики по клавиатурам для метрик'''
+        return {
+            name: {
+                'builds': stats.builds,
+                'hits': stats.hits,
+                'build_seconds': stats.build_seconds,
+                'saved_seconds': stats.saved_seconds,
+            }
+            for name, stats in self.stats.items()
+        }
+
+
+keyboard_factory = KeyboardFactory()
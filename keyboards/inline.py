@@ -1,43 +1,54 @@
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.fsm.context import FSMContext
-from db import Recipe
+import callbacks as cb
+from favorites import FavoritesPage
+from keyboards.factory import keyboard_factory
+from shopping import ShoppingPage
+
+
+def main_menu_keyboard(last_recipe_id: int | None = None):
+    '''
+    Инлайн-клава главного меню. Строится один раз,
+    вариант с кнопкой «Назад» — один раз на рецепт
+    '''
+    if last_recipe_id is None:
+        return keyboard_factory.static('main_menu', _build_main_menu)
+    return keyboard_factory.cached(
+        'main_menu_back', _build_main_menu, last_recipe_id
+    )
 
 
-async def main_menu_keyboard(state: FSMContext):
+def _build_main_menu(last_recipe_id: int | None = None):
     '''Создание инлайн-клавы главного меню'''
     builder = InlineKeyboardBuilder()
 
     builder.button(
         text='🔍 Найти рецепт',
-        callback_data='find_recipe_inline'
+        callback_data=cb.FindRecipe().pack()
         )
     builder.button(
         text='📜 Случайный рецепт',
-        callback_data='random_recipe_inline'
+        callback_data=cb.RandomRecipe().pack()
         )
     builder.button(
         text='🥦 Поиск рецепта по ингредиентам',
-        callback_data='by_ingredients_inline'
+        callback_data=cb.ByIngredients().pack()
         )
     builder.button(
         text='⭐️ Избранное',
-        callback_data='favorites_inline'
+        callback_data=cb.Favorites().pack()
         )
     builder.button(
         text='🛒 Список покупок',
-        callback_data='view_shopping_list'
+        callback_data=cb.ShoppingList().pack()
         )
 
     builder.adjust(2, 1, 2)
 
-    user_data = await state.get_data()
-    last_recipe_id = user_data.get('last_recipe_id')
-
     if last_recipe_id:
         builder.button(
             text='🔙 Назад',
-            callback_data=f'back_to_recipe:{last_recipe_id}'
+            callback_data=cb.BackToRecipe(last_recipe_id).pack()
             )
         builder.adjust(1, 2, 1, 2)
 
@@ -45,53 +56,67 @@ async def main_menu_keyboard(state: FSMContext):
 
 
 def recipe_actions_keyboard(
-        is_favorite: bool, recipe_id: int, page: int = None
+        is_favorite: bool, recipe_id: int, page: int = None,
+        page_start: int = None
+        ):
+    '''Инлайн-клава для действий с рецептом (кешируется по параметрам)'''
+    return keyboard_factory.cached(
+        'recipe_actions', _build_recipe_actions,
+        is_favorite, recipe_id, page, page_start
+    )
+
+
+def _build_recipe_actions(
+        is_favorite: bool, recipe_id: int, page: int | None,
+        page_start: int | None
         ):
-    '''Инлайн-клава для действий с рецептом'''
     builder = InlineKeyboardBuilder()
     if is_favorite:
         builder.button(
             text='❌ Удалить из избранного',
-            callback_data=f'remove_favorite:{recipe_id}'
+            callback_data=cb.RemoveFavorite(recipe_id).pack()
         )
         builder.button(
             text='🛒 Добавить ингредиенты в список покупок',
-            callback_data=f'add_to_shopping_list:{recipe_id}'
+            callback_data=cb.AddToShoppingList(recipe_id).pack()
         )
     else:
         builder.button(
             text='💾 Добавить в избранное',
-            callback_data=f'add_favorite:{recipe_id}'
+            callback_data=cb.AddFavorite(recipe_id).pack()
         )
 
     if page is not None:
+        cursor = f'f{page_start}' if page_start is not None else ''
         builder.button(
             text='⬅️ Назад к списку',
-            callback_data=f'favorites_page:{page}'
+            callback_data=cb.FavoritesPage(page, cursor).pack()
         )
 
     builder.button(
             text='Ⓜ️ Главное меню',
-            callback_data='main_menu_inline'
+            callback_data=cb.MainMenu().pack()
         )
 
     builder.adjust(1)
     return builder.as_markup()
 
 
-async def favorites_paginated_keyboard(
-        recipes: list[Recipe], page: int, per_page: int = 5
-        ):
+async def favorites_paginated_keyboard(favorites_page: FavoritesPage):
+    '''
+    Инлайн-клава одной страницы избранного.
+    Навигация передаёт keyset-курсоры: a — после позиции, b — перед ней
+    '''
     builder = InlineKeyboardBuilder()
 
-    start_index = page * per_page
-    end_index = start_index + per_page
-    current_recipes = recipes[start_index:end_index]
+    page = favorites_page.page
 
-    for recipe in current_recipes:
+    for recipe_id, name_ru in favorites_page.recipes:
         builder.button(
-            text=recipe.name_ru,
-            callback_data=f'view_recipe:{recipe.id}:{page}'
+            text=name_ru,
+            callback_data=cb.ViewRecipe(
+                recipe_id, page, favorites_page.first_position
+            ).pack()
         )
 
     builder.adjust(1)
@@ -101,55 +126,117 @@ async def favorites_paginated_keyboard(
     next_page_number = page + 1
     previous_page_number = page - 1
 
-    if end_index < len(recipes): 
+    if favorites_page.has_next:
         nav_buttons.append(InlineKeyboardButton(
             text='Далее➡️',
-            callback_data=f'favorites_page:{next_page_number}'
+            callback_data=cb.FavoritesPage(
+                next_page_number, f'a{favorites_page.last_position}'
+            ).pack()
             )
         )
 
-    if page > 0:
+    if favorites_page.has_prev:
         nav_buttons.append(InlineKeyboardButton(
             text='Назад⬅️',
-            callback_data=f'favorites_page:{previous_page_number}'
+            callback_data=cb.FavoritesPage(
+                previous_page_number, f'b{favorites_page.first_position}'
+            ).pack()
             )
         )
 
     if nav_buttons:
         builder.row(*nav_buttons)
 
-    builder.button(
-        text='⬅️ Главное меню', callback_data='main_menu_inline'
+    builder.row(InlineKeyboardButton(
+        text='⬅️ Главное меню', callback_data=cb.MainMenu().pack()
+        ))
+
+    return builder.as_markup()
+
+
+def search_results_keyboard(page: int, page_count: int):
+    '''Навигация по страницам результатов поиска'''
+    return keyboard_factory.cached(
+        'search_results', _build_search_results, page, page_count
+    )
+
+
+def _build_search_results(page: int, page_count: int):
+    builder = InlineKeyboardBuilder()
+
+    nav_buttons = []
+
+    if page + 1 < page_count:
+        nav_buttons.append(InlineKeyboardButton(
+            text='Далее➡️',
+            callback_data=cb.SearchPage(page + 1).pack()
+            )
+        )
+
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(
+            text='Назад⬅️',
+            callback_data=cb.SearchPage(page - 1).pack()
+            )
         )
 
+    if nav_buttons:
+        builder.row(*nav_buttons)
+
+    builder.row(InlineKeyboardButton(
+        text='⬅️ Главное меню', callback_data=cb.MainMenu().pack()
+        ))
+
     return builder.as_markup()
 
 
-async def shopping_list_actions_keyboard(items: list):
+def shopping_list_actions_keyboard(shopping_page: ShoppingPage):
+    '''
+    Клава одной страницы списка покупок: строка и кнопка удаления
+    в одном ряду, номер страницы передаётся в callback_data
+    '''
     builder = InlineKeyboardBuilder()
+    page = shopping_page.page
 
-    for item in items:
+    for item in shopping_page.items:
         status_symbol = '☑️' if not item.is_purchased else '✅'
-        builder.button(
-            text=f'{status_symbol} {item.item_name}',
-            callback_data=f'toggle_purchased:{item.id}'
+        builder.row(
+            InlineKeyboardButton(
+                text=f'{status_symbol} {item.text}',
+                callback_data=cb.TogglePurchased(item.id, page).pack()
+            ),
+            InlineKeyboardButton(
+                text='❌',
+                callback_data=cb.DeleteItem(item.id, page).pack()
+            )
         )
 
-        builder.button(
-            text='❌',
-            callback_data=f'delete_item:{item.id}'
+    nav_buttons = []
+
+    if page + 1 < shopping_page.page_count:
+        nav_buttons.append(InlineKeyboardButton(
+            text='Далее➡️',
+            callback_data=cb.ShoppingPage(page + 1).pack()
+            )
         )
 
-    builder.button(
-        text='🗑️ Очистить весь список',
-        callback_data='clear_shopping_list'
-    )
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(
+            text='Назад⬅️',
+            callback_data=cb.ShoppingPage(page - 1).pack()
+            )
+        )
 
-    builder.button(
+    if nav_buttons:
+        builder.row(*nav_buttons)
+
+    builder.row(InlineKeyboardButton(
+        text='🗑️ Очистить весь список',
+        callback_data=cb.ClearShoppingList().pack()
+        ))
+    builder.row(InlineKeyboardButton(
         text='⬅️ Главное меню',
-        callback_data='main_menu_inline'
-    )
+        callback_data=cb.MainMenu().pack()
+        ))
 
-    builder.adjust(2, repeat=True)
-    builder.adjust(1)
     return builder.as_markup()
@@ -0,0 +1,293 @@
+'''
+Метрики бота в текстовом формате Prometheus.
+
+По каждому хендлеру собираются гистограммы: время выполнения,
+число SQL-запросов и время в БД (через события SQLAlchemy), число
+запросов к Telegram. Запросы к БД и Telegram относятся к хендлеру
+через ContextVar: они выполняются в той же задаче asyncio.
+Метрики отдаются по HTTP на METRICS_HOST:METRICS_PORT/metrics
+'''
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Iterable
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import METRICS_HOST, METRICS_PORT
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def _escape(value) -> str:
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in sorted(self._values.items()):
+            yield (f'{self.name}{_labels(self.labels, label_values)} '
+                   f'{_number(value)}')
+
+
+class Histogram:
+    '''Гистограмма с фиксированными границами корзин'''
+
+    def __init__(
+            self, name: str, help: str, labels: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = SECONDS_BUCKETS
+            ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label_values -> [счётчики корзин (+Inf последней), сумма]
+        self._series = {}
+
+    def observe(self, *label_values, value: float):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [
+                [0] * (len(self.buckets) + 1), 0.0
+            ]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        names = self.labels + ('le',)
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                yield (f'{self.name}_bucket'
+                       f'{_labels(names, label_values + (le,))} {cumulative}')
+            labels = _labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {_number(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauges:
+    '''Значения, которые читаются из объектов бота в момент запроса метрик'''
+
+    def __init__(
+            self, name: str, help: str, labels: tuple[str, ...],
+            collect: Callable[[], Iterable[tuple[tuple, float]]]
+            ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        for label_values, value in self.collect():
+            yield (f'{self.name}{_labels(self.labels, label_values)} '
+                   f'{_number(value)}')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.register(Histogram(
+    'bot_handler_duration_seconds', 'Время выполнения хендлера',
+    ('handler',)
+))
+HANDLER_DB_STATEMENTS = registry.register(Histogram(
+    'bot_handler_db_statements', 'SQL-запросов за вызов хендлера',
+    ('handler',), COUNT_BUCKETS
+))
+HANDLER_DB_SECONDS = registry.register(Histogram(
+    'bot_handler_db_seconds', 'Время SQL-запросов за вызов хендлера',
+    ('handler',)
+))
+HANDLER_TELEGRAM_CALLS = registry.register(Histogram(
+    'bot_handler_telegram_calls', 'Запросов к Telegram за вызов хендлера',
+    ('handler',), COUNT_BUCKETS
+))
+HANDLER_ERRORS = registry.register(Counter(
+    'bot_handler_errors_total', 'Хендлеры, завершившиеся исключением',
+    ('handler',)
+))
+TELEGRAM_REQUESTS = registry.register(Counter(
+    'bot_telegram_requests_total', 'Запросы к Bot API по методам',
+    ('method',)
+))
+
+
+@dataclass
+class HandlerStats:
+    '''Счётчики одного вызова хендлера'''
+    # Имя в метках; общий хендлер может уточнить его (label_handler)
+    handler: str = ''
+    db_statements: int = 0
+    db_seconds: float = 0.0
+    telegram_calls: int = 0
+
+
+current_stats: ContextVar[HandlerStats | None] = ContextVar(
+    'handler_stats', default=None
+)
+
+
+def label_handler(name: str):
+    '''Метрики текущего вызова пишутся под именем name'''
+    stats = current_stats.get()
+    if stats is not None:
+        stats.handler = name
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info['query_started'].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.db_statements += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def _handle_error(context):
+    # after_cursor_execute для упавшего запроса не вызывается
+    if context.connection is not None:
+        started = context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+
+def instrument_engine(sync_engine: Engine):
+    '''Подключает подсчёт SQL-запросов к движку (engine.sync_engine)'''
+    if not event.contains(sync_engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(sync_engine, 'before_cursor_execute',
+                     _before_cursor_execute)
+        event.listen(sync_engine, 'after_cursor_execute',
+                     _after_cursor_execute)
+        event.listen(sync_engine, 'handle_error', _handle_error)
+
+
+def observe_handler(
+        handler: str, seconds: float, stats: HandlerStats, failed: bool
+        ):
+    HANDLER_SECONDS.observe(handler, value=seconds)
+    HANDLER_DB_STATEMENTS.observe(handler, value=stats.db_statements)
+    HANDLER_DB_SECONDS.observe(handler, value=stats.db_seconds)
+    HANDLER_TELEGRAM_CALLS.observe(handler, value=stats.telegram_calls)
+    if failed:
+        HANDLER_ERRORS.inc(handler)
+
+
+def register_cache_gauges():
+    '''Состояние кешей процесса: рецепты, карточки, клавиатуры'''
+    from cache import recipe_cache
+    from keyboards.factory import keyboard_factory
+
+    def recipe_caches():
+        for cache_name, stats in (('recipes', recipe_cache.stats()),
+                                  ('cards', recipe_cache.card_stats())):
+            for stat, value in stats.items():
+                yield (cache_name, stat), value
+
+    def keyboards():
+        for name, stats in keyboard_factory.report().items():
+            for stat, value in stats.items():
+                yield (name, stat), value
+
+    registry.register(Gauges(
+        'bot_recipe_cache', 'Кеш рецептов и карточек', ('cache', 'stat'),
+        recipe_caches
+    ))
+    registry.register(Gauges(
+        'bot_keyboard_cache', 'Кеш клавиатур', ('keyboard', 'stat'),
+        keyboards
+    ))
+
+
+def register_outbound_gauges(queue):
+    '''Счётчики очереди исходящих сообщений (middlewares.OutboundQueue)'''
+    registry.register(Gauges(
+        'bot_outbound_queue', 'Очередь исходящих сообщений', ('stat',),
+        lambda: (((stat,), value) for stat, value in queue.stats().items())
+    ))
+
+
+def register_fsm_gauges(storage):
+    '''Кеш и удаление просроченных состояний (fsm_storage.SQLiteStorage)'''
+    registry.register(Gauges(
+        'bot_fsm_storage', 'Хранилище состояний диалогов', ('stat',),
+        lambda: (((stat,), value) for stat, value in storage.stats().items())
+    ))
+
+
+async def start_metrics_server(
+        host: str = METRICS_HOST, port: int = METRICS_PORT
+        ) -> web.AppRunner | None:
+    '''HTTP-сервер с /metrics. port=0 — метрики не публикуются'''
+    if not port:
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={'Content-Type': CONTENT_TYPE}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,6 @@
+from middlewares.metrics import MetricsMiddleware, TelegramCallsMiddleware
+from middlewares.outbound import OutboundQueue, bulk_sends
+from middlewares.registration import UserRegistrationMiddleware
+
+__all__ = ['MetricsMiddleware', 'OutboundQueue', 'TelegramCallsMiddleware',
+           'UserRegistrationMiddleware', 'bulk_sends']
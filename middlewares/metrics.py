@@ -0,0 +1,55 @@
+'''
+Сбор метрик по хендлерам (см. metrics.py)
+'''
+
+import time
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware, NextRequestMiddlewareType
+)
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+from metrics import (HandlerStats, TELEGRAM_REQUESTS, current_stats,
+                     observe_handler)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    '''
+    Внутренний middleware сообщений и колбэков: замеряет хендлер
+    и собирает SQL-запросы и запросы к Telegram, сделанные за его вызов
+    '''
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+            ) -> Any:
+        stats = HandlerStats(handler=data['handler'].callback.__name__)
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            current_stats.reset(token)
+            observe_handler(
+                stats.handler, time.perf_counter() - started, stats, failed
+            )
+
+
+class TelegramCallsMiddleware(BaseRequestMiddleware):
+    '''Middleware сессии бота: считает запросы к Bot API'''
+
+    async def __call__(
+            self, make_request: NextRequestMiddlewareType,
+            bot: Bot, method: TelegramMethod
+            ) -> Any:
+        TELEGRAM_REQUESTS.inc(type(method).__name__)
+        stats = current_stats.get()
+        if stats is not None:
+            stats.telegram_calls += 1
+        return await make_request(bot, method)
@@ -0,0 +1,245 @@
+'''
+Очередь исходящих запросов к Telegram с учётом лимитов
+'''
+
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware, NextRequestMiddlewareType
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    TelegramMethod, SendMessage, SendPhoto, CopyMessage, ForwardMessage,
+    EditMessageText, EditMessageCaption, EditMessageReplyMarkup,
+    EditMessageMedia
+)
+from cache import LRUCache
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE,
+                    OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES,
+                    OUTBOUND_CHATS_TRACKED)
+
+
+# Приоритеты: меньше — раньше
+INTERACTIVE = 0
+BULK = 1
+
+_priority: ContextVar[int] = ContextVar('outbound_priority', default=INTERACTIVE)
+
+# Отправка и изменение сообщений — то, на что действуют лимиты Telegram.
+# Остальные методы (answerCallbackQuery, getMe...) идут без очереди
+SEND_METHODS = (SendMessage, SendPhoto, CopyMessage, ForwardMessage)
+EDIT_METHODS = (EditMessageText, EditMessageCaption, EditMessageReplyMarkup,
+                EditMessageMedia)
+
+
+@contextmanager
+def bulk_sends():
+    '''
+    Запросы внутри блока (рассылки и т.п.) пропускают вперёд
+    ответы на действия пользователей
+    '''
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    '''Маркерное ведро: rate запросов в секунду, до burst подряд'''
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # До какого момента Telegram просил не отправлять (retry_after)
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        '''Через сколько секунд можно отправить запрос'''
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Request:
+    '''Запрос в очереди. Ожидающее изменение сообщения можно заменить новым'''
+
+    __slots__ = ('method', 'chat_id', 'priority', 'granted', 'done',
+                 'edit_key')
+
+    def __init__(self, method: TelegramMethod, priority: int, edit_key=None):
+        loop = asyncio.get_running_loop()
+        self.method = method
+        self.chat_id = method.chat_id
+        self.priority = priority
+        self.granted = loop.create_future()
+        self.done = loop.create_future()
+        self.edit_key = edit_key
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    '''
+    Middleware сессии бота: все отправки и изменения сообщений проходят
+    через очередь с общим лимитом (global_rate в секунду) и лимитом на чат
+    (chat_rate в секунду, до chat_burst подряд).
+    Ответы на действия пользователей идут раньше рассылок (bulk_sends).
+    Если изменение сообщения ещё ждёт очереди, а пришло новое изменение
+    того же сообщения, отправляется только последнее.
+    На 429 чат приостанавливается на retry_after, а запрос повторяется
+    до max_retries раз
+    '''
+
+    def __init__(
+            self, global_rate: float = OUTBOUND_GLOBAL_RATE,
+            chat_rate: float = OUTBOUND_CHAT_RATE,
+            chat_burst: float = OUTBOUND_CHAT_BURST,
+            max_retries: int = OUTBOUND_MAX_RETRIES,
+            chats_tracked: int = OUTBOUND_CHATS_TRACKED
+            ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # Ведро давно молчавшего чата и так полное — его можно забыть
+        self._chats = LRUCache(chats_tracked)
+        self._queues = {INTERACTIVE: deque(), BULK: deque()}
+        self._pending_edits = {}
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def __call__(
+            self, make_request: NextRequestMiddlewareType,
+            bot: Bot, method: TelegramMethod
+            ) -> Any:
+        if (not isinstance(method, SEND_METHODS + EDIT_METHODS)
+                or getattr(method, 'chat_id', None) is None):
+            return await make_request(bot, method)
+
+        edit_key = None
+        if isinstance(method, EDIT_METHODS):
+            edit_key = (type(method), method.chat_id, method.message_id)
+            waiting = self._pending_edits.get(edit_key)
+            if waiting is not None:
+                # Старое изменение ещё не отправлено — заменяем его новым
+                waiting.method = method
+                self.coalesced += 1
+                return await asyncio.shield(waiting.done)
+
+        request = _Request(method, _priority.get(), edit_key)
+        if edit_key is not None:
+            self._pending_edits[edit_key] = request
+        try:
+            result = await self._send(make_request, bot, request)
+        except BaseException as e:
+            if not request.done.done():
+                request.done.set_exception(e)
+                # Исключение уже получил вызывающий, у присоединившихся
+                # изменений оно будет извлечено ими же
+                request.done.exception()
+            raise
+        request.done.set_result(result)
+        return result
+
+    async def _send(
+            self, make_request: NextRequestMiddlewareType,
+            bot: Bot, request: _Request
+            ) -> Any:
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(request)
+            if request.edit_key is not None and attempt == 0:
+                # С этого момента новые изменения встают в очередь заново
+                self._pending_edits.pop(request.edit_key, None)
+            try:
+                result = await make_request(bot, request.method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                self._chat_bucket(request.chat_id).blocked_until = (
+                    time.monotonic() + e.retry_after
+                )
+                continue
+            self.sent += 1
+            return result
+
+    async def _wait_turn(self, request: _Request):
+        request.granted = asyncio.get_running_loop().create_future()
+        self._queues[request.priority].append(request)
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._grant_loop())
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            queue = self._queues[request.priority]
+            if request in queue:
+                queue.remove(request)
+            if request.edit_key is not None:
+                self._pending_edits.pop(request.edit_key, None)
+            raise
+
+    def _next_ready(self, now: float) -> tuple[_Request | None, float]:
+        '''Первый запрос, чат которого готов; иначе — сколько ждать'''
+        wait = None
+        for priority in (INTERACTIVE, BULK):
+            for request in self._queues[priority]:
+                delay = self._chat_bucket(request.chat_id).delay(now)
+                if delay <= 0:
+                    return request, 0.0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _grant_loop(self):
+        '''Выдаёт разрешения на отправку в порядке приоритета и лимитов'''
+        while any(self._queues.values()):
+            self._wakeup.clear()
+            now = time.monotonic()
+            global_delay = self.global_bucket.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            request, wait = self._next_ready(now)
+            if request is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._queues[request.priority].remove(request)
+            self.global_bucket.take()
+            self._chat_bucket(request.chat_id).take()
+            if not request.granted.done():
+                request.granted.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+        }
@@ -0,0 +1,46 @@
+'''
+Регистрация пользователей до вызова хендлеров
+'''
+
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+from sqlalchemy.dialects.sqlite import insert
+from cache import LRUCache
+from config import KNOWN_USERS_CACHE_SIZE
+from db import SessionLocal, User
+
+
+class UserRegistrationMiddleware(BaseMiddleware):
+    '''
+    Гарантирует строку в users для автора каждого апдейта.
+    Id уже известных пользователей хранятся в ограниченном LRU,
+    поэтому повторный визит не стоит ни одного запроса.
+    Неизвестный пользователь создаётся одним
+    INSERT ... ON CONFLICT DO NOTHING — без предварительного SELECT
+    и без гонки при одновременных апдейтах
+    '''
+
+    def __init__(self, cache_size: int = KNOWN_USERS_CACHE_SIZE):
+        self.known_users = LRUCache(cache_size)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+            ) -> Any:
+        user: TelegramUser | None = data.get('event_from_user')
+        if user is not None and self.known_users.get(user.id) is None:
+            await self.register(user)
+        return await handler(event, data)
+
+    async def register(self, user: TelegramUser):
+        async with SessionLocal() as db:
+            await db.execute(
+                insert(User)
+                .values(id=user.id, username=user.username)
+                .on_conflict_do_nothing(index_elements=[User.id])
+            )
+            await db.commit()
+        self.known_users.set(user.id, True)
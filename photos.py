@@ -0,0 +1,105 @@
+'''
+Фото рецептов: повторное использование file_id Telegram.
+
+По URL Telegram каждый раз скачивает картинку с TheMealDB, это
+медленно и ломается, когда сайт не отвечает. После первой отправки
+бот запоминает file_id и дальше отправляет фото по нему
+'''
+
+import logging
+from aiogram import types
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
+from sqlalchemy import and_, delete, select
+from sqlalchemy.dialects.sqlite import insert
+from cache import LRUCache
+from config import RECIPE_PHOTO_CACHE_SIZE
+from db import Recipe, RecipePhoto, SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecipePhotos:
+    '''
+    file_id фото рецептов в таблице recipe_photos и LRU-кеше в памяти.
+    Запись используется, только пока image_url рецепта не изменился.
+    Если Telegram отклонил file_id, фото отправляется по URL,
+    а file_id перезаписывается
+    '''
+
+    def __init__(self, cache_size: int = RECIPE_PHOTO_CACHE_SIZE):
+        # (bot_id, recipe_id) -> (image_url, file_id | None)
+        self._cache = LRUCache(cache_size)
+
+    async def file_id(self, bot_id: int, recipe: Recipe) -> str | None:
+        key = (bot_id, recipe.id)
+        cached = self._cache.get(key)
+        if cached is None:
+            async with SessionLocal() as db:
+                row = (await db.execute(
+                    select(RecipePhoto.image_url, RecipePhoto.file_id)
+                    .where(and_(RecipePhoto.bot_id == bot_id,
+                                RecipePhoto.recipe_id == recipe.id))
+                )).first()
+            # Отсутствие записи тоже кешируется, чтобы не читать БД снова
+            cached = tuple(row) if row else (recipe.image_url, None)
+            self._cache.set(key, cached)
+
+        image_url, file_id = cached
+        return file_id if image_url == recipe.image_url else None
+
+    async def save(self, bot_id: int, recipe: Recipe, file_id: str):
+        async with SessionLocal() as db:
+            statement = insert(RecipePhoto).values(
+                bot_id=bot_id, recipe_id=recipe.id,
+                image_url=recipe.image_url, file_id=file_id
+            )
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[RecipePhoto.bot_id, RecipePhoto.recipe_id],
+                set_={
+                    'image_url': statement.excluded.image_url,
+                    'file_id': statement.excluded.file_id,
+                }
+            ))
+            await db.commit()
+        self._cache.set((bot_id, recipe.id), (recipe.image_url, file_id))
+
+    async def forget(self, bot_id: int, recipe: Recipe):
+        async with SessionLocal() as db:
+            await db.execute(
+                delete(RecipePhoto).where(and_(
+                    RecipePhoto.bot_id == bot_id,
+                    RecipePhoto.recipe_id == recipe.id
+                ))
+            )
+            await db.commit()
+        self._cache.set((bot_id, recipe.id), (recipe.image_url, None))
+
+    async def send(
+            self, message: types.Message, recipe: Recipe, caption: str
+            ) -> types.Message:
+        '''Отправляет фото рецепта по file_id, а если его нет — по URL'''
+        bot_id = message.bot.id
+        file_id = await self.file_id(bot_id, recipe)
+        if file_id:
+            try:
+                return await message.answer_photo(
+                    photo=file_id, caption=caption, parse_mode=ParseMode.HTML
+                )
+            except TelegramBadRequest as e:
+                logger.warning(
+                    'file_id фото рецепта %s отклонён: %s', recipe.id, e
+                )
+                await self.forget(bot_id, recipe)
+
+        sent = await message.answer_photo(
+            photo=recipe.image_url, caption=caption, parse_mode=ParseMode.HTML
+        )
+        if sent.photo:
+            # Последний размер — самый крупный
+            await self.save(bot_id, recipe, sent.photo[-1].file_id)
+        return sent
+
+
+recipe_photos = RecipePhotos()
@@ -0,0 +1,106 @@
+'''
+Выбор случайного рецепта без ORDER BY random()
+'''
+
+import random
+from collections import OrderedDict, deque
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from catalog import catalog_watcher
+from config import RANDOM_NO_REPEAT_FRACTION, RANDOM_HISTORY_USERS
+from db import Recipe
+
+
+# Сколько раз пробуем случайный id, прежде чем искать свободный перебором
+MAX_PICK_ATTEMPTS = 32
+
+
+class RecipeSampler:
+    '''
+    Держит в памяти список id рецептов и выбирает из него за O(1).
+    Для каждого пользователя хранится окно недавно показанных id:
+    рецепт не повторится, пока не будет показана доля каталога
+    no_repeat_fraction
+    '''
+
+    def __init__(
+            self,
+            no_repeat_fraction: float = RANDOM_NO_REPEAT_FRACTION,
+            max_users: int = RANDOM_HISTORY_USERS
+            ):
+        if not 0 <= no_repeat_fraction < 1:
+            raise ValueError('no_repeat_fraction должен быть в [0, 1)')
+        self.no_repeat_fraction = no_repeat_fraction
+        self.max_users = max_users
+        self._ids = []
+        self._version = None
+        # user_id -> (deque недавних id, set тех же id)
+        self._history = OrderedDict()
+
+    @property
+    def window(self) -> int:
+        '''Размер окна неповторения для текущего каталога'''
+        if not self._ids:
+            return 0
+        return min(
+            int(len(self._ids) * self.no_repeat_fraction), len(self._ids) - 1
+        )
+
+    def rebuild(self, recipe_ids: list[int], version: int | None = None):
+        '''Пересобирает пространство id. История пользователей сохраняется'''
+        self._ids = list(recipe_ids)
+        self._version = version
+
+    async def ensure_fresh(self, db: AsyncSession):
+        '''Перечитывает id рецептов, если каталог сменил версию'''
+        version = await catalog_watcher.current_version(db)
+        if self._version != version or not self._ids:
+            result = await db.execute(select(Recipe.id))
+            self.rebuild(result.scalars().all(), version)
+
+    def _user_history(self, user_id: int):
+        window = self.window
+        history = self._history.get(user_id)
+        if history is None or history[0].maxlen != window:
+            recent = deque(history[0] if history else (), maxlen=window)
+            history = (recent, set(recent))
+        self._history[user_id] = history
+        self._history.move_to_end(user_id)
+        while len(self._history) > self.max_users:
+            self._history.popitem(last=False)
+        return history
+
+    def pick(self, user_id: int) -> int | None:
+        '''Случайный id рецепта, не показанный пользователю недавно'''
+        if not self._ids:
+            return None
+
+        recent, recent_set = self._user_history(user_id)
+
+        for _ in range(MAX_PICK_ATTEMPTS):
+            recipe_id = random.choice(self._ids)
+            if recipe_id not in recent_set:
+                break
+        else:
+            # Окно почти покрывает каталог: ищем свободный id от случайного места
+            start = random.randrange(len(self._ids))
+            recipe_id = next(
+                (self._ids[(start + i) % len(self._ids)]
+                 for i in range(len(self._ids))
+                 if self._ids[(start + i) % len(self._ids)] not in recent_set),
+                self._ids[start]
+            )
+
+        if recent.maxlen:
+            if len(recent) == recent.maxlen:
+                recent_set.discard(recent[0])
+            recent.append(recipe_id)
+            recent_set.add(recipe_id)
+        return recipe_id
+
+    async def pick_for(self, db: AsyncSession, user_id: int) -> int | None:
+        await self.ensure_fresh(db)
+        return self.pick(user_id)
+
+
+recipe_sampler = RecipeSampler()
@@ -0,0 +1,294 @@
+'''
+Поиск рецептов по индексам БД
+'''
+
+import re
+import time
+from dataclasses import dataclass
+from aiogram.fsm.context import FSMContext
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import SEARCH_RESULTS_LIMIT, SEARCH_SESSION_TTL, SEARCH_PAGE_SIZE
+from db import Recipe, RecipeIngredient
+
+
+WORD_RE = re.compile(r'\w+')
+LETTERS_RE = re.compile(r'[^\W\d_]+')
+MEASURE_RE = re.compile(r'\([^)]*\)')
+CYRILLIC_RE = re.compile('[а-я]')
+
+# Окончания для упрощённого стемминга русских существительных
+# и прилагательных. Проверяются от длинных к коротким
+RU_ENDINGS = sorted((
+    'ыми', 'ими', 'ого', 'его', 'ому', 'ему', 'ами', 'ями',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ую', 'юю',
+    'ых', 'их', 'ом', 'ем', 'ах', 'ях', 'ов', 'ев', 'ей', 'ам', 'ям',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+# Сколько строк индекса вставляется одним executemany
+INDEX_INSERT_BATCH = 5000
+
+STOP_WORDS = {'и', 'или', 'для', 'по', 'на', 'в', 'с', 'со', 'из', 'and', 'or', 'of'}
+
+FTS_SEARCH_SQL = text(
+    'SELECT rowid FROM recipes_fts '
+    'WHERE recipes_fts MATCH :query '
+    'ORDER BY rank '
+    'LIMIT :limit'
+)
+
+
+def normalize_text(value: str) -> str:
+    '''Приводит текст к нижнему регистру и заменяет ё на е'''
+    return value.lower().replace('ё', 'е')
+
+
+def build_fts_query(search_query: str) -> str:
+    '''
+    Превращает ввод пользователя в запрос FTS5:
+    каждое слово обязательно и ищется по префиксу
+    '''
+    words = WORD_RE.findall(normalize_text(search_query))
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+async def search_recipe_ids_by_name(
+        db: AsyncSession, search_query: str,
+        limit: int = SEARCH_RESULTS_LIMIT
+        ) -> list[int]:
+    '''Возвращает id рецептов, отсортированные по релевантности (bm25)'''
+    fts_query = build_fts_query(search_query)
+    if not fts_query:
+        return []
+
+    result = await db.execute(
+        FTS_SEARCH_SQL, {'query': fts_query, 'limit': limit}
+    )
+    return list(result.scalars().all())
+
+
+async def load_recipes_in_order(
+        db: AsyncSession, recipe_ids: list[int]
+        ) -> list[Recipe]:
+    '''Загружает рецепты по списку id, сохраняя порядок списка'''
+    if not recipe_ids:
+        return []
+
+    result = await db.execute(
+        select(Recipe).where(Recipe.id.in_(recipe_ids))
+    )
+    recipes_by_id = {recipe.id: recipe for recipe in result.scalars().all()}
+    return [
+        recipes_by_id[recipe_id] for recipe_id in recipe_ids
+        if recipe_id in recipes_by_id
+    ]
+
+
+async def search_recipes_by_name(
+        db: AsyncSession, search_query: str,
+        limit: int = SEARCH_RESULTS_LIMIT
+        ) -> list[Recipe]:
+    '''Ранжированный поиск рецептов по названию (англ. и рус.)'''
+    recipe_ids = await search_recipe_ids_by_name(db, search_query, limit)
+    return await load_recipes_in_order(db, recipe_ids)
+
+
+def stem_word(word: str) -> str:
+    '''Упрощённый стемминг: отрезает типичное окончание слова'''
+    if CYRILLIC_RE.search(word):
+        for ending in RU_ENDINGS:
+            if (word.endswith(ending)
+                    and len(word) - len(ending) >= MIN_STEM_LENGTH):
+                return word[:-len(ending)]
+        return word
+    # Для непереведённых английских названий убираем мн. число
+    if word.endswith('s') and len(word) > MIN_STEM_LENGTH:
+        return word[:-1]
+    return word
+
+
+def ingredient_terms(ingredient: str) -> list[str]:
+    '''
+    Нормализует один ингредиент в список термов:
+    убирает количество в скобках, регистр, ё и окончания
+    '''
+    ingredient = normalize_text(MEASURE_RE.sub(' ', ingredient))
+    terms = []
+    for word in LETTERS_RE.findall(ingredient):
+        if word in STOP_WORDS:
+            continue
+        term = stem_word(word)
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+
+def build_ingredient_index(
+        recipe_id: int, ingredients_text: str | None
+        ) -> list[dict]:
+    '''
+    Строки инвертированного индекса для ингредиентов одного рецепта.
+    Словари, а не объекты ORM — вставляются пакетно через executemany
+    '''
+    lines = [
+        line.strip() for line in (ingredients_text or '').split('\n')
+        if line.strip()
+    ]
+    rows = []
+    for position, line in enumerate(lines):
+        for term in ingredient_terms(line):
+            rows.append({
+                'term': term[:50],
+                'recipe_id': recipe_id,
+                'position': position,
+                'ingredients_count': len(lines),
+            })
+    return rows
+
+
+async def rebuild_ingredient_index(db: AsyncSession) -> int:
+    '''Пересобирает индекс ингредиентов по всем рецептам в БД'''
+    await db.execute(delete(RecipeIngredient))
+    result = await db.execute(select(Recipe.id, Recipe.ingredients_ru))
+    indexed = 0
+    rows = []
+    for recipe_id, ingredients_ru in result.all():
+        rows.extend(build_ingredient_index(recipe_id, ingredients_ru))
+        indexed += 1
+        if len(rows) >= INDEX_INSERT_BATCH:
+            await db.execute(insert(RecipeIngredient), rows)
+            rows = []
+    if rows:
+        await db.execute(insert(RecipeIngredient), rows)
+    await db.commit()
+    return indexed
+
+
+@dataclass
+class IngredientMatch:
+    '''Рецепт, найденный по ингредиентам, и его покрытие'''
+    recipe_id: int
+    # Сколько введённых ингредиентов используется в рецепте
+    matched: int
+    # Сколько ингредиентов рецепта не хватает
+    missing: int
+
+
+async def search_recipes_by_ingredients(
+        db: AsyncSession, ingredients: list[str],
+        limit: int = SEARCH_RESULTS_LIMIT
+        ) -> list[IngredientMatch]:
+    '''
+    Ранжированный поиск «что приготовить».
+    Читает только posting lists термов введённых ингредиентов,
+    сортирует по числу совпавших ингредиентов, затем по недостающим
+    '''
+    wanted = [ingredient_terms(item) for item in ingredients]
+    wanted = [terms for terms in wanted if terms]
+    all_terms = {term for terms in wanted for term in terms}
+    if not all_terms:
+        return []
+
+    result = await db.execute(
+        select(
+            RecipeIngredient.term,
+            RecipeIngredient.recipe_id,
+            RecipeIngredient.position,
+            RecipeIngredient.ingredients_count
+        ).where(RecipeIngredient.term.in_(all_terms))
+    )
+
+    # (recipe_id, position) -> термы этой строки ингредиента
+    line_terms = {}
+    ingredients_count = {}
+    for term, recipe_id, position, count in result.all():
+        line_terms.setdefault((recipe_id, position), set()).add(term)
+        ingredients_count[recipe_id] = count
+
+    matched = {}
+    used_positions = {}
+    for (recipe_id, position), terms in line_terms.items():
+        for index, wanted_terms in enumerate(wanted):
+            # Ингредиент из нескольких слов должен совпасть целиком
+            if terms.issuperset(wanted_terms):
+                matched.setdefault(recipe_id, set()).add(index)
+                used_positions.setdefault(recipe_id, set()).add(position)
+
+    matches = [
+        IngredientMatch(
+            recipe_id=recipe_id,
+            matched=len(indexes),
+            missing=ingredients_count[recipe_id] - len(used_positions[recipe_id])
+        )
+        for recipe_id, indexes in matched.items()
+    ]
+    matches.sort(key=lambda m: (-m.matched, m.missing, m.recipe_id))
+    return matches[:limit]
+
+
+# Ключ в данных FSM, под которым лежат результаты последнего поиска
+SEARCH_SESSION_KEY = 'search'
+
+
+async def save_search_session(
+        state: FSMContext, recipe_ids: list[int],
+        coverage: list[tuple[int, int]] | None = None,
+        wanted: int | None = None
+        ):
+    '''
+    Сохраняет результаты поиска в состоянии пользователя компактно:
+    только id (не больше SEARCH_RESULTS_LIMIT) и срок действия.
+    Для поиска по ингредиентам — пары (совпало, не хватает)
+    '''
+    session = {
+        'ids': list(recipe_ids[:SEARCH_RESULTS_LIMIT]),
+        'expires_at': int(time.time()) + SEARCH_SESSION_TTL,
+    }
+    if coverage is not None:
+        session['coverage'] = [list(item) for item in coverage[:SEARCH_RESULTS_LIMIT]]
+        session['wanted'] = wanted
+    await state.update_data({SEARCH_SESSION_KEY: session})
+
+
+async def load_search_session(state: FSMContext) -> dict | None:
+    '''Результаты последнего поиска или None, если их нет или они устарели'''
+    user_data = await state.get_data()
+    session = user_data.get(SEARCH_SESSION_KEY)
+    if not session or session['expires_at'] < time.time():
+        return None
+    return session
+
+
+def search_page_count(session: dict) -> int:
+    return max(1, -(-len(session['ids']) // SEARCH_PAGE_SIZE))
+
+
+async def search_page_lines(
+        db: AsyncSession, session: dict, page: int
+        ) -> list[str]:
+    '''
+    Строки одной страницы результатов со сквозной нумерацией.
+    Из БД читаются только названия рецептов этой страницы
+    '''
+    start = page * SEARCH_PAGE_SIZE
+    page_ids = session['ids'][start:start + SEARCH_PAGE_SIZE]
+    result = await db.execute(
+        select(Recipe.id, Recipe.name_ru).where(Recipe.id.in_(page_ids))
+    )
+    names = dict(result.all())
+
+    coverage = session.get('coverage')
+    lines = []
+    for offset, recipe_id in enumerate(page_ids):
+        number = start + offset + 1
+        line = f'{number}. {names.get(recipe_id, "—")}'
+        if coverage:
+            matched, missing = coverage[start + offset]
+            line += (
+                f' (есть {matched} из {session["wanted"]}, '
+                f'не хватает: {missing})'
+            )
+        lines.append(line)
+    return lines
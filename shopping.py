@@ -0,0 +1,216 @@
+'''
+Список покупок пользователя
+'''
+
+from dataclasses import dataclass
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import and_, case, delete, exists, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import LRUCache
+from config import SHOPPING_PAGE_SIZE, SHOPPING_VIEW_CACHE_USERS
+from db import (RecipeIngredientItem, ShoppingList,
+                shopping_recipes_table as shopping_recipes)
+from ingredients import Ingredient, aggregate_ingredients, parse_ingredients
+
+
+@dataclass
+class ShoppingItemView:
+    '''Строка списка в том виде, в каком она показывается'''
+    id: int
+    text: str
+    is_purchased: bool
+
+
+@dataclass
+class ShoppingPage:
+    page: int
+    page_count: int
+    items: list[ShoppingItemView]
+
+
+@dataclass
+class RenderedPage:
+    '''Последняя страница, отправленная пользователю, и её разметка'''
+    message_id: int
+    page: ShoppingPage
+    text: str
+    markup: InlineKeyboardMarkup
+
+
+class ShoppingViews:
+    '''
+    Последняя показанная страница списка покупок по пользователям.
+    Отметка «куплено» меняет строку прямо в ней, без чтения страницы
+    из БД, а одинаковая повторная отрисовка не отправляется в Telegram
+    '''
+
+    def __init__(self, cache_users: int = SHOPPING_VIEW_CACHE_USERS):
+        self._cache = LRUCache(cache_users) if cache_users > 0 else None
+
+    def get(self, user_id: int, message_id: int) -> RenderedPage | None:
+        if self._cache is None:
+            return None
+        rendered = self._cache.get(user_id)
+        if rendered is None or rendered.message_id != message_id:
+            return None
+        return rendered
+
+    def set(self, user_id: int, rendered: RenderedPage):
+        if self._cache is not None:
+            self._cache.set(user_id, rendered)
+
+    def invalidate(self, user_id: int):
+        if self._cache is not None:
+            self._cache.pop(user_id)
+
+
+shopping_views = ShoppingViews()
+
+
+def item_text(item: ShoppingList) -> str:
+    '''Строка списка для показа: "Мука (1,5 кг)"'''
+    return str(Ingredient(item.item_name, item.quantity, item.unit))
+
+
+async def recipe_ingredients(
+        db: AsyncSession, recipe_id: int, ingredients_ru: str | None
+        ) -> list[Ingredient]:
+    '''Разобранные при импорте ингредиенты рецепта'''
+    result = await db.execute(
+        select(RecipeIngredientItem)
+        .where(RecipeIngredientItem.recipe_id == recipe_id)
+        .order_by(RecipeIngredientItem.position)
+    )
+    items = [
+        Ingredient(item.name, item.quantity, item.unit)
+        for item in result.scalars()
+    ]
+    # Рецепт ещё не переразобран (fill_db.py --reindex) — разбираем текст
+    return items or parse_ingredients(ingredients_ru)
+
+
+async def add_recipe(
+        db: AsyncSession, user_id: int, recipe_id: int,
+        ingredients: list[Ingredient]
+        ) -> bool:
+    '''
+    Добавляет ингредиенты рецепта в список покупок одним upsert:
+    одинаковые ингредиенты в одинаковых единицах складываются
+    с уже имеющимися. Купленная строка при повторном добавлении
+    снова становится некупленной с новым количеством.
+    Возвращает False, если рецепт уже добавлен и список не пуст
+    '''
+    already_added = await db.scalar(select(
+        exists().where(and_(
+            shopping_recipes.c.user_id == user_id,
+            shopping_recipes.c.recipe_id == recipe_id
+        ))
+        & exists().where(ShoppingList.user_id == user_id)
+    ))
+    if already_added:
+        return False
+
+    rows = [
+        {
+            'user_id': user_id,
+            'item_name': item.name[:200],
+            'name_key': item.key[:200],
+            'quantity': item.quantity,
+            'unit': item.unit[:50],
+            'is_purchased': False,
+        }
+        for item in aggregate_ingredients(ingredients)
+    ]
+    if rows:
+        statement = insert(ShoppingList).values(rows)
+        added = statement.excluded.quantity
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[
+                ShoppingList.user_id, ShoppingList.name_key, ShoppingList.unit
+            ],
+            set_={
+                # Как в aggregate_ingredients: количество без числа
+                # не обнуляет сумму, NULL — только если чисел нет у обоих
+                'quantity': case(
+                    (ShoppingList.is_purchased, added),
+                    (and_(ShoppingList.quantity.is_(None), added.is_(None)),
+                     None),
+                    else_=(func.coalesce(ShoppingList.quantity, 0)
+                           + func.coalesce(added, 0))
+                ),
+                'is_purchased': False,
+            }
+        ))
+    await db.execute(
+        insert(shopping_recipes)
+        .values(user_id=user_id, recipe_id=recipe_id)
+        .on_conflict_do_nothing()
+    )
+    await db.commit()
+    shopping_views.invalidate(user_id)
+    return True
+
+
+async def load_page(
+        db: AsyncSession, user_id: int, page: int = 0,
+        per_page: int = SHOPPING_PAGE_SIZE
+        ) -> ShoppingPage:
+    '''Одна страница списка в порядке добавления (LIMIT/OFFSET в SQL)'''
+    total = await db.scalar(
+        select(func.count()).where(ShoppingList.user_id == user_id)
+    )
+    page_count = max(1, -(-total // per_page))
+    page = min(max(page, 0), page_count - 1)
+
+    result = await db.execute(
+        select(ShoppingList)
+        .where(ShoppingList.user_id == user_id)
+        .order_by(ShoppingList.id)
+        .limit(per_page)
+        .offset(page * per_page)
+    )
+    return ShoppingPage(
+        page=page,
+        page_count=page_count,
+        items=[
+            ShoppingItemView(item.id, item_text(item), bool(item.is_purchased))
+            for item in result.scalars()
+        ]
+    )
+
+
+async def toggle_item(
+        db: AsyncSession, user_id: int, item_id: int
+        ) -> bool | None:
+    '''Переключает «куплено» у одной строки. None — строки нет'''
+    result = await db.execute(
+        update(ShoppingList)
+        .where(and_(ShoppingList.id == item_id,
+                    ShoppingList.user_id == user_id))
+        .values(is_purchased=case((ShoppingList.is_purchased, False),
+                                  else_=True))
+        .returning(ShoppingList.is_purchased)
+    )
+    is_purchased = result.scalar()
+    await db.commit()
+    return is_purchased
+
+
+async def delete_item(db: AsyncSession, user_id: int, item_id: int) -> bool:
+    result = await db.execute(
+        delete(ShoppingList).where(and_(ShoppingList.id == item_id,
+                                        ShoppingList.user_id == user_id))
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def clear(db: AsyncSession, user_id: int):
+    '''Очищает список покупок и забывает добавленные рецепты'''
+    await db.execute(delete(ShoppingList).where(ShoppingList.user_id == user_id))
+    await db.execute(
+        delete(shopping_recipes).where(shopping_recipes.c.user_id == user_id)
+    )
+    await db.commit()
+    shopping_views.invalidate(user_id)
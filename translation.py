@@ -0,0 +1,256 @@
+'''
+Перевод текстов для импорта рецептов.
+
+Переводчики взаимозаменяемы (Google или локальная заглушка для тестов),
+а CachedTranslator добавляет к любому из них постоянный кеш на диске
+и отправку непереведённых строк пакетами
+'''
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from db import DATA_DIR
+
+
+logger = logging.getLogger(__name__)
+
+
+TRANSLATION_CACHE_PATH = os.path.join(DATA_DIR, 'translations.db')
+
+# Ограничение Google Translate на один запрос — около 5000 символов
+MAX_BATCH_CHARS = 4500
+# Разделитель строк внутри пакета: переводчик сохраняет переводы строк
+BATCH_SEPARATOR = '\n'
+# Разрывы строк в многострочных текстах; скобки сохраняют их при split
+LINE_BREAK_RE = re.compile(r'(\r\n|\r|\n)')
+
+
+class BaseTranslator(ABC):
+    '''Интерфейс переводчика. Методы блокирующие'''
+
+    source = 'en'
+    dest = 'ru'
+
+    @abstractmethod
+    def translate_batch(self, texts: list[str]) -> list[str]:
+        '''Переводит список строк, порядок ответа совпадает с запросом'''
+
+
+class GoogleTranslator(BaseTranslator):
+    '''Перевод через googletrans: пакет уходит одним запросом'''
+
+    def __init__(self):
+        from googletrans import Translator
+        self._translator = Translator()
+
+    def _translate(self, text: str) -> str:
+        return self._translator.translate(
+            text, src=self.source, dest=self.dest
+        ).text
+
+    def translate_batch(self, texts: list[str]) -> list[str]:
+        if len(texts) == 1 or any(BATCH_SEPARATOR in text for text in texts):
+            return [self._translate(text) for text in texts]
+
+        translated = self._translate(BATCH_SEPARATOR.join(texts))
+        parts = translated.split(BATCH_SEPARATOR)
+        if len(parts) != len(texts):
+            # Переводчик склеил или разбил строки — переводим по одной
+            return [self._translate(text) for text in texts]
+        return [part.strip() for part in parts]
+
+
+class FakeTranslator(BaseTranslator):
+    '''Локальный переводчик для тестов и офлайн-прогонов'''
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self.calls = 0
+
+    def translate_batch(self, texts: list[str]) -> list[str]:
+        self.calls += 1
+        return [f'{self.prefix}{text}' for text in texts]
+
+
+TRANSLATORS = {
+    'google': GoogleTranslator,
+    'fake': FakeTranslator,
+}
+
+
+class TranslationCache:
+    '''Кеш переводов в SQLite-файле, ключ — хеш исходного текста'''
+
+    def __init__(self, path: str = TRANSLATION_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS translations ('
+            'key BLOB PRIMARY KEY, text TEXT NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(text: str, source: str, dest: str) -> bytes:
+        return hashlib.sha256(f'{source}:{dest}:{text}'.encode()).digest()
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, str]:
+        found = {}
+        with self._lock:
+            # Лимит SQLite на число параметров запроса
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                found.update(self._conn.execute(
+                    f'SELECT key, text FROM translations '
+                    f'WHERE key IN ({placeholders})', chunk
+                ).fetchall())
+        return found
+
+    def set_many(self, items: dict[bytes, str]):
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO translations (key, text) VALUES (?, ?)',
+                items.items()
+            )
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def split_batches(texts: list[str], max_chars: int = MAX_BATCH_CHARS):
+    '''Делит строки на пакеты не длиннее max_chars символов'''
+    batch, size = [], 0
+    for text in texts:
+        if batch and size + len(text) + len(BATCH_SEPARATOR) > max_chars:
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text) + len(BATCH_SEPARATOR)
+    if batch:
+        yield batch
+
+
+class Translations(dict):
+    '''
+    Словарь исходная строка -> перевод. Строки, которые перевести
+    не удалось, в словарь не попадают и перечислены в failed
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed: set[str] = set()
+
+
+class CachedTranslator:
+    '''
+    Переводит набор строк: повторы схлопываются, уже переведённые
+    берутся из кеша, остальные уходят переводчику пакетами.
+    Без переводчика (офлайн-импорт) кеш только читается,
+    а строки не из кеша считаются непереведёнными
+    '''
+
+    def __init__(
+            self, translator: BaseTranslator | None,
+            cache: TranslationCache | None = None,
+            max_batch_chars: int = MAX_BATCH_CHARS
+            ):
+        self.translator = translator
+        self.cache = cache
+        self.max_batch_chars = max_batch_chars
+        self.source = translator.source if translator else BaseTranslator.source
+        self.dest = translator.dest if translator else BaseTranslator.dest
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> bytes:
+        return TranslationCache.key(text, self.source, self.dest)
+
+    def _from_cache(self, texts: list[str], result: Translations) -> list[str]:
+        '''Кладёт в result найденные в кеше переводы, возвращает остальные'''
+        cached = (self.cache.get_many([self._key(text) for text in texts])
+                  if self.cache else {})
+        missing = []
+        for text in texts:
+            translation = cached.get(self._key(text))
+            if translation is None:
+                missing.append(text)
+            else:
+                result[text] = translation
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return missing
+
+    def _store(self, items: dict[str, str]):
+        if self.cache and items:
+            self.cache.set_many({
+                self._key(text): value for text, value in items.items()
+            })
+
+    def translate_many(self, texts: list[str]) -> Translations:
+        '''
+        Возвращает словарь исходная строка -> перевод.
+        Непереведённые строки — в Translations.failed: вызывающий
+        не должен сохранять вместо них английский текст как перевод.
+        Многострочные тексты (инструкции) переводятся построчно в общих
+        пакетах с остальными строками: перевод строки внутри пакета
+        заставил бы переводчик отправлять весь пакет по одной строке
+        '''
+        result = Translations({'': ''})
+        unique = list(dict.fromkeys(text for text in texts if text))
+        missing = self._from_cache(unique, result)
+
+        # текст -> [строка, разрыв, строка, ...]
+        multiline = {
+            text: LINE_BREAK_RE.split(text)
+            for text in missing if LINE_BREAK_RE.search(text)
+        }
+        lines = [text for text in missing if text not in multiline]
+        queued = set(lines)
+        new_lines = list(dict.fromkeys(
+            line for parts in multiline.values()
+            for line in (part.strip() for part in parts[::2])
+            if line and line not in result and line not in queued
+        ))
+        lines += self._from_cache(new_lines, result)
+
+        if self.translator is None:
+            result.failed.update(lines)
+        else:
+            for batch in split_batches(lines, self.max_batch_chars):
+                try:
+                    translated = self.translator.translate_batch(batch)
+                except Exception as e:
+                    logger.warning(
+                        'Ошибка перевода пакета из %s строк: %s', len(batch), e
+                    )
+                    result.failed.update(batch)
+                    continue
+                translated = dict(zip(batch, translated))
+                result.update(translated)
+                self._store(translated)
+
+        assembled = {}
+        for text, parts in multiline.items():
+            pieces = []
+            for position, part in enumerate(parts):
+                line = part.strip()
+                # Нечётные элементы — сами разрывы строк
+                if position % 2 or not line:
+                    pieces.append(part)
+                elif line in result.failed:
+                    result.failed.add(text)
+                    break
+                else:
+                    pieces.append(result[line])
+            else:
+                assembled[text] = ''.join(pieces)
+        result.update(assembled)
+        self._store(assembled)
+        return result
@@ -1,45 +1,53 @@
 import re
+from dataclasses import replace
+from html import escape
 from aiogram import types
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import func, select, or_, and_
-from sqlalchemy.orm import selectinload
-from db import SessionLocal, Recipe, User, favorites_table as favorites
+from cache import recipe_cache
+from db import SessionLocal, Recipe
+from favorites import favorites_service
+from photos import recipe_photos
+import shopping
+from shopping import RenderedPage, ShoppingPage, shopping_views
 from handlers.states import FindRecipeState, ByIngredientsState
+from sampler import recipe_sampler
+from search import (
+    search_recipe_ids_by_name, search_recipes_by_ingredients,
+    save_search_session, load_search_session,
+    search_page_count, search_page_lines
+    )
 from keyboards.inline import (
-    main_menu_keyboard, recipe_actions_keyboard, favorites_paginated_keyboard
+    main_menu_keyboard, recipe_actions_keyboard, favorites_paginated_keyboard,
+    search_results_keyboard, shopping_list_actions_keyboard
     )
 
 
 async def send_one_recipe(
         event: types.Message | types.CallbackQuery,
         recipe: Recipe, is_favorite: bool, state: FSMContext,
-        page: int = None
+        page: int = None, page_start: int = None
         ):
-    '''Отправляет один рецепт пользователю, включая фото и полный текст'''
-    keyboard = recipe_actions_keyboard(is_favorite, recipe.id)
-
-    caption_text = (
-            f'<b>Рецепт:</b> {recipe.name_ru}'
-        )
-    full_recipe_text = (
-        '<b>Ингредиенты:</b>'
-        f'{recipe.ingredients_ru}\n\n'
-        '<b>Инструкция по приготовлению:</b>'
-        f'{recipe.instructions_ru}'
+    '''
+    Отправляет один рецепт пользователю: фото с подписью и текст.
+    Фото уходит по сохранённому file_id (см. photos.py), текст берётся
+    из готовой карточки рецепта, клавиатура — под последней частью
+    '''
+    keyboard = recipe_actions_keyboard(
+        is_favorite, recipe.id, page, page_start
     )
+    card = recipe_cache.card(recipe)
 
     if recipe.image_url:
-        await event.answer_photo(
-            photo=recipe.image_url,
-            caption=caption_text,
-            parse_mode=ParseMode.HTML
-        )
+        await recipe_photos.send(event, recipe, card.caption)
     else:
-        await event.answer(caption_text, parse_mode=ParseMode.HTML,
-                           reply_markup=keyboard)
-    await event.answer(full_recipe_text, parse_mode=ParseMode.HTML,
-                       reply_markup=keyboard)
+        await event.answer(card.caption, parse_mode=ParseMode.HTML)
+    for number, part in enumerate(card.body, 1):
+        await event.answer(
+            part, parse_mode=ParseMode.HTML,
+            reply_markup=keyboard if number == len(card.body) else None
+        )
 
 
 async def send_random_recipe(event: types.Message | types.CallbackQuery,
@@ -47,14 +55,18 @@ async def send_random_recipe(event: types.Message | types.CallbackQuery,
     '''Получает случайный рецепт из БД и вызывает send_one_recipe'''
     is_favorite = False
     async with SessionLocal() as db:
-        result = await db.execute(select(Recipe).order_by(func.random()).limit(1))
-        rand_recipe = result.scalars().first()
-
-        if not rand_recipe:
-            await event.answer('''К сожалению, я пока не знаю рецептов,
-                                но уже активно изучаю кулинарную книгу''')
-            return
-        await send_one_recipe(event, rand_recipe, is_favorite, state)
+        # В личном чате id чата совпадает с id пользователя
+        recipe_id = await recipe_sampler.pick_for(db, event.chat.id)
+        rand_recipe = (await recipe_cache.get(db, recipe_id)
+                       if recipe_id else None)
+
+    if not rand_recipe:
+        await event.answer('''К сожалению, я пока не знаю рецептов,
+                            но уже активно изучаю кулинарную книгу''')
+        return
+    # Соединение с БД уже возвращено в пул: отправка в Telegram
+    # может занять секунды
+    await send_one_recipe(event, rand_recipe, is_favorite, state)
 
 
 async def start_search_dialog(
@@ -71,75 +83,91 @@ async def start_search_dialog(
 async def process_search_query_and_display_results(
         message: types.Message, state: FSMContext
         ):
+    search_query = message.text
+    await message.answer(f'Ищу рецепт: "{search_query}"...')
+
     async with SessionLocal() as db:
-        search_query = message.text
-        await message.answer(f'Ищу рецепт: "{search_query}"...')
-
-        result = await db.execute(
-            select(Recipe)
-            .where(
-                or_(
-                    Recipe.name.like(f'%{search_query}%'),
-                    Recipe.name_ru.like(f'%{search_query}%')
-                )
-            )
+        found_ids = await search_recipe_ids_by_name(db, search_query)
+
+    # Страница результатов открывает свою сессию: внешняя к этому
+    # моменту закрыта, чтобы не держать два соединения пула сразу
+    if found_ids:
+        await save_search_session(state, found_ids)
+        await state.set_state(FindRecipeState.waiting_for_choice)
+        await send_search_page(message, state)
+    else:
+        await message.answer('Рецептов с таким названием не найдено 🤷‍♂️')
+        await state.clear()
+
+
+async def send_search_page(
+        message: types.Message, state: FSMContext,
+        page: int = 0, edit: bool = False
+        ):
+    '''Показывает страницу сохранённых результатов поиска'''
+    session = await load_search_session(state)
+
+    if not session:
+        await message.answer(
+            'Результаты поиска устарели... '
+            'Попробуйте снова начать поиск рецепта...',
+            reply_markup=main_menu_keyboard()
         )
+        await state.clear()
+        return
 
-        found_recipes = result.scalars().all()
+    page_count = search_page_count(session)
+    page = min(max(page, 0), page_count - 1)
 
-        if found_recipes:
-            answ = ['Найдены следующие рецепты:']
-            for i, recipe in enumerate(found_recipes, start=1):
-                answ.append(f'{i}. {recipe.name_ru}')
+    async with SessionLocal() as db:
+        lines = await search_page_lines(db, session, page)
 
-            final_message = '\n'.join(answ)
+    answ = [f'Найдены следующие рецепты (стр. {page + 1} из {page_count}):']
+    answ.extend(lines)
+    answ.append('')
+    answ.append('Напишите номер блюда, рецепт которого хотите получить🍽')
 
-            await message.answer(final_message)
-            await message.answer(
-                'Напишите номер блюда, рецепт которого хотите получить🍽'
-                )
+    final_message = '\n'.join(answ)
+    keyboard = search_results_keyboard(page, page_count)
 
-            await state.update_data(found_recipes=found_recipes)
-            await state.set_state(FindRecipeState.waiting_for_choice)
-        else:
-            await message.answer('Рецептов с таким названием не найдено 🤷‍♂️')
-            await state.clear()
+    if edit:
+        await message.edit_text(final_message, reply_markup=keyboard)
+    else:
+        await message.answer(final_message, reply_markup=keyboard)
 
 
 async def send_selected_recipe_by_choice(
         message: types.Message, state: FSMContext
         ):
     '''Принимает выбор блюда юзера из списка и отправляет рецепт'''
-    user_data = await state.get_data()
-    found_recipes = user_data.get('found_recipes')
+    session = await load_search_session(state)
 
-    if not found_recipes:
+    if not session:
         await message.answer(
-            'Произошла ошибка... Попробуйте снова начать поиск рецепта...'
+            'Результаты поиска устарели... '
+            'Попробуйте снова начать поиск рецепта...'
         )
         await state.clear()
         return
 
     try:
         choice = int(message.text)
-        if 1 <= choice <= len(found_recipes):
-            selected_recipe = found_recipes[choice - 1]
+        found_ids = session['ids']
+        if 1 <= choice <= len(found_ids):
             user_id = message.from_user.id
-            recipe_id = selected_recipe.id
-            
+            recipe_id = found_ids[choice - 1]
+
             async with SessionLocal() as db:
+                selected_recipe = await recipe_cache.get(db, recipe_id)
                 # Проверяем, является ли рецепт избранным
-                is_favorite_check = await db.execute(
-                    select(favorites).where(
-                        and_(
-                            favorites.c.user_id == user_id,
-                            favorites.c.recipe_id == recipe_id
-                        )
-                    )
+                is_favorite = await favorites_service.is_favorite(
+                    db, user_id, recipe_id
                 )
-                is_favorite = is_favorite_check.first() is not None
 
-            # Исправленный вызов функции
+            if not selected_recipe:
+                await message.answer('К сожалению, рецепт не найден.')
+                return
+
             await send_one_recipe(message, selected_recipe, is_favorite, state)
             await state.clear()
         else:
@@ -162,39 +190,28 @@ async def start_by_ingredients_search(
 async def process_search_by_ingredients(
         message: types.Message, state: FSMContext
         ):
-    keyboard = main_menu_keyboard(state)
-    async with SessionLocal() as db:
-        ingredients = message.text
-        ingredients_list = [item.strip() for item in ingredients.split(',')]
-
-        search_conditions = []
-        for ingredient in ingredients_list:
-            search_conditions.append(
-                Recipe.ingredients_ru.ilike(f'%{ingredient}%')
-                )
-        result = await db.execute(
-            select(Recipe).where(or_(*search_conditions))
-            )
+    keyboard = main_menu_keyboard()
+    ingredients = message.text
+    ingredients_list = [
+        item.strip() for item in ingredients.split(',') if item.strip()
+    ]
 
-        found_recipes = result.scalars().all()
-        if found_recipes:
-            answ = ['Найдены следующие рецепты:']
-            for i, recipe in enumerate(found_recipes, start=1):
-                answ.append(f'{i}. {recipe.name_ru}')
-
-            final_message = '\n'.join(answ)
-
-            await message.answer(final_message)
-            await message.answer(
-                'Напишите номер блюда, рецепт которого хотите получить🍽'
-                )
-
-            await state.update_data(found_recipes=found_recipes)
-            await state.set_state(ByIngredientsState.waiting_for_choice)
-        else:
-            await message.answer('Рецептов не найдено 🤷‍♂️',
-                                 reply_markup=keyboard)
-            await state.clear()
+    async with SessionLocal() as db:
+        matches = await search_recipes_by_ingredients(db, ingredients_list)
+
+    if matches:
+        await save_search_session(
+            state,
+            [match.recipe_id for match in matches],
+            coverage=[(match.matched, match.missing) for match in matches],
+            wanted=len(ingredients_list)
+        )
+        await state.set_state(ByIngredientsState.waiting_for_choice)
+        await send_search_page(message, state)
+    else:
+        await message.answer('Рецептов не найдено 🤷‍♂️',
+                             reply_markup=keyboard)
+        await state.clear()
 
 
 async def from_favorites(callback: types.CallbackQuery, state: FSMContext):
@@ -203,26 +220,104 @@ async def from_favorites(callback: types.CallbackQuery, state: FSMContext):
 
     async with SessionLocal() as db:
         user_id = callback.from_user.id
-        result = await db.execute(
-            select(User).options(
-                selectinload(User.favorites_recipes)
-                ).where(User.id == user_id)
-            )
-        user = result.scalars().first()
+        favorites_page = await favorites_service.page(db, user_id)
 
-        if user and user.favorites_recipes:
-            keyboard = await favorites_paginated_keyboard(
-                user.favorites_recipes,
-                page=0
-            )
+        if favorites_page.recipes:
+            keyboard = await favorites_paginated_keyboard(favorites_page)
             await callback.message.answer(
                 '⭐️ Ваши избранные рецепты:\n'
                 'Выберите, чтобы просмотреть рецепт:',
                 reply_markup=keyboard
                 )
         else:
-            keyboard = await main_menu_keyboard(state)
+            keyboard = main_menu_keyboard()
             await callback.message.answer(
                 'У вас пока нет избранных рецептов 🤷‍♂️',
                 reply_markup=keyboard
             )
+
+
+def shopping_list_text(shopping_page: ShoppingPage) -> str:
+    items_text = '\n'.join([
+        f'<s>{escape(item.text)}</s>' if item.is_purchased
+        else f'• {escape(item.text)}'
+        for item in shopping_page.items
+    ])
+    pages = (
+        f' (стр. {shopping_page.page + 1} из {shopping_page.page_count})'
+        if shopping_page.page_count > 1 else ''
+    )
+    return (
+        f'<b>🛒 Ваш список покупок</b>{pages}:\n'
+        'Купленные ингредиенты отмечайте кнопкой ☑️ '
+        '(для отмены нажмите на ингредиент еще раз)\n'
+        'Чтобы удалить ингредиент из списка (безвозвратно!), нажмите ❌\n\n'
+        f'{items_text}\n\n'
+        'Чтобы удалить весь список, нажмите кнопку ниже.'
+    )
+
+
+async def edit_unless_unchanged(message: types.Message, text: str, **kwargs):
+    '''
+    edit_text, который молча пропускает «message is not modified»:
+    после перезапуска или двойного нажатия страница может совпасть
+    с уже показанной
+    '''
+    try:
+        await message.edit_text(text, **kwargs)
+    except TelegramBadRequest as e:
+        if 'message is not modified' not in e.message:
+            raise
+
+
+async def send_shopping_page(
+        callback: types.CallbackQuery, state: FSMContext, page: int = 0,
+        toggled: tuple[int, bool] | None = None
+        ):
+    '''
+    Показывает страницу списка покупок, редактируя сообщение с кнопкой.
+    toggled — (id строки, новое значение «куплено»): если эта страница
+    уже показана в сообщении, строка меняется в ней без запроса к БД.
+    Если текст и кнопки не изменились, сообщение не редактируется
+    '''
+    user_id = callback.from_user.id
+    message = callback.message
+    shown = shopping_views.get(user_id, message.message_id)
+
+    shopping_page = None
+    if toggled and shown and shown.page.page == page:
+        item_id, is_purchased = toggled
+        if any(item.id == item_id for item in shown.page.items):
+            # Копия: показанная страница в кеше меняется, только когда
+            # сообщение действительно отредактировано
+            shopping_page = replace(shown.page, items=[
+                replace(item, is_purchased=is_purchased)
+                if item.id == item_id else item
+                for item in shown.page.items
+            ])
+
+    if shopping_page is None:
+        async with SessionLocal() as db:
+            shopping_page = await shopping.load_page(db, user_id, page)
+
+    if not shopping_page.items:
+        shopping_views.invalidate(user_id)
+        await edit_unless_unchanged(
+            message,
+            'Ваш список покупок пуст. Добавьте в него'
+            ' ингредиенты из избранных рецептов',
+            reply_markup=main_menu_keyboard()
+        )
+        return
+
+    text = shopping_list_text(shopping_page)
+    markup = shopping_list_actions_keyboard(shopping_page)
+    if shown and shown.text == text and shown.markup == markup:
+        return
+
+    await edit_unless_unchanged(
+        message, text, reply_markup=markup, parse_mode=ParseMode.HTML
+    )
+    shopping_views.set(
+        user_id, RenderedPage(message.message_id, shopping_page, text, markup)
+    )
@@ -0,0 +1,152 @@
+'''
+Режим webhook: Telegram сам присылает апдейты POST-запросами.
+
+Сервер на aiohttp проверяет секретный токен из заголовка
+X-Telegram-Bot-Api-Secret-Token, сразу отвечает 200 и обрабатывает
+апдейт в фоне. Одновременно обрабатывается не больше
+WEBHOOK_MAX_CONCURRENCY апдейтов: следующий запрос ждёт свободного
+места, прежде чем получить ответ. При остановке сервер перестаёт
+принимать запросы и дожидается уже начатых обработчиков
+'''
+
+import asyncio
+import hmac
+import logging
+import signal
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+                    WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY,
+                    WEBHOOK_DRAIN_TIMEOUT)
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookHandler:
+    '''Приём апдейтов и фоновая обработка с ограничением параллельности'''
+
+    def __init__(
+            self, bot: Bot, dp: Dispatcher, secret: str,
+            max_concurrency: int = WEBHOOK_MAX_CONCURRENCY
+            ):
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._closing = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def _check_secret(self, request: web.Request) -> bool:
+        token = request.headers.get(SECRET_HEADER, '')
+        return hmac.compare_digest(token.encode(), self.secret.encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._check_secret(request):
+            return web.Response(status=401)
+        if self._closing:
+            # Telegram повторит апдейт позже — его получит новый процесс
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(
+                await request.json(), context={'bot': self.bot}
+            )
+        except (ValueError, ValidationError):
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception('Ошибка обработки апдейта %s', update.update_id)
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        '''Перестаёт принимать апдейты и ждёт начатые обработчики'''
+        self._closing = True
+        if not self._tasks:
+            return
+        logger.info('Ожидание %s обработчиков', len(self._tasks))
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning('Прервано обработчиков: %s', len(pending))
+
+
+def create_webhook_app(
+        bot: Bot, dp: Dispatcher, secret: str = WEBHOOK_SECRET,
+        path: str = WEBHOOK_PATH, url: str = WEBHOOK_URL
+        ) -> web.Application:
+    '''
+    aiohttp-приложение webhook. Если задан url, при запуске webhook
+    регистрируется в Telegram; без него сервер можно проверять
+    локально, отправляя записанные апдейты curl'ом
+    '''
+    if not secret:
+        raise RuntimeError('Для режима webhook нужен WEBHOOK_SECRET')
+
+    handler = WebhookHandler(bot, dp, secret)
+    app = web.Application()
+    app['webhook_handler'] = handler
+    app.router.add_post(path, handler.handle)
+
+    async def on_startup(app: web.Application):
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        if url:
+            await bot.set_webhook(
+                url, secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            logger.info('Webhook зарегистрирован: %s', url)
+
+    async def on_shutdown(app: web.Application):
+        # Webhook не удаляется: при перезапуске апдейты копятся
+        # в Telegram и достанутся новому процессу
+        await handler.drain()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+async def run_webhook(
+        bot: Bot, dp: Dispatcher,
+        host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT
+        ):
+    '''Запускает webhook-сервер и работает до SIGINT/SIGTERM'''
+    app = create_webhook_app(bot, dp)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info('Webhook-сервер слушает %s:%s%s', host, port, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info('Остановка webhook-сервера')
+        # Закрывает порт, затем on_shutdown дожидается обработчиков
+        await runner.cleanup()